@@ -0,0 +1,40 @@
+from timeit import timeit
+
+from _game.base.modifiers import Effect
+from _game.base.stats_abilities_and_settings import Abilities
+from _game.base.weapons import Weapons
+from _game.entities.base.action import ActionType, TargetType
+from _game.entities.entities.monsters import PredefinedMonsters
+from _game.mechanics.battle_tracker import Battletracker
+
+
+def bench_actions(effect_counts=(0, 100, 1000, 10000), repeats: int = 200):
+    """
+    Time get_actions + prime_action for entities carrying growing numbers of effects.
+    The cost must not grow with the size of the entities involved.
+    """
+    print("get_actions + prime_action")
+    for effect_count in effect_counts:
+        bt = Battletracker(seed=0)
+        source = bt.add_entity(PredefinedMonsters.TROLL)
+        target = bt.add_entity(PredefinedMonsters.GOBLIN)
+        source.add_weapon(Weapons.get_weapon('Dagger'))
+        bt.place_entity(source, x=0, y=0)
+        bt.place_entity(target, x=1, y=0)
+
+        # Inflate both entities with effects, as a long battle would. Neutral ones, so the rolls stay the same.
+        for entity in (source, target):
+            for number in range(effect_count):
+                entity.add_effect(Effect(stat=Abilities.STRENGTH, value=0, source=f"Effect {number}", stacking=True))
+
+        def run():
+            actions = bt.get_actions(source=source)
+            for action in actions[ActionType.WEAPON_ATTACK_MELEE]:
+                bt.prime_action(action, (TargetType.ENTITY, target.battle_data.entity_id))
+
+        seconds = timeit(run, number=repeats) / repeats
+        print(f"  effects {effect_count:>6}: {seconds * 1e6:8.1f} us")
+
+
+if __name__ == '__main__':
+    bench_actions()
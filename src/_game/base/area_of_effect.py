@@ -0,0 +1,96 @@
+import math
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from _game.base.stats_abilities_and_settings import Abilities, AreaShape, FEET_PER_HEX
+
+
+_SQRT3_2 = math.sqrt(3) / 2
+_EPSILON = 1e-9
+
+
+def to_cartesian(x, y) -> Tuple:
+    """
+    Centre of a HEX_BASE_60 hex in cartesian coordinates, one hex wide. Accepts scalars and arrays.
+    """
+    return x + 0.5 * y, _SQRT3_2 * y
+
+
+@dataclass(frozen=True)
+class AreaOfEffect:
+    """
+    Template of an area attack on the HEX_BASE_60 grid, sizes in feet.
+    A hex is caught if its centre lies inside the template.
+
+    :param shape: CONE and LINE start at the attacker and point towards the aim, BURST is centred on the aim
+    :param size: Length of cones and lines, radius of bursts
+    :param width: Width of lines
+    :param save_ability: Saving throw of caught entities, a success halves the damage.
+        None if every caught entity takes the full damage.
+    """
+    shape: AreaShape
+    size: int
+    width: int = 5
+    save_ability: Optional[Abilities] = None
+
+    def mask(self,
+             origin: Tuple[int, int],
+             aim: Tuple[int, int],
+             xs: np.ndarray,
+             ys: np.ndarray) -> np.ndarray:
+        """
+        Vectorized membership test.
+
+        :param origin: Hex of the attacker
+        :param aim: Hex the attack is aimed at
+        :param xs: x coordinates of the hexes to test
+        :param ys: y coordinates of the hexes to test
+        :return: Boolean mask, True for caught hexes
+        """
+        xs, ys = np.asarray(xs), np.asarray(ys)
+        length = self.size / FEET_PER_HEX
+
+        if self.shape == AreaShape.BURST:
+            dx, dy = xs - aim[0], ys - aim[1]
+            return (np.abs(dx) + np.abs(dy) + np.abs(dx + dy)) // 2 <= length + _EPSILON
+
+        if self.shape not in (AreaShape.CONE, AreaShape.LINE):
+            raise ValueError(f"Area shape {self.shape!r} not supported.")
+
+        ox, oy = to_cartesian(*origin)
+        ax, ay = to_cartesian(*aim)
+        norm = math.hypot(ax - ox, ay - oy)
+        if norm == 0:
+            raise ValueError(f"A {self.shape.name} needs an aim different from its origin.\n"
+                             f"Delivered: origin {origin!r}, aim {aim!r}")
+        ux, uy = (ax - ox) / norm, (ay - oy) / norm
+
+        px, py = to_cartesian(xs, ys)
+        px, py = px - ox, py - oy
+        along = px * ux + py * uy
+        across = np.abs(px * uy - py * ux)
+        dx, dy = xs - origin[0], ys - origin[1]
+        in_reach = (along > _EPSILON) & ((np.abs(dx) + np.abs(dy) + np.abs(dx + dy)) // 2 <= length + _EPSILON)
+
+        if self.shape == AreaShape.CONE:
+            # The apex sits on the edge of the origin hex, so the first hex in front of the attacker is caught.
+            return in_reach & (across <= (along + 0.5) / 2 + _EPSILON)
+        return in_reach & (across <= self.width / FEET_PER_HEX / 2 + _EPSILON)
+
+    def hexes(self, origin: Tuple[int, int], aim: Tuple[int, int]) -> List[Tuple[int, int]]:
+        """
+        All hexes covered by the template.
+        """
+        centre = aim if self.shape == AreaShape.BURST else origin
+        reach = self.size // FEET_PER_HEX
+        dx, dy = np.meshgrid(np.arange(-reach, reach + 1), np.arange(-reach, reach + 1))
+        xs, ys = dx.ravel() + centre[0], dy.ravel() + centre[1]
+        caught = self.mask(origin, aim, xs, ys)
+        return list(zip(xs[caught].tolist(), ys[caught].tolist()))
+
+    def description(self) -> str:
+        return (f"{self.shape.name} {self.size} ft"
+                f"{f' x {self.width} ft' if self.shape == AreaShape.LINE else ''}"
+                f"{f', {self.save_ability.name} save' if self.save_ability is not None else ''}")
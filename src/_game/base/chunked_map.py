@@ -0,0 +1,201 @@
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+# name: (dtype, default value)
+MAP_LAYERS = {
+    "movement_cost": (np.uint8, 1),  # Multiplier on the movement needed to enter a hex, 0 if impassable
+    "wall": (np.bool_, False),  # Blocks movement and line of sight
+    "occupancy": (np.int16, 0),  # Number of entities standing on a hex
+}
+_CHUNK_FILE = re.compile(r"(\w+)\.(-?\d+)\.(-?\d+)\.npy")
+
+
+class ChunkedMap:
+    """
+    Sparse HEX_BASE_60 map made of square chunks of NumPy arrays, one array per layer.
+    Chunks are created on the first write into them, reads outside of existing chunks return the layer default.
+    With a directory the chunks are memory mapped .npy files, so maps larger than memory only load what is used.
+    """
+    def __init__(self, chunk_size: int = 32, directory: Optional[str] = None):
+        if chunk_size < 1:
+            raise ValueError(f"Chunk size must be positive.\n"
+                             f"Delivered: {chunk_size!r}")
+        self.chunk_size = chunk_size
+        self.directory = directory
+        self._chunks: Dict[Tuple[int, int], Dict[str, np.ndarray]] = {}
+        self._on_disk = set()
+        self._wall_count = 0  # Walls in loaded chunks
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            for file_name in os.listdir(directory):
+                match = _CHUNK_FILE.fullmatch(file_name)
+                if match is not None and match.group(1) in MAP_LAYERS:
+                    self._on_disk.add((int(match.group(2)), int(match.group(3))))
+
+    def __contains__(self, chunk: Tuple[int, int]) -> bool:
+        return chunk in self._chunks or chunk in self._on_disk
+
+    @property
+    def chunks(self) -> List[Tuple[int, int]]:
+        return sorted(set(self._chunks) | self._on_disk)
+
+    def _path(self, layer: str, chunk: Tuple[int, int]) -> str:
+        return os.path.join(self.directory, f"{layer}.{chunk[0]}.{chunk[1]}.npy")
+
+    def _chunk(self, chunk: Tuple[int, int], create: bool) -> Optional[Dict[str, np.ndarray]]:
+        arrays = self._chunks.get(chunk)
+        if arrays is not None:
+            return arrays
+        if chunk not in self._on_disk and not create:
+            return None
+
+        shape = (self.chunk_size, self.chunk_size)
+        arrays = {}
+        for layer, (dtype, default) in MAP_LAYERS.items():
+            if self.directory is None:
+                arrays[layer] = np.full(shape, default, dtype=dtype)
+            elif os.path.exists(self._path(layer, chunk)):
+                arrays[layer] = np.lib.format.open_memmap(self._path(layer, chunk), mode="r+")
+            else:
+                arrays[layer] = np.lib.format.open_memmap(self._path(layer, chunk), mode="w+",
+                                                          dtype=dtype, shape=shape)
+                arrays[layer][:] = default
+        self._chunks[chunk] = arrays
+        self._on_disk.discard(chunk)
+        self._wall_count += int(np.count_nonzero(arrays["wall"]))
+        return arrays
+
+    @property
+    def has_walls(self) -> bool:
+        """
+        False only if there is certainly no wall, chunks not yet loaded from disk may hold some.
+        """
+        return self._wall_count > 0 or bool(self._on_disk)
+
+    def chunk_arrays(self, chunk: Tuple[int, int]) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Layer: array of a chunk, None if the chunk does not exist.
+        """
+        return self._chunk(chunk, create=False)
+
+    def put_chunk(self, chunk: Tuple[int, int], arrays: Dict[str, np.ndarray]):
+        """
+        Overwrite the layers of a chunk, e.g. from a snapshot.
+        """
+        target = self._chunk(chunk, create=True)
+        self._wall_count -= int(np.count_nonzero(target["wall"]))
+        for layer, array in arrays.items():
+            target[layer][:] = array
+        self._wall_count += int(np.count_nonzero(target["wall"]))
+
+    def get(self, layer: str, x: int, y: int):
+        chunk_x, local_x = divmod(x, self.chunk_size)
+        chunk_y, local_y = divmod(y, self.chunk_size)
+        arrays = self._chunk((chunk_x, chunk_y), create=False)
+        if arrays is None:
+            return MAP_LAYERS[layer][1]
+        return arrays[layer][local_x, local_y].item()
+
+    def set(self, layer: str, x: int, y: int, value):
+        chunk_x, local_x = divmod(x, self.chunk_size)
+        chunk_y, local_y = divmod(y, self.chunk_size)
+        array = self._chunk((chunk_x, chunk_y), create=True)[layer]
+        if layer == "wall":
+            self._wall_count += bool(value) - bool(array[local_x, local_y])
+        array[local_x, local_y] = value
+
+    def add(self, layer: str, x: int, y: int, value):
+        self.set(layer, x, y, self.get(layer, x, y) + value)
+
+    def get_many(self, layer: str, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """
+        Vectorized get, one fancy index per chunk touched.
+        """
+        xs, ys = np.asarray(xs, dtype=np.int64), np.asarray(ys, dtype=np.int64)
+        dtype, default = MAP_LAYERS[layer]
+        values = np.full(xs.shape, default, dtype=dtype)
+        if xs.size == 0:
+            return values
+
+        chunk_xs, local_xs = np.divmod(xs, self.chunk_size)
+        chunk_ys, local_ys = np.divmod(ys, self.chunk_size)
+        # One integer per chunk, so grouping is a 1-D unique instead of a row-wise one.
+        codes = (chunk_xs << 32) + (chunk_ys & 0xFFFFFFFF)
+        chunk_codes, inverse = np.unique(codes, return_inverse=True)
+        inverse = inverse.reshape(xs.shape)
+        for i, code in enumerate(chunk_codes.tolist()):
+            chunk_x, chunk_y = code >> 32, code & 0xFFFFFFFF
+            chunk_y = chunk_y - (1 << 32) if chunk_y >= 1 << 31 else chunk_y
+            arrays = self._chunk((chunk_x, chunk_y), create=False)
+            if arrays is None:
+                continue
+            selected = inverse == i
+            values[selected] = arrays[layer][local_xs[selected], local_ys[selected]]
+        return values
+
+    def region(self, layer: str, x: int, y: int, width: int, height: int) -> np.ndarray:
+        """
+        Layer values of a rectangle in grid coordinates, indexed [x - x0, y - y0], e.g. for rendering.
+        """
+        dtype, default = MAP_LAYERS[layer]
+        values = np.full((width, height), default, dtype=dtype)
+        size = self.chunk_size
+        for chunk_x in range(x // size, (x + width - 1) // size + 1):
+            for chunk_y in range(y // size, (y + height - 1) // size + 1):
+                arrays = self._chunk((chunk_x, chunk_y), create=False)
+                if arrays is None:
+                    continue
+                # Overlap of the chunk and the rectangle, in grid coordinates.
+                x_start, x_end = max(x, chunk_x * size), min(x + width, (chunk_x + 1) * size)
+                y_start, y_end = max(y, chunk_y * size), min(y + height, (chunk_y + 1) * size)
+                values[x_start - x:x_end - x, y_start - y:y_end - y] = \
+                    arrays[layer][x_start - chunk_x * size:x_end - chunk_x * size,
+                                  y_start - chunk_y * size:y_end - chunk_y * size]
+        return values
+
+    def flush(self):
+        for arrays in self._chunks.values():
+            for array in arrays.values():
+                if isinstance(array, np.memmap):
+                    array.flush()
+
+
+def hex_line(start: Tuple[int, int], end: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Hexes on the straight line from start to end (both included), by rounding interpolated cube coordinates.
+    """
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    steps = (abs(dx) + abs(dy) + abs(dx + dy)) // 2
+    if steps == 0:
+        return np.array([start[0]]), np.array([start[1]])
+
+    # A tiny nudge keeps lines running exactly along hex edges from flipping between both sides.
+    t = np.linspace(0.0, 1.0, steps + 1)
+    qs = start[0] + 1e-6 + dx * t
+    rs = start[1] + 1e-6 + dy * t
+    ss = -qs - rs
+
+    q, r, s = np.round(qs), np.round(rs), np.round(ss)
+    dq, dr, ds = np.abs(q - qs), np.abs(r - rs), np.abs(s - ss)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    q = np.where(fix_q, -r - s, q)
+    r = np.where(fix_r, -q - s, r)
+    return q.astype(np.int64), r.astype(np.int64)
+
+
+def line_of_sight(hex_map: ChunkedMap, start: Tuple[int, int], end: Tuple[int, int]) -> bool:
+    """
+    True if no wall stands between start and end, walls on start and end themselves do not block.
+    """
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    # Checked for every attack, so skip the line drawing if nothing can block it.
+    if not hex_map.has_walls or (abs(dx) + abs(dy) + abs(dx + dy)) // 2 <= 1:
+        return True
+    xs, ys = hex_line(start, end)
+    return not hex_map.get_many("wall", xs[1:-1], ys[1:-1]).any()
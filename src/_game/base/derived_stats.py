@@ -0,0 +1,117 @@
+import heapq
+from collections import defaultdict
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Tuple
+
+
+class StatGraphStructure:
+    """
+    Nodes and edges of a derived stat graph. One structure is shared by every graph built from it,
+    so compute functions must be picklable module level functions.
+    Nodes have to be added after the nodes they depend on.
+    """
+    def __init__(self):
+        self.inputs: List[Hashable] = []
+        self.compute: Dict[Hashable, Tuple[Callable, Tuple[Hashable, ...]]] = {}
+        self.dependents: Dict[Hashable, List[Hashable]] = defaultdict(list)
+        self.order: Dict[Hashable, int] = {}
+
+    def _add(self, key: Hashable):
+        if key in self.order:
+            raise ValueError(f"Node {key!r} already defined.")
+        self.order[key] = len(self.order)
+
+    def add_input(self, key: Hashable):
+        self._add(key)
+        self.inputs.append(key)
+
+    def add_derived(self, key: Hashable, compute: Callable, depends_on: Iterable[Hashable]):
+        depends_on = tuple(depends_on)
+        missing = [d for d in depends_on if d not in self.order]
+        if missing:
+            raise ValueError(f"Node {key!r} depends on undefined nodes {missing!r}.")
+        self._add(key)
+        self.compute[key] = (compute, depends_on)
+        for dependency in depends_on:
+            self.dependents[dependency].append(key)
+
+
+class DerivedStatGraph:
+    """
+    Values of a StatGraphStructure. Changing inputs recomputes only their dependents, in dependency order,
+    and stops wherever a recomputed value did not change.
+    Every change bumps version and the node version of every changed node, for caches to key on.
+    """
+    def __init__(self, structure: StatGraphStructure, inputs: Dict[Hashable, Any]):
+        self.structure = structure
+        self.values: Dict[Hashable, Any] = {}
+        self.node_versions: Dict[Hashable, int] = {}
+        self.version = 0
+
+        for key in structure.inputs:
+            if key not in inputs:
+                raise ValueError(f"Input {key!r} not delivered.")
+        for key in structure.order:
+            if key in structure.compute:
+                compute, depends_on = structure.compute[key]
+                self.values[key] = compute(*[self.values[d] for d in depends_on])
+            else:
+                self.values[key] = inputs[key]
+            self.node_versions[key] = 0
+
+    def get(self, key: Hashable) -> Any:
+        return self.values[key]
+
+    def node_version(self, key: Hashable) -> int:
+        return self.node_versions[key]
+
+    def set(self, key: Hashable, value: Any) -> List[Hashable]:
+        return self.update({key: value})
+
+    def update(self, inputs: Dict[Hashable, Any]) -> List[Hashable]:
+        """
+        Set several inputs at once and propagate the changes.
+
+        :return: Keys of all nodes whose value changed
+        """
+        structure = self.structure
+        changed = []
+        pending = []
+        queued = set()
+        for key, value in inputs.items():
+            if key in structure.compute:
+                raise ValueError(f"Node {key!r} is derived and cannot be set.")
+            if self.values[key] == value:
+                continue
+            self.values[key] = value
+            changed.append(key)
+            for dependent in structure.dependents[key]:
+                if dependent not in queued:
+                    queued.add(dependent)
+                    heapq.heappush(pending, (structure.order[dependent], dependent))
+
+        while pending:
+            _, key = heapq.heappop(pending)
+            compute, depends_on = structure.compute[key]
+            value = compute(*[self.values[d] for d in depends_on])
+            if value == self.values[key]:
+                continue
+            self.values[key] = value
+            changed.append(key)
+            for dependent in structure.dependents[key]:
+                if dependent not in queued:
+                    queued.add(dependent)
+                    heapq.heappush(pending, (structure.order[dependent], dependent))
+
+        if changed:
+            self.version += 1
+            for key in changed:
+                self.node_versions[key] = self.version
+        return changed
+
+    def copy(self) -> 'DerivedStatGraph':
+        graph = object.__new__(DerivedStatGraph)
+        graph.structure = self.structure
+        graph.values = dict(self.values)
+        graph.node_versions = dict(self.node_versions)
+        graph.version = self.version
+        return graph
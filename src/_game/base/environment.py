@@ -1,65 +1,98 @@
 from __future__ import annotations
 
-from typing import Dict, List, Any
+from typing import Dict, Optional, Tuple
 from enum import Enum
-from dataclasses import dataclass, field
 
+import numpy as np
+
+from _game.base.chunked_map import ChunkedMap, MAP_LAYERS, line_of_sight
+from _game.base.item_store import ItemStore
+from _game.base.stats_abilities_and_settings import FEET_PER_HEX
 from _game.base.weapons import BaseWeapon
 
 
+_MAX_MOVEMENT_COST = int(np.iinfo(MAP_LAYERS["movement_cost"][0]).max)
+
+
 class LocationMetric(Enum):
     HEX_BASE_60 = "HexBase60"
 
 
+def _hex_distance(dx: int, dy: int) -> int:
+    # Along both axes or against them the steps add up, otherwise the diagonal hexes cover both at once.
+    if dx < 0 < dy or dy < 0 < dx:
+        return FEET_PER_HEX * max(abs(dx), abs(dy))
+    return FEET_PER_HEX * (abs(dx) + abs(dy))
+
+
 class Location:
+    """
+    Immutable grid position, usable as dictionary key.
+    """
+    __slots__ = ("x", "y", "metric")
+
     def __init__(self, x: int = 0, y: int = 0, metric: LocationMetric = LocationMetric.HEX_BASE_60):
-        self.x = x
-        self.y = y
-        self.metric = metric
+        object.__setattr__(self, "x", x)
+        object.__setattr__(self, "y", y)
+        object.__setattr__(self, "metric", metric)
 
-    def __abs__(self) -> int:
-        if self.metric == LocationMetric.HEX_BASE_60:
-            if self.x < 0 < self.y or self.y < 0 < self.x:
-                return 5 * (min(abs(self.x + self.y), abs(self.x - self.y)) + min(abs(self.x), abs(self.y)))
-            else:
-                return 5 * (abs(self.x) + abs(self.y))
-        else:
-            raise ValueError(f"Metric {self.metric!r} not supported for operator 'abs'.")
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{self.__class__.__name__} is immutable, create a new one instead.")
 
-    def __add__(self, other: Location) -> Location:
-        if not self.metric == other.metric:
-            raise ValueError(f"Cannot add {self.__class__.__name__} of different metrics.\n"
-                             f"Delivered metrics: {self.metric!r} and {other.metric!r}")
+    def __delattr__(self, name):
+        raise AttributeError(f"{self.__class__.__name__} is immutable, create a new one instead.")
 
-        if self.metric == LocationMetric.HEX_BASE_60:
-            new_loc = Location(
-                x=self.x + other.x,
-                y=self.y + other.y,
-                metric=self.metric
-            )
-            return new_loc
-        else:
-            raise ValueError(f"Metric {self.metric!r} not supported for operator '+'.")
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Location):
+            return NotImplemented
+        return self.x == other.x and self.y == other.y and self.metric is other.metric
 
-    def __sub__(self, other: Location) -> Location:
-        if not self.metric == other.metric:
-            raise ValueError(f"Cannot add {self.__class__.__name__} of different metrics.\n"
+    def __hash__(self) -> int:
+        return hash((self.x, self.y, self.metric))
+
+    def __reduce__(self):
+        return Location, (self.x, self.y, self.metric)
+
+    def __copy__(self) -> Location:
+        return self
+
+    def __deepcopy__(self, memo) -> Location:
+        return self
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(x={self.x}, y={self.y}, metric={self.metric.name})"
+
+    def __str__(self) -> str:
+        return f"x({self.x}), y({self.y})"
+
+    def _check_metric(self, other: Location, operator: str):
+        if self.metric is not other.metric:
+            raise ValueError(f"Cannot apply {operator!r} to {self.__class__.__name__}s of different metrics.\n"
                              f"Delivered metrics: {self.metric!r} and {other.metric!r}")
+        if self.metric is not LocationMetric.HEX_BASE_60:
+            raise ValueError(f"Metric {self.metric!r} not supported for operator {operator!r}.\n"
+                             f"Supported: {LocationMetric.HEX_BASE_60!r}")
 
-        if self.metric == LocationMetric.HEX_BASE_60:
-            new_loc = Location(
-                x=self.x - other.x,
-                y=self.y - other.y,
-                metric=self.metric
-            )
-            return new_loc
+    def distance(self, other: Location) -> int:
+        """
+        Distance in feet, same as abs(self - other) without creating the difference.
+        """
+        self._check_metric(other, "distance")
+        return _hex_distance(self.x - other.x, self.y - other.y)
+
+    def __abs__(self) -> int:
+        if self.metric is LocationMetric.HEX_BASE_60:
+            return _hex_distance(self.x, self.y)
         else:
-            raise ValueError(f"Metric {self.metric} (type {type(LocationMetric.HEX_BASE_60)}) "
-                             f"not supported for operator '-'.\n"
-                             f"Supported: {LocationMetric.HEX_BASE_60} (type {type(LocationMetric.HEX_BASE_60)})")
+            raise ValueError(f"Metric {self.metric!r} not supported for operator 'abs'.")
 
-    def key(self) -> str:
-        return f"x({self.x}), y({self.y}), metric({self.metric.name})"
+    def __add__(self, other: Location) -> Location:
+        self._check_metric(other, "+")
+        return Location(x=self.x + other.x, y=self.y + other.y, metric=self.metric)
+
+    def __sub__(self, other: Location) -> Location:
+        self._check_metric(other, "-")
+        return Location(x=self.x - other.x, y=self.y - other.y, metric=self.metric)
 
     def description(self):
         if self.metric == LocationMetric.HEX_BASE_60:
@@ -85,67 +118,83 @@ class Location:
         return html
 
 
-@dataclass
-class EnvironmentSquare:
-    location: Location = None
-    weapons: List[BaseWeapon] = field(default_factory=list)
-    undefined: List[Any] = field(default_factory=list)
-
 class Environment:
-    def __init__(self):
-        self._environment: Dict[str, EnvironmentSquare] = {}
-        self._default: EnvironmentSquare = EnvironmentSquare()
-
-    def get_environment_square(self, location: Location = None):
-        if location is None:
-            return self._default
-        elif location.key() in self._environment:
-            return self._environment[location.key()]
-        else:
-            self._environment[location.key()] = EnvironmentSquare(location=location)
-            return self._environment[location.key()]
+    def __init__(self, hex_map: Optional[ChunkedMap] = None):
+        # Dropped items live in the item store, terrain, walls and occupancy in NumPy chunks of the map.
+        self.items: ItemStore = ItemStore()
+        self.map: ChunkedMap = hex_map if hex_map is not None else ChunkedMap()
+        self._spotted_weapons: Tuple[int, Dict[str, Tuple[Optional[Location], str, int]]] = (-1, {})
+
+    def set_movement_cost(self, location: Location, movement_cost: Optional[int]):
+        if movement_cost is not None and movement_cost < 1:
+            raise ValueError(f"Movement cost must be at least 1 or None for impassable squares.\n"
+                             f"Delivered: {movement_cost!r}")
+        if movement_cost is not None and movement_cost > _MAX_MOVEMENT_COST:
+            raise ValueError(f"Movement cost must be at most {_MAX_MOVEMENT_COST}.\n"
+                             f"Delivered: {movement_cost!r}")
+        self.map.set("movement_cost", location.x, location.y, 0 if movement_cost is None else movement_cost)
+
+    def movement_cost(self, x: int, y: int) -> Optional[int]:
+        """
+        Multiplier on the movement needed to enter the square (2 for difficult terrain), None if impassable.
+        """
+        if self.map.get("wall", x, y):
+            return None
+        return self.map.get("movement_cost", x, y) or None
 
-    def add_drop(self, drop, location: Location = None):
-        env = self.get_environment_square(location)
-        if drop is None:
-            return
+    def set_wall(self, location: Location, wall: bool):
+        self.map.set("wall", location.x, location.y, wall)
 
-        if isinstance(drop, BaseWeapon):
-            env.weapons.append(drop)
-        else:
-            env.undefined.append(drop)
-
-    def spot_weapons(self) -> Dict[str, str]:
-        weapons_def = {w.description_short: [None, w.name]
-                   for w in self._default.weapons}
-        weapons_sqr = {w.description_short: [loc, w.name]
-                   for loc, square in self._environment.items()
-                   for w in square.weapons}
-        weapons_def.update(weapons_sqr)
-        return weapons_def
+    def is_wall(self, x: int, y: int) -> bool:
+        return bool(self.map.get("wall", x, y))
 
-    def pick_up_weapon(self, weapons_def) -> BaseWeapon:
-        loc, weapon = weapons_def
+    def line_of_sight(self, start: Location, end: Location) -> bool:
+        return line_of_sight(self.map, (start.x, start.y), (end.x, end.y))
 
-        if loc is None:
-            location = self._default
-        elif loc in self._environment:
-            location = self._environment[loc]
-
-        weapons = location.weapons
+    def move_occupant(self, old: Optional[Tuple[int, int]], new: Optional[Tuple[int, int]]):
+        """
+        Keep the occupancy layer in sync with an entity moving between hexes, None for entering or leaving the map.
+        """
+        if old == new:
+            return
+        if old is not None:
+            self.map.add("occupancy", *old, -1)
+        if new is not None:
+            self.map.add("occupancy", *new, 1)
 
-        remaining_weapons = []
-        pick_up = None
-        pick_up_done = False
-        for w in weapons:
-            if weapon == w.name and not pick_up_done:
-                pick_up = w
-                pick_up_done = True
-            else:
-                remaining_weapons.append(w)
+    def add_drop(self, drop, location: Location = None) -> Optional[int]:
+        """
+        :return: Item ID of the drop, None if nothing was dropped
+        """
+        if drop is None:
+            return None
+        return self.items.add(drop, location)
 
-        location.weapons = remaining_weapons
+    def spot_weapons(self) -> Dict[str, Tuple[Optional[Location], str, int]]:
+        """
+        Description: (location, weapon name, item ID) of every weapon lying around.
+        Rebuilt only after items were added or removed.
+        """
+        version, weapons_def = self._spotted_weapons
+        if version != self.items.version:
+            weapons_def = {f"{w.description_short} at {'no location' if loc is None else loc} (#{item_id})":
+                               (loc, w.name, item_id)
+                           for item_id, loc, w in self.items if isinstance(w, BaseWeapon)}
+            self._spotted_weapons = (self.items.version, weapons_def)
+        return weapons_def
 
-        return pick_up
+    def nearest_weapon(self, location: Location, name: str, max_feet: Optional[int] = None) -> Optional[int]:
+        """
+        Item ID of the closest weapon with the given name, None if there is none.
+        """
+        return self.items.nearest(location, name, max_feet=max_feet)
 
+    def pick_up_weapon(self, weapons_def) -> Optional[BaseWeapon]:
+        loc, weapon, item_id = weapons_def
 
+        if item_id not in self.items:
+            return None
+        if self.items.location(item_id) != loc or self.items.get(item_id).name != weapon:
+            raise ValueError(f"Item {item_id} is not a {weapon} at location {loc}.\n"
+                             f"Delivered: {weapons_def!r}")
+        return self.items.remove(item_id)
@@ -1,7 +1,11 @@
 import random
+import re
 from dataclasses import dataclass, field
 from collections import defaultdict
-from typing import Dict
+from functools import lru_cache
+from typing import Dict, Tuple, List, Optional
+
+import numpy as np
 
 
 @dataclass
@@ -20,46 +24,165 @@ class RollInfo:
         return ret
 
 
-def roll_dice(dice_notation: str, double_dice: bool = False) -> RollInfo:
-    # Regular expression to match each part of the dice roll (including multiple dice rolls and modifiers)
+@dataclass(frozen=True)
+class DicePlan:
+    """
+    Compiled form of a dice notation.
 
-    roll = RollInfo()
-    roll.dice_notation = dice_notation
+    :param dice_notation: Notation the plan was compiled from
+    :param dice: Dice terms as (count, sides, sign), e.g. "2d6" -> (2, 6, 1)
+    :param modifier: Sum of all flat modifiers
+    """
+    dice_notation: str
+    dice: Tuple[Tuple[int, int, int], ...] = ()
+    modifier: int = 0
+
+
+# Whitespace is only allowed before a term and between its sign and the term, never inside the term.
+_DICE_TERM = re.compile(r"\s*([+-]?)\s*(?:(\d*)d(\d+)|(\d+))")
+
+
+@lru_cache(maxsize=1024)
+def compile_dice_notation(dice_notation: str) -> DicePlan:
+    """
+    Compile a dice notation like "1d8 + 3", "10", "d10" or "6d8 + 2d6 - 1" into a reusable DicePlan.
+    Plans are kept in a bounded LRU cache, so every notation is parsed only once.
+
+    :param dice_notation: Dice rolls in Format "1d8 + 3", empty notations roll 0
+    :return: Compiled DicePlan
+    """
+    end = len(dice_notation.rstrip())
 
-    to_handle = ""
-    to_roll = ""
-    while dice_notation:
-        dice_notation.strip()
+    dice = []
+    modifier = 0
+    position = 0
+    while position < end:
+        # Every term after the first needs its sign, "3d6 2" is no "3d62".
+        term = _DICE_TERM.match(dice_notation, position)
+        if term is None or (position and not term.group(1)):
+            raise ValueError(f"Cannot parse dice notation {dice_notation!r} at position {position}.\n"
+                             f"Supported Format: \"1d8 + 3\", \"10\", \"d10\" or \"6d8\"")
+        sign, count, sides, flat = term.groups()
+        sign = -1 if sign == "-" else 1
+        if flat is not None:
+            modifier += sign * int(flat)
+        else:
+            if int(sides) < 1:
+                raise ValueError(f"Dice need at least one side.\n"
+                                 f"Delivered: {dice_notation!r}")
+            dice.append((int(count) if count else 1, int(sides), sign))
+        position = term.end()
 
-        pre_string = dice_notation[0]
-        dice_notation = dice_notation[1:]
+    return DicePlan(dice_notation=dice_notation, dice=tuple(dice), modifier=modifier)
 
-        if pre_string.isdigit():
-            to_handle += pre_string
-        elif pre_string == "d":
-            to_roll = to_handle if to_handle else 1
-            to_handle = ""
 
-        if pre_string == "+" or not dice_notation:
-            if to_roll:
+class BattleRng:
+    """
+    Seeded source of independent random streams.
+    Every stream key yields the same random.Random on every call, so rolls can be replayed from the seed alone.
+    Spawned children are independent of their parent and each other, e.g. for parallel workers.
 
-                num_dice = int(to_roll) if not double_dice else 2 * int(to_roll)
-                dice = int(to_handle)
+    :param seed: Entropy of the root seed, a fresh one is drawn if None
+    :param spawn_key: Path of spawn indices from the root
+    """
+    _STREAM = 0
+    _SPAWN = 1
 
-                rolls = [random.randint(1, dice) for _ in range(num_dice)]
-                roll.total_roll += sum(rolls)
-                roll.all_rolls[dice] += rolls
+    def __init__(self, seed: Optional[int] = None, spawn_key: Tuple[int, ...] = ()):
+        self.seed = np.random.SeedSequence(seed).entropy
+        self.spawn_key = tuple(spawn_key)
 
-            else:
-                modifier = int(to_handle)
+    def _state(self, *key: int) -> np.ndarray:
+        return np.random.SeedSequence(self.seed, spawn_key=self.spawn_key + key).generate_state(4)
 
-                roll.total_roll += modifier
+    def stream(self, key: int) -> random.Random:
+        return random.Random(int.from_bytes(self._state(self._STREAM, key).tobytes(), "little"))
 
-            to_roll = ""
-            to_handle = ""
+    def numpy_stream(self, key: int) -> np.random.Generator:
+        return np.random.default_rng(self._state(self._STREAM, key))
+
+    def spawn(self, n: int) -> List['BattleRng']:
+        return [BattleRng(self.seed, self.spawn_key + (self._SPAWN, i)) for i in range(n)]
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(seed={self.seed}, spawn_key={self.spawn_key})"
+
+
+def roll_dice_plan(plan: DicePlan, double_dice: bool = False, rng: Optional[random.Random] = None) -> RollInfo:
+    randint = rng.randint if rng is not None else random.randint
+
+    roll = RollInfo()
+    roll.dice_notation = plan.dice_notation
+
+    total = plan.modifier
+    for count, sides, sign in plan.dice:
+        num_dice = count if not double_dice else 2 * count
+
+        rolls = [randint(1, sides) for _ in range(num_dice)]
+        total += sign * sum(rolls)
+        roll.all_rolls[sides] += rolls
+    roll.total_roll = total
+
+    return roll
+
+
+def roll_dice(dice_notation: str, double_dice: bool = False, rng: Optional[random.Random] = None) -> RollInfo:
+    return roll_dice_plan(compile_dice_notation(dice_notation), double_dice=double_dice, rng=rng)
+
+@dataclass
+class BatchRollInfo:
+    total_rolls: np.ndarray = None
+    dice_notation: str = None
+    # (sides, sign, rolls) per dice term in the order of the notation, e.g. "2d6 - 1d6" keeps the d6 terms apart
+    all_rolls: List[Tuple[int, int, np.ndarray]] = field(default_factory=list)
+
+    def description(self) -> str:
+        if not len(self.total_rolls):
+            return f"Rolled: {self.dice_notation} x0"
+        return (f"Rolled: {self.dice_notation} x{len(self.total_rolls)}, "
+                f"Mean: {self.total_rolls.mean():.2f}, "
+                f"Min: {self.total_rolls.min()}, "
+                f"Max: {self.total_rolls.max()}")
+
+
+_batch_rng = np.random.default_rng()
+
+
+def roll_dice_batch(dice_notation: str,
+                    n: int,
+                    double_dice: bool = False,
+                    keep_rolls: bool = False,
+                    rng: Optional[np.random.Generator] = None) -> BatchRollInfo:
+    """
+    Roll a dice notation n times in one vectorized pass.
+
+    :param dice_notation: Dice rolls in Format "1d8 + 3" or "10" or "d10" or "6d8"
+    :param n: Number of independent rolls
+    :param double_dice: Double the number of dice (critical hits)
+    :param keep_rolls: Keep the single dice per roll in all_rolls, one (sides, sign, rolls) per dice term
+        with rolls of shape (n, number of dice), so the totals are the modifier plus the signed sums
+    :param rng: Generator to roll with, e.g. BattleRng.numpy_stream
+    :return: BatchRollInfo with one total per roll in total_rolls
+    """
+    if n < 0:
+        raise ValueError(f"Number of rolls must not be negative. Delivered: {n}")
+    plan = compile_dice_notation(dice_notation)
+    rng = rng if rng is not None else _batch_rng
+
+    roll = BatchRollInfo(dice_notation=dice_notation)
+    totals = np.full(n, plan.modifier, dtype=np.int64)
+    for count, sides, sign in plan.dice:
+        num_dice = count if not double_dice else 2 * count
+
+        rolls = rng.integers(1, sides, size=(n, num_dice), endpoint=True)
+        totals += sign * rolls.sum(axis=1)
+        if keep_rolls:
+            roll.all_rolls.append((sides, sign, rolls))
+    roll.total_rolls = totals
 
     return roll
 
+
 def empty_set_or_set_of_dataclasses(variable) -> set:
     if variable is None:
         return set()
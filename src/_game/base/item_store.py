@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Iterator, List, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from _game.base.environment import Location
+
+
+def item_type(item: Any) -> str:
+    """
+    Index key of an item, the name for named items (e.g. weapons), the class name otherwise.
+    """
+    return getattr(item, "name", None) or item.__class__.__name__
+
+
+class ItemStore:
+    """
+    Items lying around, each under an ID that stays valid until it is removed and is never reused.
+    Adding and removing is O(1), items are indexed by location and by item_type.
+    Items with location None lie somewhere off the grid.
+    """
+    def __init__(self):
+        self._next_id = 0
+        self._items: Dict[int, Tuple[Optional[Location], Any]] = {}
+        # Dicts of ID: None serve as insertion ordered sets.
+        self._by_location: Dict[Optional[Location], Dict[int, None]] = {}
+        self._by_type: Dict[str, Dict[int, None]] = {}
+        self.version = 0
+
+    @classmethod
+    def from_items(cls, items: List[Tuple[int, Optional[Location], Any]], next_id: int) -> 'ItemStore':
+        """
+        Rebuild a store with the given item IDs, e.g. from a snapshot.
+        """
+        store = cls()
+        for item_id, location, item in items:
+            store._next_id = item_id
+            store.add(item, location)
+        store._next_id = next_id
+        return store
+
+    @property
+    def next_id(self) -> int:
+        return self._next_id
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, item_id: int) -> bool:
+        return item_id in self._items
+
+    def __iter__(self) -> Iterator[Tuple[int, Optional[Location], Any]]:
+        for item_id, (location, item) in self._items.items():
+            yield item_id, location, item
+
+    def add(self, item: Any, location: Optional[Location] = None) -> int:
+        item_id = self._next_id
+        self._next_id += 1
+        self._items[item_id] = (location, item)
+        self._by_location.setdefault(location, {})[item_id] = None
+        self._by_type.setdefault(item_type(item), {})[item_id] = None
+        self.version += 1
+        return item_id
+
+    def remove(self, item_id: int) -> Any:
+        if item_id not in self._items:
+            raise ValueError(f"No item with ID {item_id!r} in the store.")
+        location, item = self._items.pop(item_id)
+        for index, key in ((self._by_location, location), (self._by_type, item_type(item))):
+            ids = index[key]
+            del ids[item_id]
+            if not ids:
+                del index[key]
+        self.version += 1
+        return item
+
+    def get(self, item_id: int) -> Any:
+        return self._items[item_id][1]
+
+    def location(self, item_id: int) -> Optional[Location]:
+        return self._items[item_id][0]
+
+    def at(self, location: Optional[Location]) -> List[Tuple[int, Any]]:
+        return [(item_id, self._items[item_id][1]) for item_id in self._by_location.get(location, ())]
+
+    def of_type(self, name: str) -> List[int]:
+        return list(self._by_type.get(name, ()))
+
+    @property
+    def locations(self) -> List[Optional[Location]]:
+        return list(self._by_location)
+
+    def nearest(self, location: Location, name: str, max_feet: Optional[int] = None) -> Optional[int]:
+        """
+        ID of the closest item of the given item_type on the grid, ties are broken by the lowest ID.
+        Only items of that type are looked at.
+        """
+        best = None
+        for item_id in self._by_type.get(name, ()):
+            item_location = self._items[item_id][0]
+            if item_location is None:
+                continue
+            distance = location.distance(item_location)
+            if max_feet is not None and distance > max_feet:
+                continue
+            if best is None or (distance, item_id) < best:
+                best = (distance, item_id)
+        return best[1] if best is not None else None
@@ -0,0 +1,148 @@
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Hashable, Optional, Tuple, Union
+
+from _game.base.stats_abilities_and_settings import Abilities, DamageType, EffectStat
+
+
+_DAMAGE_TYPE_STATS = {EffectStat.DAMAGE_RESISTANCE, EffectStat.DAMAGE_IMMUNITY}
+_FLAG_STATS = {EffectStat.ADVANTAGE, EffectStat.DISADVANTAGE}
+
+
+@dataclass(frozen=True)
+class Effect:
+    """
+    Buff or debuff on a single stat.
+
+    :param stat: Ability score or EffectStat to modify
+    :param value: Bonus (negative for penalties) on ability scores, AC and speed,
+        the DamageType for DAMAGE_RESISTANCE / DAMAGE_IMMUNITY, ignored for ADVANTAGE / DISADVANTAGE
+    :param source: Spell, item or feature causing the effect
+    :param stacking: Non stacking effects of the same source and stat do not add up, only the highest counts
+    :param expires_round: Battletracker round number the effect ends in, None for no expiry
+    :param expires_turn: Turn of expires_round the effect ends at, i.e. at the start of that turn
+    """
+    stat: Union[Abilities, EffectStat]
+    value: Union[int, DamageType, None] = None
+    source: str = ""
+    stacking: bool = False
+    expires_round: Optional[int] = None
+    expires_turn: int = 0
+
+    @property
+    def expires(self) -> Optional[Tuple[int, int]]:
+        return None if self.expires_round is None else (self.expires_round, self.expires_turn)
+
+    def description(self) -> str:
+        value = self.value.name if isinstance(self.value, DamageType) else \
+            f"{self.value:+}" if isinstance(self.value, int) else ""
+        return (f"{self.stat.name} {value}{' ' if value else ''}({self.source or 'no source'}"
+                f"{', stacking' if self.stacking else ''}"
+                f"{f', until round {self.expires_round} turn {self.expires_turn}' if self.expires is not None else ''})")
+
+
+class ModifierStack:
+    """
+    Active effects of an entity with their aggregates kept up to date on every add and remove,
+    so reading the effective modifier of a stat never scans the effects.
+    """
+    def __init__(self):
+        self.effects: Dict[int, Effect] = {}
+        self._next_effect_id = 0
+
+        # Numeric stats: sum of stacking effects + sum over sources of the highest non stacking value
+        self._stacking_total: Dict[Hashable, int] = defaultdict(int)
+        self._source_values: Dict[Tuple[Hashable, str], Counter] = defaultdict(Counter)
+        self._non_stacking_total: Dict[Hashable, int] = defaultdict(int)
+        # Damage types and flags: number of effects granting them
+        self._counts: Counter = Counter()
+        self._damage_types: Dict[EffectStat, FrozenSet[DamageType]] = {stat: frozenset() for stat in _DAMAGE_TYPE_STATS}
+
+    def __len__(self) -> int:
+        return len(self.effects)
+
+    @classmethod
+    def from_effects(cls, effects: Dict[int, Effect], next_effect_id: int) -> 'ModifierStack':
+        """
+        Rebuild a stack with the given effect IDs, e.g. from a snapshot.
+        """
+        stack = cls()
+        for effect in effects.values():
+            stack._apply(effect, 1)
+        stack.effects = dict(effects)
+        stack._next_effect_id = next_effect_id
+        return stack
+
+    @property
+    def next_effect_id(self) -> int:
+        return self._next_effect_id
+
+    def copy(self) -> 'ModifierStack':
+        return ModifierStack.from_effects(self.effects, self._next_effect_id)
+
+    def total(self, stat: Union[Abilities, EffectStat]) -> int:
+        return self._stacking_total.get(stat, 0) + self._non_stacking_total.get(stat, 0)
+
+    def damage_types(self, stat: EffectStat) -> FrozenSet[DamageType]:
+        return self._damage_types[stat]
+
+    def active(self, stat: EffectStat) -> bool:
+        return self._counts[stat] > 0
+
+    def add(self, effect: Effect) -> Tuple[int, bool]:
+        """
+        :return: ID of the effect and whether the aggregate of its stat changed
+        """
+        if effect.stat in _DAMAGE_TYPE_STATS:
+            if not isinstance(effect.value, DamageType):
+                raise ValueError(f"Effects on {effect.stat.name} need a DamageType as value.\n"
+                                 f"Delivered: {effect.value!r}")
+        elif effect.stat not in _FLAG_STATS and not isinstance(effect.value, int):
+            raise ValueError(f"Effects on {effect.stat.name} need an integer value.\n"
+                             f"Delivered: {effect.value!r}")
+
+        effect_id = self._next_effect_id
+        self._next_effect_id += 1
+        self.effects[effect_id] = effect
+        return effect_id, self._apply(effect, 1)
+
+    def remove(self, effect_id: int) -> Tuple[Effect, bool]:
+        """
+        :return: The removed effect and whether the aggregate of its stat changed
+        """
+        if effect_id not in self.effects:
+            raise ValueError(f"Effect ID {effect_id} not active.\n"
+                             f"Active: {list(self.effects)!r}")
+        effect = self.effects.pop(effect_id)
+        return effect, self._apply(effect, -1)
+
+    def _apply(self, effect: Effect, sign: int) -> bool:
+        stat = effect.stat
+        if stat in _FLAG_STATS:
+            self._counts[stat] += sign
+            return self._counts[stat] == (1 if sign > 0 else 0)
+
+        if stat in _DAMAGE_TYPE_STATS:
+            self._counts[(stat, effect.value)] += sign
+            if self._counts[(stat, effect.value)] != (1 if sign > 0 else 0):
+                return False
+            if sign > 0:
+                self._damage_types[stat] = self._damage_types[stat] | {effect.value}
+            else:
+                self._damage_types[stat] = self._damage_types[stat] - {effect.value}
+            return True
+
+        if effect.stacking:
+            self._stacking_total[stat] += sign * effect.value
+            return effect.value != 0
+
+        values = self._source_values[(stat, effect.source)]
+        before = max(values) if values else 0
+        values[effect.value] += sign
+        if values[effect.value] == 0:
+            del values[effect.value]
+        after = max(values) if values else 0
+        if not values:
+            del self._source_values[(stat, effect.source)]
+        self._non_stacking_total[stat] += after - before
+        return after != before
@@ -0,0 +1,145 @@
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+
+from _game.base.functionality import compile_dice_notation
+
+# Above this support length convolutions are done via FFT instead of direct summation.
+FFT_THRESHOLD = 256
+
+
+@dataclass(frozen=True, eq=False)
+class DiceDistribution:
+    """
+    Exact probability mass function of a dice notation.
+
+    :param dice_notation: Notation the distribution was computed for
+    :param double_dice: Whether the number of dice was doubled (critical hits)
+    :param offset: Lowest possible total, pmf[0] is the probability of rolling it
+    :param pmf: Probabilities of the totals offset, offset + 1, ...
+    """
+    dice_notation: str
+    double_dice: bool
+    offset: int
+    pmf: np.ndarray
+
+    @property
+    def totals(self) -> np.ndarray:
+        return np.arange(self.offset, self.offset + len(self.pmf))
+
+    @property
+    def minimum(self) -> int:
+        return self.offset
+
+    @property
+    def maximum(self) -> int:
+        return self.offset + len(self.pmf) - 1
+
+    @property
+    def mean(self) -> float:
+        return float(np.dot(self.totals, self.pmf))
+
+    @property
+    def variance(self) -> float:
+        deviation = self.totals - self.mean
+        return float(np.dot(deviation * deviation, self.pmf))
+
+    @property
+    def standard_deviation(self) -> float:
+        return self.variance ** 0.5
+
+    def probability(self, total: int) -> float:
+        index = total - self.offset
+        if 0 <= index < len(self.pmf):
+            return float(self.pmf[index])
+        return 0.0
+
+    def probability_at_least(self, total: int) -> float:
+        index = total - self.offset
+        if index <= 0:
+            return 1.0
+        if index >= len(self.pmf):
+            return 0.0
+        return float(min(1.0, self.pmf[index:].sum()))
+
+    def percentile(self, q: float) -> int:
+        """
+        Smallest total t with P(total <= t) >= q / 100.
+        """
+        if not 0 <= q <= 100:
+            raise ValueError(f"Percentile must be within [0, 100]. Delivered: {q}")
+        cdf = np.cumsum(self.pmf)
+        index = int(np.searchsorted(cdf, q / 100 - 1e-12))
+        return self.offset + min(index, len(self.pmf) - 1)
+
+    def description(self) -> str:
+        return (f"Exact: {self.dice_notation}{' (doubled dice)' if self.double_dice else ''}, "
+                f"Mean: {self.mean:.2f}, "
+                f"Std: {self.standard_deviation:.2f}, "
+                f"Range: {self.minimum} - {self.maximum}, "
+                f"Median: {self.percentile(50)}")
+
+
+def _convolve(pmf_a: np.ndarray, pmf_b: np.ndarray) -> np.ndarray:
+    size = len(pmf_a) + len(pmf_b) - 1
+    if min(len(pmf_a), len(pmf_b)) < 2 or size <= FFT_THRESHOLD:
+        return np.convolve(pmf_a, pmf_b)
+
+    pmf = np.fft.irfft(np.fft.rfft(pmf_a, size) * np.fft.rfft(pmf_b, size), size)
+    return _clean(pmf)
+
+
+def _clean(pmf: np.ndarray) -> np.ndarray:
+    # FFT results carry round off noise of ~1e-16, which must not turn into negative probabilities.
+    pmf = np.clip(pmf, 0.0, None)
+    return pmf / pmf.sum()
+
+
+@lru_cache(maxsize=256)
+def _dice_pool_pmf(count: int, sides: int) -> np.ndarray:
+    """
+    PMF of the sum of count dice with the given sides, offset by count (the lowest total).
+    """
+    if count == 0:
+        return np.ones(1)
+
+    die = np.full(sides, 1 / sides)
+    size = count * (sides - 1) + 1
+    if size > FFT_THRESHOLD:
+        pmf = _clean(np.fft.irfft(np.fft.rfft(die, size) ** count, size))
+    else:
+        pmf = np.ones(1)
+        for _ in range(count):
+            pmf = np.convolve(pmf, die)
+    pmf.setflags(write=False)
+    return pmf
+
+
+@lru_cache(maxsize=1024)
+def get_dice_distribution(dice_notation: str, double_dice: bool = False) -> DiceDistribution:
+    """
+    Exact distribution of any notation roll_dice accepts. Results are memoized per notation.
+
+    :param dice_notation: Dice rolls in Format "1d8 + 3" or "10" or "d10" or "6d8"
+    :param double_dice: Double the number of dice (critical hits)
+    :return: DiceDistribution of the total roll
+    """
+    plan = compile_dice_notation(dice_notation)
+
+    offset = plan.modifier
+    pmf = np.ones(1)
+    for count, sides, sign in plan.dice:
+        num_dice = count if not double_dice else 2 * count
+
+        pool = _dice_pool_pmf(num_dice, sides)
+        if sign > 0:
+            offset += num_dice
+        else:
+            pool = pool[::-1]
+            offset -= num_dice * sides
+        pmf = _convolve(pmf, pool)
+
+    pmf = np.array(pmf)
+    pmf.setflags(write=False)
+    return DiceDistribution(dice_notation=dice_notation, double_dice=double_dice, offset=offset, pmf=pmf)
@@ -3,6 +3,10 @@ from typing import Optional
 from dataclasses import dataclass
 
 
+# Grid size of the hex based battle map
+FEET_PER_HEX = 5
+
+
 class CharacterType(Enum):
     PLAYER = auto()
     ENEMY = auto()
@@ -51,27 +55,29 @@ class Skills(Enum):
     SURVIVAL = auto()
 
     def get_ability(self) -> Abilities:
-        skill_to_ability = {
-            Skills.ACROBATICS: Abilities.DEXTERITY,
-            Skills.ANIMAL_HANDLING: Abilities.DEXTERITY,
-            Skills.ARCANA: Abilities.INTELLIGENCE,
-            Skills.ATHLETICS: Abilities.STRENGTH,
-            Skills.DECEPTION: Abilities.CHARISMA,
-            Skills.HISTORY: Abilities.INTELLIGENCE,
-            Skills.INSIGHT: Abilities.WISDOM,
-            Skills.INTIMIDATION: Abilities.CHARISMA,
-            Skills.INVESTIGATION: Abilities.INTELLIGENCE,
-            Skills.MEDICINE: Abilities.WISDOM,
-            Skills.NATURE: Abilities.INTELLIGENCE,
-            Skills.PERCEPTION: Abilities.WISDOM,
-            Skills.PERFORMANCE: Abilities.CHARISMA,
-            Skills.PERSUASION: Abilities.CHARISMA,
-            Skills.RELIGION: Abilities.INTELLIGENCE,
-            Skills.SLEIGHT_OF_HAND: Abilities.DEXTERITY,
-            Skills.STEALTH: Abilities.DEXTERITY,
-            Skills.SURVIVAL: Abilities.WISDOM
-        }
-        return skill_to_ability[self]
+        return _SKILL_TO_ABILITY[self]
+
+
+_SKILL_TO_ABILITY = {
+    Skills.ACROBATICS: Abilities.DEXTERITY,
+    Skills.ANIMAL_HANDLING: Abilities.DEXTERITY,
+    Skills.ARCANA: Abilities.INTELLIGENCE,
+    Skills.ATHLETICS: Abilities.STRENGTH,
+    Skills.DECEPTION: Abilities.CHARISMA,
+    Skills.HISTORY: Abilities.INTELLIGENCE,
+    Skills.INSIGHT: Abilities.WISDOM,
+    Skills.INTIMIDATION: Abilities.CHARISMA,
+    Skills.INVESTIGATION: Abilities.INTELLIGENCE,
+    Skills.MEDICINE: Abilities.WISDOM,
+    Skills.NATURE: Abilities.INTELLIGENCE,
+    Skills.PERCEPTION: Abilities.WISDOM,
+    Skills.PERFORMANCE: Abilities.CHARISMA,
+    Skills.PERSUASION: Abilities.CHARISMA,
+    Skills.RELIGION: Abilities.INTELLIGENCE,
+    Skills.SLEIGHT_OF_HAND: Abilities.DEXTERITY,
+    Skills.STEALTH: Abilities.DEXTERITY,
+    Skills.SURVIVAL: Abilities.WISDOM
+}
 
 @dataclass
 class AbilityScoreTracker:
@@ -107,3 +113,17 @@ class Size(Enum):
     LARGE = auto()
     HUGE = auto()
     GARGANTUAN = auto()
+
+class EffectStat(Enum):
+    # Stats an Effect can modify besides the ability scores.
+    ARMOR_CLASS = auto()
+    SPEED = auto()
+    DAMAGE_RESISTANCE = auto()
+    DAMAGE_IMMUNITY = auto()
+    ADVANTAGE = auto()
+    DISADVANTAGE = auto()
+
+class AreaShape(Enum):
+    CONE = auto()
+    LINE = auto()
+    BURST = auto()
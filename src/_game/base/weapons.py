@@ -1,8 +1,9 @@
-from typing import Union, List
+from typing import Union, List, Optional
 
+from _game.base.area_of_effect import AreaOfEffect
 from _game.base.functionality import empty_set_or_set_of_dataclasses
 from _game.base.stats_abilities_and_settings import Abilities, DamageType, AbilityScoreTracker, WeaponType, \
-    WeaponProperties
+    WeaponProperties, AreaShape
 
 
 class BaseWeapon:
@@ -18,7 +19,8 @@ class BaseWeapon:
                  range_disadvantage: int = None,
                  two_handed_damage_dice: str = None,
                  cost: int = None,
-                 weight: int = None):
+                 weight: int = None,
+                 area_of_effect: Optional[AreaOfEffect] = None):
         """
         Initialize a weapon.
 
@@ -27,6 +29,7 @@ class BaseWeapon:
         :param damage_type: DamageType enum value
         :param magic_bonus: Magic bonus to attack and damage rolls
         :param modifier: Ability modifier for weapon.
+        :param area_of_effect: Template of area attacks, hitting every entity caught instead of a single target
         """
         self.name = name
         self.weapon_type = weapon_type
@@ -43,6 +46,8 @@ class BaseWeapon:
         self.cost = cost
         self.weight = weight
 
+        self.area_of_effect = area_of_effect
+
         self.description_short = self._describe('short')
 
         if WeaponProperties.FINESSE in self.properties:
@@ -67,6 +72,7 @@ class BaseWeapon:
                 f"Magic: {self.magic_bonus}, "
                 f"{', '.join([mod.name for mod in self.modifier])!r}, "
                 f"{', '.join([prop.name for prop in self.properties])!r}"
+                f"{f', {self.area_of_effect.description()}' if self.area_of_effect is not None else ''}"
             )
         else:
             raise ValueError(f"Description length '{length}' not implemented.")
@@ -151,7 +157,8 @@ class Weapons:
         cost=0,  # No cost, as this is typically a natural ability
         weight=0,
         range=15,
-        range_disadvantage=30# Breath weapon has no weight
+        range_disadvantage=30,# Breath weapon has no weight
+        area_of_effect=AreaOfEffect(shape=AreaShape.CONE, size=15, save_ability=Abilities.DEXTERITY)
     )
 
     greataxe = BaseWeapon(
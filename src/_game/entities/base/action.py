@@ -2,24 +2,28 @@ from collections import defaultdict
 from dataclasses import dataclass, field
 from enum import Enum, auto
 from typing import Optional, Union, List, Set, Any
-from copy import deepcopy
 from xml.dom.minidom import Entity
 from abc import ABC, abstractmethod
+from random import Random
 
+from _game.base.area_of_effect import AreaOfEffect
+from _game.base.environment import Location
 from _game.base.stats_abilities_and_settings import DamageType, WeaponProperties
 from _game.base.functionality import RollInfo
 from _game.base.weapons import Weapons, BaseWeapon
-from _game.base.functionality import roll_dice, RollInfo
+from _game.base.functionality import roll_dice_plan, compile_dice_notation, RollInfo
 
 class ActionType(Enum):
     ENVIRONMENT_ACTION_PICK_UP_WEAPON = auto()
     WEAPON_ATTACK_MELEE = auto()
     WEAPON_ATTACK_RANGED = auto()
     WEAPON_ATTACK_THROW = auto()
+    WEAPON_ATTACK_AREA = auto()
 
 class TargetType(Enum):
     ENTITY = auto()
     ENVIRONMENT_WEAPON = auto()
+    LOCATION = auto()
 
 @dataclass
 class Action(ABC):
@@ -37,9 +41,21 @@ class Action(ABC):
     primed: bool = False
     success: bool = None
     executed: bool = False
+    rng_stream: Optional[int] = None
 
     action_info: str = field(default_factory=list)
 
+    def __copy__(self):
+        # Field level copy: entities, weapons and targets are shared references,
+        # only containers owned by the action itself are copied.
+        action = object.__new__(self.__class__)
+        action.__dict__.update(self.__dict__)
+        if isinstance(self.action_info, list):
+            action.action_info = list(self.action_info)
+        if isinstance(self.allowed_target_types, list):
+            action.allowed_target_types = list(self.allowed_target_types)
+        return action
+
     @abstractmethod
     def description_prior(self) -> str:
         pass
@@ -110,14 +126,26 @@ class WeaponAttackAction(Action):
     weapon: BaseWeapon = None
     two_handed_attack: bool = False
 
-    def roll_ac(self):
+    # Area attacks: one primed action per caught entity, all sharing the damage roll
+    area_of_effect: Optional[AreaOfEffect] = None
+    aim: Optional[Location] = None
+    save_roll: Optional[RollInfo] = None
+    saved: Optional[bool] = None
+
+    @property
+    def save_dc(self) -> int:
+        # Same bonus as the attack roll: ability modifier + proficiency
+        return 8 + compile_dice_notation(self.ac_dice_notation).modifier
+
+    def roll_ac(self, rng: Optional[Random] = None):
         if self.ac_dice_notation is None:
             raise ValueError(f"ac_dice_notation must be defined.\n"
                              f"Delivered: {self.ac_dice_notation}")
 
-        roll_1 = roll_dice(self.ac_dice_notation)
+        ac_plan = compile_dice_notation(self.ac_dice_notation)
+        roll_1 = roll_dice_plan(ac_plan, rng=rng)
         if (self.disadvantage or self.advantage) and not (self.disadvantage and self.advantage):
-            roll_2 = roll_dice(self.ac_dice_notation)
+            roll_2 = roll_dice_plan(ac_plan, rng=rng)
             ac_low, ac_high = sorted([roll_1, roll_2], key=lambda x: x.total_roll)
 
             self.applied_ac_advantage_disadvantage = True
@@ -131,8 +159,10 @@ class WeaponAttackAction(Action):
 
         self.crit_roll = self.ac_roll.all_rolls[20][0] == 20
 
-    def roll_source(self):
-        self.source_roll = roll_dice(self.source_roll_dice_notation, double_dice=self.crit_roll)
+    def roll_source(self, rng: Optional[Random] = None):
+        self.source_roll = roll_dice_plan(compile_dice_notation(self.source_roll_dice_notation),
+                                          double_dice=self.crit_roll,
+                                          rng=rng)
 
     def check_attack_success(self, defender_ac: int):
         if self.success is not None:
@@ -169,7 +199,7 @@ class WeaponAttackAction(Action):
                 self.disadvantage = True
 
             if self.attack_distance is None:
-                self.attack_distance = abs(self.source.battle_data.location - self.target.battle_data.location)
+                self.attack_distance = self.source.battle_data.location.distance(self.target.battle_data.location)
 
             if self.attack_distance > self.range_disadvantage:
                 self.success = False
@@ -180,16 +210,38 @@ class WeaponAttackAction(Action):
         self.attack_distance = distance
 
     def __copy__(self):
-        copy = deepcopy(self)
-
-        copy.source = self.source
-        copy.target = self.target
-
-        copy.weapon = self.weapon
-
-        return copy
+        action = super().__copy__()
+
+        # Rolls are altered in place by apply_resistance_and_immunity.
+        for roll in ("ac_roll", "ac_secondary_roll", "source_roll", "save_roll"):
+            value = getattr(self, roll)
+            if value is not None:
+                setattr(action, roll, RollInfo(total_roll=value.total_roll,
+                                               dice_notation=value.dice_notation,
+                                               all_rolls=defaultdict(list, {d: list(r)
+                                                                            for d, r in value.all_rolls.items()})))
+        return action
+
+    def roll_save(self, save_modifier: int, rng: Optional[Random] = None):
+        """
+        Saving throw of the target against an area attack, a success halves the damage.
+        """
+        self.save_roll = roll_dice_plan(compile_dice_notation(f"d20 {save_modifier:+}"), rng=rng)
+        self.saved = self.save_roll.total_roll >= self.save_dc
+        if self.saved:
+            self.source_roll.total_roll = self.source_roll.total_roll // 2
 
     def description_prior(self) -> str:
+        if self.action_type == ActionType.WEAPON_ATTACK_AREA:
+            ret = f"{self.action_type.name}"
+            if self.weapon:
+                ret += f", {self.weapon.name}"
+            ret += f", {self.area_of_effect.description()}"
+            ret += f", DC {self.save_dc}" if self.area_of_effect.save_ability is not None else ""
+            ret += f", Damage: {self.source_roll_dice_notation}"
+            ret += f", {self.damage_type.name}"
+            ret += ", magical" if self.magic else ""
+            return ret
         if self.action_type in {ActionType.WEAPON_ATTACK_MELEE,
                                 ActionType.WEAPON_ATTACK_RANGED,
                                 ActionType.WEAPON_ATTACK_THROW}:
@@ -204,7 +256,21 @@ class WeaponAttackAction(Action):
             return ret
         raise NotImplementedError()
 
+    def _description_area(self) -> str:
+        ret = f"{self.weapon.name if self.weapon else 'Area'} at {self.aim}"
+        if self.target is not None:
+            ret += f" -> ID{self.target.battle_data.entity_id}"
+        if self.save_roll is not None:
+            ret += f", {'SAVED' if self.saved else 'FAILED'} save {self.save_roll.total_roll} vs DC {self.save_dc}"
+        ret += f", Damage: {self.source_roll.total_roll} ({self.source_roll.dice_notation})"
+        ret += f", {self.damage_type.name}"
+        ret += ", RESISTANCE" if self.resistance_applied and not self.immunity_applied else ""
+        ret += ", IMMUNITY" if self.immunity_applied else ""
+        return ret
+
     def description_primed(self) -> str:
+        if self.action_type == ActionType.WEAPON_ATTACK_AREA:
+            return self._description_area()
         if self.action_type in {ActionType.WEAPON_ATTACK_MELEE,
                                 ActionType.WEAPON_ATTACK_RANGED,
                                 ActionType.WEAPON_ATTACK_THROW}:
@@ -217,12 +283,15 @@ class WeaponAttackAction(Action):
             ret += ", magical" if self.magic else ""
             ret += ", RESISTANCE" if self.resistance_applied and not self.immunity_applied else ""
             ret += ", IMMUNITY" if self.immunity_applied else ""
-            ret += ", ".join(self.action_info) if self.action_info is not None else ""
+            ret += "".join(f", {info}" for info in self.action_info) if self.action_info is not None else ""
             return ret
         raise NotImplementedError()
 
 
     def description_executed(self) -> str:
+        if self.action_type == ActionType.WEAPON_ATTACK_AREA:
+            return (f"Turn {self.battle_tracker_turn}, Round {self.battle_tracker_round}, "
+                    f"{self.action_type.name}, {self._description_area()}")
         if self.action_type in {ActionType.WEAPON_ATTACK_MELEE,
                                 ActionType.WEAPON_ATTACK_RANGED,
                                 ActionType.WEAPON_ATTACK_THROW}:
@@ -1,14 +1,18 @@
 from dataclasses import dataclass, field
-from typing import Optional, List, Union, Dict
+from typing import Optional, List, Union, Dict, Hashable, Any
 from copy import copy
+from itertools import chain
+from random import Random
 import logging
 
+from _game.base.derived_stats import StatGraphStructure, DerivedStatGraph
 from _game.base.environment import Location
+from _game.base.modifiers import Effect, ModifierStack
 from _game.base.functionality import roll_dice, RollInfo
 from _game.base.functionality import empty_set_or_set_of_dataclasses, \
     emtpy_list_or_list_of_dataclasses
 from _game.base.stats_abilities_and_settings import Abilities, Skills, AbilityScoreTracker, SkillScoreTracker, \
-    DamageType, WeaponType, WeaponProperties, Size, CharacterType
+    DamageType, WeaponType, WeaponProperties, Size, CharacterType, EffectStat
 from _game.base.weapons import BaseWeapon
 from _game.entities.base.action import Action, ActionType, TargetType, EnvironmentAction, WeaponAttackAction
 
@@ -29,9 +33,9 @@ class HitPointTracker:
         self.play_max_modifier = 0
         self.current = self.play_max
 
-    def roll_hit_points(self):
+    def roll_hit_points(self, rng: Optional[Random] = None):
         if self.rule_rolls is not None:
-            self.play_max = roll_dice(self.rule_rolls).total_roll
+            self.play_max = roll_dice(self.rule_rolls, rng=rng).total_roll
         self.play_max_modifier = 0
         self.current = self.play_max
 
@@ -47,10 +51,9 @@ class BattleTrackerMetaData:
     entity_id: int = None
     initiative: int = None
 
-    actions_affected_by: List[Action] = field(default_factory=list)
-    actions_taken: List[Action] = field(default_factory=list)
-
     enemy_in_melee_range: bool = False
+    # Feet moved in the current turn of the entity
+    movement_used: int = 0
 
     left_hand: str = None
     right_hand: str = None
@@ -59,6 +62,88 @@ class BattleTrackerMetaData:
 
     location: Location = None
 
+def _effective_score(base: Optional[int], bonus: int) -> Optional[int]:
+    return None if base is None else base + bonus
+
+
+def _ability_modifier(score: Optional[int]) -> int:
+    return 0 if score is None else (score - 10)//2
+
+
+def _proficient_bonus(proficient: bool, proficiency_bonus: int) -> int:
+    return proficiency_bonus if proficient else 0
+
+
+def _sum(*values: int) -> int:
+    return sum(values)
+
+
+def _non_negative_sum(*values: int) -> int:
+    return max(sum(values), 0)
+
+
+def _union(*values: frozenset) -> frozenset:
+    return frozenset().union(*values)
+
+
+def _collect(*values: Any) -> tuple:
+    return values
+
+
+def _build_entity_stats() -> StatGraphStructure:
+    """
+    ability base (+ bonus) -> score -> modifier -> skills
+                                               -> attack_stats (attack and damage notation of the weapon attacks)
+    armor_class_base (+ bonus) -> armor_class
+    *_bonus inputs are the aggregates of the ModifierStack of the entity.
+    """
+    stats = StatGraphStructure()
+    stats.add_input("proficiency_bonus")
+    for stat, compute in [("armor_class", _sum),
+                          ("speed", _non_negative_sum),
+                          ("damage_resistances", _union),
+                          ("damage_immunity", _union)]:
+        stats.add_input(f"{stat}_base")
+        stats.add_input(f"{stat}_bonus")
+        stats.add_derived(stat, compute, [f"{stat}_base", f"{stat}_bonus"])
+    stats.add_input("advantage")
+    stats.add_input("disadvantage")
+
+    for ability in Abilities:
+        stats.add_input(("ability", ability))
+        stats.add_input(("ability_bonus", ability))
+        stats.add_derived(("score", ability), _effective_score, [("ability", ability), ("ability_bonus", ability)])
+        stats.add_derived(("modifier", ability), _ability_modifier, [("score", ability)])
+
+    for proficiency in chain(Skills, WeaponType):
+        stats.add_input(("proficient", proficiency))
+        stats.add_derived(("proficiency", proficiency), _proficient_bonus,
+                          [("proficient", proficiency), "proficiency_bonus"])
+
+    for skill in Skills:
+        stats.add_derived(("skill", skill), _sum, [("modifier", skill.get_ability()), ("proficiency", skill)])
+
+    stats.add_derived("attack_stats", _collect,
+                      [("modifier", ability) for ability in Abilities] +
+                      [("proficiency", weapon_type) for weapon_type in WeaponType] +
+                      ["advantage", "disadvantage"])
+    return stats
+
+
+ENTITY_STATS = _build_entity_stats()
+
+# Graph input fed by the ModifierStack aggregate of each stat
+_EFFECT_INPUTS = {
+    **{ability: ("ability_bonus", ability) for ability in Abilities},
+    EffectStat.ARMOR_CLASS: "armor_class_bonus",
+    EffectStat.SPEED: "speed_bonus",
+    EffectStat.DAMAGE_RESISTANCE: "damage_resistances_bonus",
+    EffectStat.DAMAGE_IMMUNITY: "damage_immunity_bonus",
+    EffectStat.ADVANTAGE: "advantage",
+    EffectStat.DISADVANTAGE: "disadvantage",
+}
+
+
 class Entity:
     def __init__(self,
                  race: str,
@@ -81,14 +166,14 @@ class Entity:
                  weapons: List[WeaponType] = None,
                  character_type: CharacterType = CharacterType.ENEMY):
         self.character_type = character_type
+        # Template this entity was spawned from, None for templates themselves.
+        self.template: Optional[Entity] = None
 
         self.battle_data = BattleTrackerMetaData()
 
         self.race = race
         self.name = name
 
-        self.armor_class = armor_class
-
         if not isinstance(hit_points, HitPointTracker):
             self.hit_points = HitPointTracker(rule_default=hit_points)
             self.hit_points.roll_hit_points()
@@ -98,54 +183,196 @@ class Entity:
 
         self.size = size
 
-        self.speed = speed
         self.proficiencies = empty_set_or_set_of_dataclasses(proficiencies)
-        self.proficiency_bonus = proficiency_bonus
-
-        self.ability_scores = {
-            Abilities.STRENGTH: AbilityScoreTracker(base=strength),
-            Abilities.DEXTERITY: AbilityScoreTracker(base=dexterity),
-            Abilities.CONSTITUTION: AbilityScoreTracker(base=constitution),
-            Abilities.INTELLIGENCE: AbilityScoreTracker(base=intelligence),
-            Abilities.WISDOM: AbilityScoreTracker(base=wisdom),
-            Abilities.CHARISMA: AbilityScoreTracker(base=charisma)
-        }
 
-        self.damage_resistances = empty_set_or_set_of_dataclasses(damage_resistances)
-        self.damage_immunity = empty_set_or_set_of_dataclasses(damage_immunities)
+        ability_scores = {
+            Abilities.STRENGTH: strength,
+            Abilities.DEXTERITY: dexterity,
+            Abilities.CONSTITUTION: constitution,
+            Abilities.INTELLIGENCE: intelligence,
+            Abilities.WISDOM: wisdom,
+            Abilities.CHARISMA: charisma
+        }
+        stat_inputs = {
+            "proficiency_bonus": proficiency_bonus,
+            "armor_class_base": armor_class,
+            "armor_class_bonus": 0,
+            "speed_base": speed,
+            "speed_bonus": 0,
+            "damage_resistances_base": frozenset(empty_set_or_set_of_dataclasses(damage_resistances)),
+            "damage_resistances_bonus": frozenset(),
+            "damage_immunity_base": frozenset(empty_set_or_set_of_dataclasses(damage_immunities)),
+            "damage_immunity_bonus": frozenset(),
+            "advantage": False,
+            "disadvantage": False
+        }
+        for ability, base in ability_scores.items():
+            stat_inputs[("ability", ability)] = base
+            stat_inputs[("ability_bonus", ability)] = 0
+        for proficiency in chain(Skills, WeaponType):
+            stat_inputs[("proficient", proficiency)] = proficiency in self.proficiencies
+        self._stats = DerivedStatGraph(ENTITY_STATS, stat_inputs)
+        # Spawned instances share the stats of their template until they change them.
+        self._owns_stats = True
+        self.ability_scores: Dict[Abilities, AbilityScoreTracker] = {}
+        self.skill_scores: Dict[Skills, SkillScoreTracker] = {}
+        # Buffs and debuffs, their aggregates are fed into the stats.
+        self.modifiers = ModifierStack()
 
         self.weapons = emtpy_list_or_list_of_dataclasses(weapons)
+        # Weapon attacks derived from weapons and attack_stats. bonus_action: attacks
+        self._attack_tables: Dict[bool, List[WeaponAttackAction]] = {}
+        self._attack_tables_version = None
 
         if roll_for_stats:
             self.reroll_health_stats()
         self.initial_data_update()
 
-    def _set_ability_skill_modifiers(self):
-        for ability, score in self.ability_scores.items():
-            if score.base is None:
-                continue
-            score.modifier = (score.base - 10)//2
-
-        skill_scores = {}
-        for skill in Skills:
-            score = SkillScoreTracker()
-            score.base_type = skill.get_ability()
-            score.modifier_excl_proficiency = self.ability_scores[score.base_type].modifier
-            if skill in self.proficiencies:
-                score.modifier = score.modifier_excl_proficiency + self.proficiency_bonus
-            else:
-                score.modifier = score.modifier_excl_proficiency
-            skill_scores[skill] = score
-        self.skill_scores = skill_scores
+    def spawn(self) -> 'Entity':
+        """
+        Create a battle instance of this entity.
+        The instance shares all template data (stats, proficiencies, resistances, weapon objects) and only owns
+        its mutable state: hit points, battle data (ID, initiative, location, action history) and its weapon list.
+        Shared data is never mutated in place, writers like set_ability_score replace it instead.
+        """
+        instance = copy(self)
+        instance.template = self.template if self.template is not None else self
+        instance.hit_points = copy(self.hit_points)
+        instance.battle_data = BattleTrackerMetaData()
+        instance.weapons = list(self.weapons)
+        instance._attack_tables = {}
+        instance._attack_tables_version = None
+        instance._owns_stats = False
+        instance.modifiers = self.modifiers.copy()
+        return instance
+
+    @property
+    def armor_class(self) -> int:
+        return self._stats.get("armor_class")
+
+    @armor_class.setter
+    def armor_class(self, armor_class: int):
+        self._set_stats({"armor_class_base": armor_class})
+
+    @property
+    def speed(self) -> int:
+        return self._stats.get("speed")
+
+    @speed.setter
+    def speed(self, speed: int):
+        self._set_stats({"speed_base": speed})
+
+    @property
+    def damage_resistances(self) -> frozenset:
+        return self._stats.get("damage_resistances")
+
+    @damage_resistances.setter
+    def damage_resistances(self, damage_resistances: Optional[Union[List[DamageType], DamageType]]):
+        self._set_stats({"damage_resistances_base": frozenset(empty_set_or_set_of_dataclasses(damage_resistances))})
+
+    @property
+    def damage_immunity(self) -> frozenset:
+        return self._stats.get("damage_immunity")
+
+    @damage_immunity.setter
+    def damage_immunity(self, damage_immunities: Optional[Union[List[DamageType], DamageType]]):
+        self._set_stats({"damage_immunity_base": frozenset(empty_set_or_set_of_dataclasses(damage_immunities))})
+
+    @property
+    def proficiency_bonus(self) -> int:
+        return self._stats.get("proficiency_bonus")
+
+    @proficiency_bonus.setter
+    def proficiency_bonus(self, proficiency_bonus: int):
+        self._set_stats({"proficiency_bonus": proficiency_bonus})
+
+    @property
+    def stats_version(self) -> int:
+        """
+        Bumped whenever any derived stat changes, for caches to key on.
+        """
+        return self._stats.version
+
+    def stat_version(self, key: Hashable) -> int:
+        return self._stats.node_version(key)
+
+    def set_ability_score(self, ability: Abilities, base: int):
+        self._set_stats({("ability", ability): base})
+
+    def add_proficiency(self, proficiency: Union[Skills, Abilities, WeaponType]):
+        self.proficiencies = self.proficiencies | {proficiency}
+        if ("proficient", proficiency) in ENTITY_STATS.order:
+            self._set_stats({("proficient", proficiency): True})
+
+    def remove_proficiency(self, proficiency: Union[Skills, Abilities, WeaponType]):
+        self.proficiencies = self.proficiencies - {proficiency}
+        if ("proficient", proficiency) in ENTITY_STATS.order:
+            self._set_stats({("proficient", proficiency): False})
+
+    def add_effect(self, effect: Effect) -> int:
+        """
+        :return: Effect ID, needed to remove the effect
+        """
+        effect_id, changed = self.modifiers.add(effect)
+        if changed:
+            self._apply_modifier(effect.stat)
+        return effect_id
+
+    def remove_effect(self, effect_id: int) -> Effect:
+        effect, changed = self.modifiers.remove(effect_id)
+        if changed:
+            self._apply_modifier(effect.stat)
+        return effect
+
+    def _apply_modifier(self, stat: Union[Abilities, EffectStat]):
+        if stat in (EffectStat.DAMAGE_RESISTANCE, EffectStat.DAMAGE_IMMUNITY):
+            value = self.modifiers.damage_types(stat)
+        elif stat in (EffectStat.ADVANTAGE, EffectStat.DISADVANTAGE):
+            value = self.modifiers.active(stat)
+        else:
+            value = self.modifiers.total(stat)
+        self._set_stats({_EFFECT_INPUTS[stat]: value})
+
+    def _invalidate_attack_tables(self):
+        self._attack_tables = {}
+
+    def _set_stats(self, inputs: Dict[Hashable, Any]):
+        # Copy on write, the stats may be shared with the template.
+        if not self._owns_stats:
+            self._stats = self._stats.copy()
+            self._owns_stats = True
+        self._refresh_stat_views(self._stats.update(inputs))
+
+    def _refresh_stat_views(self, changed: List[Hashable]):
+        # ability_scores and skill_scores are read only views on the stat graph.
+        # Changed entries are replaced, never mutated, as the views may be shared with the template.
+        abilities = {key[1] for key in changed if isinstance(key, tuple) and key[0] in ("ability", "modifier")}
+        skills = {key[1] for key in changed if isinstance(key, tuple) and key[0] == "skill"}
+
+        if abilities:
+            self.ability_scores = {**self.ability_scores, **{
+                ability: AbilityScoreTracker(base=self._stats.get(("ability", ability)),
+                                             modifier=self._stats.get(("modifier", ability)))
+                for ability in abilities
+            }}
+        if skills:
+            self.skill_scores = {**self.skill_scores, **{
+                skill: SkillScoreTracker(base_type=skill.get_ability(),
+                                         modifier_excl_proficiency=self._stats.get(("modifier", skill.get_ability())),
+                                         modifier=self._stats.get(("skill", skill)))
+                for skill in skills
+            }}
 
     def initial_data_update(self):
-        self._set_ability_skill_modifiers()
+        self._refresh_stat_views([("ability", ability) for ability in Abilities] +
+                                 [("skill", skill) for skill in Skills])
 
-    def reroll_health_stats(self):
-        self.hit_points.roll_hit_points()
+    def reroll_health_stats(self, rng: Optional[Random] = None):
+        self.hit_points.roll_hit_points(rng=rng)
 
     def add_weapon(self, weapon: BaseWeapon):
         self.weapons.append(weapon)
+        self._invalidate_attack_tables()
 
     def drop_weapon(self, weapon: BaseWeapon) -> BaseWeapon:
         weapon_num = None
@@ -159,6 +386,7 @@ class Entity:
             return None
         else:
             drop = self.weapons.pop(weapon_num)
+            self._invalidate_attack_tables()
             return drop
 
     def _get_weapon_attacks(self, base_action: WeaponAttackAction, bonus_action = False) -> List[Action]:
@@ -176,13 +404,17 @@ class Entity:
             # AC dice
             if WeaponProperties.HEAVY in weapon.properties and self.size == Size.SMALL:
                 action.disadvantage = True
+            if self._stats.get("advantage"):
+                action.advantage = True
+            if self._stats.get("disadvantage"):
+                action.disadvantage = True
 
             action.ac_dice_notation = "d20"
 
             attack_modifiers = [stats for typ, stats in self.ability_scores.items() if typ in weapon.modifier]
             if attack_modifiers:
                 used_modifier = max([at.modifier for at in attack_modifiers])
-                action.ac_dice_notation += f" +{used_modifier}"
+                action.ac_dice_notation += f" {used_modifier:+}"
 
             if weapon.weapon_type in self.proficiencies:
                 action.ac_dice_notation += f" +{self.proficiency_bonus}"
@@ -191,7 +423,7 @@ class Entity:
 
             modifier_abilities = [stats for typ, stats in self.ability_scores.items() if typ in weapon.modifier]
             max_modifier = max(stat.modifier for stat in modifier_abilities) if modifier_abilities else 0
-            attack_dice += f" +{max_modifier}"
+            attack_dice += f" {max_modifier:+}"
 
             action.magic = True if weapon.magic_bonus else False
             action.magic_damage = weapon.magic_bonus if weapon.magic_bonus else 0
@@ -199,13 +431,23 @@ class Entity:
 
             # Damage dice (source)
             if WeaponProperties.TWO_HANDED in weapon.properties and not action.two_handed_attack:
-                action.action_info += ", attack_dice set to zero due to two handed weapon being used with one hand"
+                action.action_info.append("attack_dice set to zero due to two handed weapon being used with one hand")
                 #raise ValueError(f"Implement handling of two handed weapons.")
                 attack_dice = ""
 
             action.source_roll_dice_notation = attack_dice
             action.damage_type = weapon.damage_type
 
+            # Area attacks hit every entity caught by their template instead of a single target
+            if weapon.area_of_effect is not None:
+                action.action_type = ActionType.WEAPON_ATTACK_AREA
+                action.allowed_target_types = TargetType.LOCATION
+                action.area_of_effect = weapon.area_of_effect
+                action.range = weapon.range
+                action.range_disadvantage = weapon.range_disadvantage
+                weapon_attacks.append(copy(action))
+                continue
+
             # Append Actions and set values for ranged attacks
             if not WeaponProperties.RANGE in weapon.properties:
                 weapon_attacks.append(copy(action))
@@ -225,6 +467,29 @@ class Entity:
         return weapon_attacks
 
 
+    def _get_attack_table(self,
+                          current_turn: int,
+                          current_round_number: int,
+                          bonus_action: bool = False) -> List[WeaponAttackAction]:
+        # The table is built once and only rebuilt after weapons or attack_stats changed.
+        # Callers get cheap copies stamped with the current turn.
+        if self._attack_tables_version != self._stats.node_version("attack_stats"):
+            self._attack_tables = {}
+            self._attack_tables_version = self._stats.node_version("attack_stats")
+        if bonus_action not in self._attack_tables:
+            self._attack_tables[bonus_action] = self._get_weapon_attacks(
+                base_action=WeaponAttackAction(source=self, bonus_action=bonus_action),
+                bonus_action=bonus_action
+            )
+
+        attacks = []
+        for cached_attack in self._attack_tables[bonus_action]:
+            attack = copy(cached_attack)
+            attack.battle_tracker_turn = current_turn
+            attack.battle_tracker_round = current_round_number
+            attacks.append(attack)
+        return attacks
+
     def get_actions(self,
                     current_turn: int,
                     current_round_number: int,
@@ -238,13 +503,7 @@ class Entity:
         possible_actions: Dict[ActionType, List[Action]] = dict()
 
         # Weapon Attacks
-        weapon_attacks = self._get_weapon_attacks(
-            base_action=WeaponAttackAction(
-                battle_tracker_turn=current_turn,
-                battle_tracker_round=current_round_number,
-                source=self
-            )
-        )
+        weapon_attacks = self._get_attack_table(current_turn, current_round_number)
         for attack in weapon_attacks:
             if attack.action_type in action_types:
                 if attack.action_type not in possible_actions:
@@ -277,15 +536,7 @@ class Entity:
 
         possible_actions: Dict[ActionType, List[Action]] = dict()
 
-        weapon_attacks = self._get_weapon_attacks(
-            base_action=WeaponAttackAction(
-                battle_tracker_turn=current_turn,
-                battle_tracker_round=current_round_number,
-                source=self,
-                bonus_action=True
-            ),
-            bonus_action=True
-        )
+        weapon_attacks = self._get_attack_table(current_turn, current_round_number, bonus_action=True)
         for attack in weapon_attacks:
             if attack.action_type in action_types:
                 if attack.action_type not in possible_actions:
@@ -295,9 +546,9 @@ class Entity:
 
         return possible_actions
 
-    def roll_initiative(self):
+    def roll_initiative(self, rng: Optional[Random] = None):
 
-        base_roll = roll_dice('d20').total_roll
+        base_roll = roll_dice('d20', rng=rng).total_roll
         dex_stats = self.ability_scores[Abilities.DEXTERITY]
 
         return base_roll + dex_stats.modifier
@@ -1,4 +1,5 @@
 import random
+from typing import Optional
 
 from _game.entities.base.entity import Entity, Skills
 from _game.entities.base.entity import HitPointTracker
@@ -49,8 +50,10 @@ name_set = {
     "Gorebloom", "Blightroot", "Nightmonger", "Searmash", "Vilecrusher"
 }
 
-def random_name_pick():
-    return random.choice(list(name_set))
+_name_list = sorted(name_set)
+
+def random_name_pick(rng: Optional[random.Random] = None):
+    return (rng if rng is not None else random).choice(_name_list)
 
 class PredefinedMonsters:
     GOBLIN = Entity(
@@ -246,10 +249,10 @@ class PredefinedMonsters:
     }
 
     @staticmethod
-    def get_monster(race: str = None):
+    def get_monster(race: str = None, rng: Optional[random.Random] = None):
         all_monsters = PredefinedMonsters.ALL_MONSTERS
         for monster in all_monsters.values():
-            monster.name = random_name_pick()
+            monster.name = random_name_pick(rng=rng)
 
         if race is not None:
             return all_monsters[race]
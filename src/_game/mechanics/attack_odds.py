@@ -0,0 +1,231 @@
+from dataclasses import dataclass
+from functools import lru_cache, cached_property
+from typing import Optional, Set
+
+import numpy as np
+
+from _game.base.functionality import compile_dice_notation
+from _game.base.probability import DiceDistribution, get_dice_distribution
+from _game.base.stats_abilities_and_settings import DamageType
+from _game.entities.base.action import WeaponAttackAction
+
+
+@dataclass(frozen=True)
+class AttackOdds:
+    """
+    Exact outcome of a weapon attack against one defender, without rolling.
+
+    :param hit_probability: Probability to hit, critical hits included
+    :param crit_probability: Probability of a natural 20 on the kept d20
+    :param damage: Distribution of the damage dealt, misses count as 0
+    """
+    hit_probability: float
+    crit_probability: float
+    damage: DiceDistribution
+
+    @property
+    def expected_damage(self) -> float:
+        return self.damage.mean
+
+    @cached_property
+    def _survival(self) -> np.ndarray:
+        # _survival[k] = P(damage >= k)
+        return np.cumsum(self.damage.pmf[::-1])[::-1]
+
+    @cached_property
+    def _capped_means(self) -> np.ndarray:
+        # _capped_means[h] = E[min(damage, h)] = sum of P(damage >= k) for k = 1..h
+        return np.concatenate([[0.0], np.cumsum(self._survival[1:])])
+
+    def kill_probability(self, hit_points: int) -> float:
+        """
+        Probability to drop a defender with the given current hit points to 0 or below.
+        """
+        hit_points = max(hit_points, 1)
+        return float(self._survival[hit_points]) if hit_points < len(self._survival) else 0.0
+
+    def effective_damage(self, hit_points: int) -> float:
+        """
+        Expected damage without overkill, i.e. capped at the current hit points of the defender.
+        """
+        hit_points = min(max(hit_points, 0), len(self._capped_means) - 1)
+        return float(self._capped_means[hit_points])
+
+    def description(self) -> str:
+        return (f"Hit: {self.hit_probability:.0%}, "
+                f"Crit: {self.crit_probability:.0%}, "
+                f"Expected Damage: {self.expected_damage:.1f}")
+
+
+def _kept_d20_pmf(advantage: bool, disadvantage: bool) -> np.ndarray:
+    faces = np.arange(1, 21)
+    if advantage and not disadvantage:
+        return (2 * faces - 1) / 400
+    if disadvantage and not advantage:
+        return (41 - 2 * faces) / 400
+    return np.full(20, 1 / 20)
+
+
+def _applied_damage(distribution: DiceDistribution, resisted: bool, immune: bool, saved: bool = False) -> np.ndarray:
+    """
+    PMF over damage 0, 1, ... as apply_damage sees it: halved (rounded down) on a successful save and again on
+    resistance, 0 on immunity, negative totals deal no damage.
+    """
+    if immune:
+        return np.ones(1)
+
+    totals = distribution.totals
+    if saved:
+        totals = totals // 2
+    if resisted:
+        totals = totals // 2
+    totals = np.clip(totals, 0, None)
+    return np.bincount(totals, weights=distribution.pmf)
+
+
+@lru_cache(maxsize=4096)
+def _attack_odds(ac_dice_notation: str,
+                 source_roll_dice_notation: str,
+                 advantage: bool,
+                 disadvantage: bool,
+                 armor_class: int,
+                 resisted: bool,
+                 immune: bool) -> AttackOdds:
+    ac_plan = compile_dice_notation(ac_dice_notation)
+    if ac_plan.dice != ((1, 20, 1),):
+        raise ValueError(f"Attack odds need an attack roll of a single d20 plus modifiers.\n"
+                         f"Delivered: {ac_dice_notation!r}")
+
+    kept_d20 = _kept_d20_pmf(advantage, disadvantage)
+    crit_probability = float(kept_d20[19])
+    # Same rule as WeaponAttackAction.check_attack_success: meet the AC or roll a natural 20.
+    needed = min(max(armor_class - ac_plan.modifier, 1), 20)
+    hit_probability = float(kept_d20[needed - 1:].sum())
+    normal_hit_probability = hit_probability - crit_probability
+
+    normal = _applied_damage(get_dice_distribution(source_roll_dice_notation), resisted, immune)
+    crit = _applied_damage(get_dice_distribution(source_roll_dice_notation, double_dice=True), resisted, immune)
+
+    pmf = np.zeros(max(len(normal), len(crit)))
+    pmf[0] += 1 - hit_probability
+    pmf[:len(normal)] += normal_hit_probability * normal
+    pmf[:len(crit)] += crit_probability * crit
+    pmf.setflags(write=False)
+
+    damage = DiceDistribution(dice_notation=f"{ac_dice_notation} vs AC {armor_class}: {source_roll_dice_notation}",
+                              double_dice=False,
+                              offset=0,
+                              pmf=pmf)
+    return AttackOdds(hit_probability=hit_probability, crit_probability=crit_probability, damage=damage)
+
+
+@lru_cache(maxsize=4096)
+def _area_attack_odds(source_roll_dice_notation: str,
+                      save_dc: Optional[int],
+                      save_modifier: Optional[int],
+                      resisted: bool,
+                      immune: bool) -> AttackOdds:
+    distribution = get_dice_distribution(source_roll_dice_notation)
+    # Same rule as WeaponAttackAction.roll_save: d20 + modifier meeting the DC halves the damage.
+    save_probability = 0.0 if save_dc is None else \
+        get_dice_distribution(f"d20 {save_modifier:+}").probability_at_least(save_dc)
+
+    failed = _applied_damage(distribution, resisted, immune)
+    saved = _applied_damage(distribution, resisted, immune, saved=True)
+
+    pmf = np.zeros(max(len(failed), len(saved)))
+    pmf[:len(failed)] += (1 - save_probability) * failed
+    pmf[:len(saved)] += save_probability * saved
+    pmf.setflags(write=False)
+
+    label = source_roll_dice_notation if save_dc is None else \
+        f"{source_roll_dice_notation}, d20 {save_modifier:+} vs DC {save_dc}"
+    damage = DiceDistribution(dice_notation=label,
+                              double_dice=False,
+                              offset=0,
+                              pmf=pmf)
+    return AttackOdds(hit_probability=1.0, crit_probability=0.0, damage=damage)
+
+
+_NO_CHANCE = AttackOdds(hit_probability=0.0,
+                        crit_probability=0.0,
+                        damage=DiceDistribution(dice_notation="out of range", double_dice=False, offset=0,
+                                                pmf=np.ones(1)))
+
+
+def attack_odds(action: WeaponAttackAction,
+                armor_class: int,
+                resistances: Optional[Set[DamageType]] = None,
+                immunities: Optional[Set[DamageType]] = None,
+                attack_distance: Optional[int] = None,
+                enemy_in_melee_range: Optional[bool] = None,
+                line_of_sight: bool = True) -> AttackOdds:
+    """
+    Exact P(hit), P(crit) and damage distribution of a weapon attack as built by Entity._get_weapon_attacks.
+    Results are cached per (action signature, AC).
+
+    :param action: Weapon attack, it is not modified
+    :param armor_class: Armor class of the defender
+    :param resistances: Damage resistances of the defender
+    :param immunities: Damage immunities of the defender
+    :param attack_distance: Distance to the defender, applies range rules of ranged attacks if given
+    :param enemy_in_melee_range: Ranged attacks with an enemy in melee range have disadvantage,
+        defaults to the battle data of the action source
+    :param line_of_sight: Attacks on a defender behind a wall always fail
+    :return: AttackOdds
+    """
+    if not line_of_sight:
+        return _NO_CHANCE
+
+    disadvantage = action.disadvantage
+    if action.ranged_attack:
+        if enemy_in_melee_range is None and action.source is not None:
+            enemy_in_melee_range = action.source.battle_data.enemy_in_melee_range
+        if enemy_in_melee_range:
+            disadvantage = True
+
+        if attack_distance is None:
+            attack_distance = action.attack_distance
+        if attack_distance is not None:
+            if attack_distance > action.range_disadvantage:
+                return _NO_CHANCE
+            elif attack_distance > action.range:
+                disadvantage = True
+
+    if action.success is False:
+        return _NO_CHANCE
+
+    return _attack_odds(
+        ac_dice_notation=action.ac_dice_notation,
+        source_roll_dice_notation=action.source_roll_dice_notation,
+        advantage=action.advantage,
+        disadvantage=disadvantage,
+        armor_class=armor_class,
+        resisted=action.damage_type in (resistances or set()),
+        immune=action.damage_type in (immunities or set())
+    )
+
+
+def area_attack_odds(action: WeaponAttackAction,
+                     save_modifier: int = 0,
+                     resistances: Optional[Set[DamageType]] = None,
+                     immunities: Optional[Set[DamageType]] = None) -> AttackOdds:
+    """
+    Exact damage distribution of an area attack for one caught entity. Area attacks always hit,
+    a successful saving throw against the save DC of the action halves the damage.
+    Results are cached per (action signature, save modifier).
+
+    :param action: Area attack, it is not modified
+    :param save_modifier: Modifier of the caught entity for the save ability of the area
+    :param resistances: Damage resistances of the caught entity
+    :param immunities: Damage immunities of the caught entity
+    :return: AttackOdds
+    """
+    has_save = action.area_of_effect.save_ability is not None
+    return _area_attack_odds(
+        source_roll_dice_notation=action.source_roll_dice_notation,
+        save_dc=action.save_dc if has_save else None,
+        save_modifier=save_modifier if has_save else None,
+        resisted=action.damage_type in (resistances or set()),
+        immune=action.damage_type in (immunities or set())
+    )
@@ -0,0 +1,248 @@
+import json
+import os
+import queue
+import re
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from _game.mechanics.replay import JournalEntry, replay_journal
+from _game.mechanics.snapshot import (capture_snapshot, decode_journal_entry, encode_journal_entry, encode_snapshot,
+                                     load_snapshot)
+
+
+_CHECKPOINT_FILE = re.compile(r"checkpoint-(\d+)\.btsnap")
+_SEGMENT_FILE = re.compile(r"journal-(\d+)\.jsonl")
+
+
+def _checkpoint_path(directory: str, sequence: int) -> str:
+    return os.path.join(directory, f"checkpoint-{sequence:012d}.btsnap")
+
+
+def _segment_path(directory: str, sequence: int) -> str:
+    return os.path.join(directory, f"journal-{sequence:012d}.jsonl")
+
+
+def _numbered_files(directory: str, pattern: re.Pattern) -> List[Tuple[int, str]]:
+    if not os.path.isdir(directory):
+        return []
+    found = [(int(match.group(1)), os.path.join(directory, file_name))
+             for file_name in os.listdir(directory)
+             for match in [pattern.fullmatch(file_name)] if match is not None]
+    return sorted(found)
+
+
+class JournalWriter:
+    """
+    Append-only on-disk journal of a Battletracker, written by a background thread so callers never wait for I/O.
+
+    The directory holds checkpoints (snapshots) and journal segments, both numbered in the order they are written.
+    Every checkpoint starts a new segment, so recovery loads the latest checkpoint and replays only its segment.
+    Checkpoints leave out the journal before them, so their size and the recovery time do not grow with the battle.
+    The journal may get shorter between checkpoints, e.g. by an undo.
+    Older checkpoints and segments beyond keep_checkpoints are deleted. Files of a previous writer in the directory
+    are kept until the first checkpoint of this writer is written.
+
+    :param directory: Directory of the journal, created if missing
+    :param checkpoint_every: Journal entries between two checkpoints
+    :param keep_checkpoints: Checkpoints kept on disk, older ones serve as fallback for a damaged latest one
+    :param fsync: Force written data to disk after every batch, not only to the operating system
+    :param flush_interval: Seconds the writer collects entries before writing them as one batch,
+        at most that much of the journal is lost in a crash
+    """
+    def __init__(self,
+                 directory: str,
+                 checkpoint_every: int = 200,
+                 keep_checkpoints: int = 2,
+                 fsync: bool = False,
+                 flush_interval: float = 0.05):
+        if checkpoint_every < 1:
+            raise ValueError(f"Checkpoints must be at least one entry apart.\n"
+                             f"Delivered: {checkpoint_every!r}")
+        if keep_checkpoints < 1:
+            raise ValueError(f"At least one checkpoint must be kept.\n"
+                             f"Delivered: {keep_checkpoints!r}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.checkpoint_every = checkpoint_every
+        self.keep_checkpoints = keep_checkpoints
+        self.fsync = fsync
+        self.flush_interval = flush_interval
+        # Journal length at the latest checkpoint
+        self.last_checkpoint: Optional[int] = None
+        # Numbering continues after the files of a previous writer, so recovery prefers the files of this one.
+        self._sequence = max((sequence for sequence, _ in _numbered_files(directory, _CHECKPOINT_FILE)
+                              + _numbered_files(directory, _SEGMENT_FILE)), default=0)
+        self._first_sequence = self._sequence + 1
+
+        self._queue: queue.Queue = queue.Queue()
+        self._segment = None
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name="JournalWriter", daemon=True)
+        self._thread.start()
+
+    def _check(self):
+        if self._error is not None:
+            raise RuntimeError(f"Writing the journal to {self.directory!r} failed.") from self._error
+
+    def append(self, index: int, entry: JournalEntry):
+        """
+        Queue a journal entry, index is its position in the battle journal.
+        Entries are encoded by the writer, journal arguments must not be changed after journaling.
+        """
+        self._check()
+        self._queue.put(("entry", index, entry))
+
+    def checkpoint(self, bt):
+        """
+        Queue a snapshot of the battle and start a new segment after it.
+        Only the state is captured right away, it is encoded and compressed by the writer.
+        """
+        self._check()
+        self._sequence += 1
+        self._queue.put(("checkpoint", self._sequence, capture_snapshot(bt, journal=False)))
+        self.last_checkpoint = len(bt.battle_journal)
+
+    def flush(self):
+        """
+        Wait until everything queued so far is written.
+        """
+        self._queue.join()
+        self._check()
+
+    def close(self):
+        self._queue.put(("close",))
+        self._thread.join()
+        self._check()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Waking up for every entry would compete with the battle for the GIL, entries are collected instead.
+            if batch[0][0] != "close":
+                time.sleep(self.flush_interval)
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            closing = False
+            try:
+                if self._error is None:
+                    for task in batch:
+                        if task[0] == "entry":
+                            record = encode_journal_entry(task[2])
+                            record["index"] = task[1]
+                            self._segment.write(json.dumps(record, separators=(",", ":")) + "\n")
+                        elif task[0] == "checkpoint":
+                            self._write_checkpoint(task[1], encode_snapshot(*task[2]))
+                        else:
+                            closing = True
+                    if self._segment is not None:
+                        self._segment.flush()
+                        if self.fsync:
+                            os.fsync(self._segment.fileno())
+                else:
+                    closing = any(task[0] == "close" for task in batch)
+            except BaseException as e:
+                self._error = e
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if closing:
+                if self._segment is not None:
+                    self._segment.close()
+                return
+
+    def _write_checkpoint(self, sequence: int, data: bytes):
+        path = _checkpoint_path(self.directory, sequence)
+        # Written under a temporary name first, a crash never leaves a half written checkpoint behind.
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+        if self._segment is not None:
+            self._segment.close()
+        self._segment = open(_segment_path(self.directory, sequence), "a", encoding="utf-8")
+
+        # Files of a previous writer go once this writer has a checkpoint of its own.
+        checkpoints = _numbered_files(self.directory, _CHECKPOINT_FILE)
+        kept = [sequence for sequence, _ in checkpoints if sequence >= self._first_sequence][-self.keep_checkpoints:]
+        for sequence, old_path in checkpoints + _numbered_files(self.directory, _SEGMENT_FILE):
+            if sequence < kept[0]:
+                os.remove(old_path)
+
+
+def _read_segment(path: str) -> List[Tuple[int, JournalEntry]]:
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        lines = f.read().split("\n")
+    for number, line in enumerate(lines):
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            # Only the last line can be cut off by a crash, anything else is damage.
+            if number >= len(lines) - 2:
+                break
+            raise ValueError(f"Journal {path!r} is damaged in line {number + 1}.")
+        entries.append((record["index"], decode_journal_entry(record)))
+    return entries
+
+
+def has_journal(directory: str) -> bool:
+    return bool(_numbered_files(directory, _CHECKPOINT_FILE))
+
+
+def _journal_tail(directory: str, start: int, length: int) -> List[JournalEntry]:
+    """
+    Journal entries after the checkpoint start of the given journal length, undone entries left out.
+    """
+    tail: List[JournalEntry] = []
+    for sequence, path in _numbered_files(directory, _SEGMENT_FILE):
+        if sequence < start:
+            continue
+        for index, entry in _read_segment(path):
+            if index < length:
+                raise ValueError(f"Journal {path!r} was undone to before its checkpoint.")
+            if index > length + len(tail):
+                raise ValueError(f"Journal {path!r} misses the entries {length + len(tail)} to {index - 1}.")
+            # An index going back follows an undo, the entries from there on were undone.
+            del tail[index - length:]
+            tail.append(entry)
+    return tail
+
+
+def recover_battle(bt, directory: str):
+    """
+    Restore the battle of a journal directory into a freshly created Battletracker:
+    load the latest readable checkpoint and replay the journal written after it.
+    Undone entries in the journal are left out, no more than the tail after the checkpoint is replayed.
+
+    :return: The Battletracker
+    """
+    checkpoints = _numbered_files(directory, _CHECKPOINT_FILE)
+    if not checkpoints:
+        raise ValueError(f"No checkpoint found in {directory!r}.")
+
+    errors = []
+    fresh = bt
+    for start, path in reversed(checkpoints):
+        bt = fresh if not errors else fresh.__class__()
+        try:
+            with open(path, "rb") as f:
+                load_snapshot(bt, f.read())
+            tail = _journal_tail(directory, start, len(bt.battle_journal))
+            if bt.undo_history is not None:
+                # Undo reaches back to the checkpoint, the journal before it is not kept.
+                bt.undo_history.checkpoint(bt)
+            replay_journal(bt, tail)
+            return bt
+        except (ValueError, OSError, KeyError) as e:
+            errors.append(f"{os.path.basename(path)}: {e}")
+    raise ValueError(f"No readable checkpoint in {directory!r}.\n"
+                     f"Errors: {errors!r}")
@@ -1,34 +1,215 @@
-from typing import Optional, Union, List, Dict, Tuple, Any
-from copy import copy, deepcopy
+from typing import Optional, Union, List, Dict, Tuple, Any, BinaryIO
+from contextlib import nullcontext
+from copy import copy
+import heapq
+import os
+from random import Random
 
 from _game.base.environment import Environment, LocationMetric
+from _game.base.functionality import BattleRng, roll_dice_batch
+from _game.base.modifiers import Effect
+from _game.base.stats_abilities_and_settings import AreaShape
+from _game.base.weapons import BaseWeapon
 from _game.entities.base.entity import Entity
-from _game.entities.base.action import Action, ActionType, TargetType
+from _game.entities.base.action import Action, ActionType, TargetType, WeaponAttackAction
 from _game.base.environment import Location
-
-import streamlit as st
+from _game.mechanics.autosave import JournalWriter, has_journal, recover_battle
+from _game.mechanics.replay import JournalEntry, replay_journal
+from _game.mechanics.snapshot import dump_snapshot, load_snapshot
+from _game.mechanics.distance_matrix import DistanceMatrix
+from _game.mechanics.event_log import BattleEventLog
+from _game.mechanics.initiative import InitiativeQueue
+from _game.mechanics.pathfinding import Hex, StepCost, find_path, reachable_hexes
+from _game.mechanics.spatial_index import HexSpatialIndex, FEET_PER_HEX, is_hostile
+from _game.mechanics.suggestions import ActionSuggestion, rank_actions
+from _game.mechanics.undo import UndoHistory
 
 
 class Battletracker:
-    def __init__(self):
+    def __init__(self, seed: Optional[int] = None, rng: Optional[BattleRng] = None):
         self.enemy: Dict[int, Entity] = {}  # Enemy_id: Entity
-        self.turn_order = {}  # Turn: Entity
-        self.current_turn = -1
+        self.initiative = InitiativeQueue()
         self.current_round_number = -1
-        self.current_entity: Optional[Entity] = None
-        self.battle_log_actions = []
+        self._next_entity_id = 0
+        self._free_entity_ids: List[int] = []  # Heap of the IDs of removed entities
+        # Executed actions, the actions themselves are not kept alive.
+        self.event_log = BattleEventLog()
         self.environment: Environment = Environment()
-
-    def add_entity(self, entity: Entity, roll_health = False):
-        entity = deepcopy(entity)
+        # Placed entities by hex, keeps battle_data.enemy_in_melee_range up to date.
+        self.spatial_index = HexSpatialIndex()
+        # Pairwise distances of placed entities
+        self.distances = DistanceMatrix()
+
+        # Every random event draws from its own stream of the battle seed, so the journal replays bit-exact.
+        self.rng: BattleRng = rng if rng is not None else BattleRng(seed)
+        self.next_rng_stream = 0
+        # Entries before the checkpoint a battle was recovered from are None.
+        self.battle_journal: List[Optional[JournalEntry]] = []
+        # Counts every change of the battle state, including undo and redo, caches are keyed on it.
+        self.state_version = 0
+        # Background writer of the journal to disk, if autosave is enabled
+        self.autosave: Optional[JournalWriter] = None
+        # None while the battle is rebuilt for an undo
+        self.undo_history: Optional[UndoHistory] = UndoHistory()
+
+        self._suggestion_cache: Dict[Tuple[int, int, Tuple[int, ...]], List[ActionSuggestion]] = {}
+        self._reachable_cache: Dict[Tuple[int, int, int], Dict[Location, int]] = {}
+        # Heap of (expires_round, expires_turn, entity_id, effect_id) of all effects with a duration
+        self._effect_expiry: List[Tuple[int, int, int, int]] = []
+
+    @property
+    def turn_order(self) -> Dict[int, Entity]:
+        """
+        Turn: Entity, a snapshot of the initiative queue.
+        """
+        return dict(enumerate(self.initiative))
+
+    @property
+    def current_turn(self) -> int:
+        return self.initiative.cursor
+
+    @property
+    def current_entity(self) -> Optional[Entity]:
+        return self.initiative.current
+
+    @property
+    def seed(self) -> int:
+        return self.rng.seed
+
+    def _rng_stream(self, rng_stream: Optional[int] = None) -> Tuple[int, Random]:
+        if rng_stream is None:
+            rng_stream = self.next_rng_stream
+        self.next_rng_stream = max(self.next_rng_stream, rng_stream + 1)
+        return rng_stream, self.rng.stream(rng_stream)
+
+    def _journal(self, operation: str, rng_stream: Optional[int] = None, **arguments):
+        # Operations journal once their changes are done, so a checkpoint here matches the journal length.
+        entry = JournalEntry(operation=operation, arguments=arguments, rng_stream=rng_stream)
+        self.battle_journal.append(entry)
+        self.state_version += 1
+        if self.autosave is not None:
+            self.autosave.append(len(self.battle_journal) - 1, entry)
+            if len(self.battle_journal) - self.autosave.last_checkpoint >= self.autosave.checkpoint_every:
+                self.autosave.checkpoint(self)
+        if self.undo_history is not None:
+            self.undo_history.record(self, len(self.battle_journal) - 1)
+
+    def add_entity(self, entity: Entity, roll_health = False, *, rng_stream: Optional[int] = None) -> Entity:
+        template = entity
+        entity = entity.spawn()
+        rng_stream, rng = self._rng_stream(rng_stream)
         if roll_health:
-            entity.reroll_health_stats()
-
-        i = 0
-        while i in self.enemy:
-            i += 1
-        entity.battle_data.entity_id = i
-        self.enemy[i] = entity
+            entity.reroll_health_stats(rng=rng)
+
+        entity.battle_data.entity_id = self._allocate_entity_id()
+        self.enemy[entity.battle_data.entity_id] = entity
+
+        self._journal("add_entity", rng_stream, template=template, roll_health=roll_health, name=entity.name)
+        return entity
+
+    def add_entities(self,
+                     entity: Entity,
+                     count: int,
+                     roll_health: bool = False,
+                     placement: Optional[List[Tuple[int, int]]] = None,
+                     roll_initiative: bool = False,
+                     metric: LocationMetric = LocationMetric.HEX_BASE_60,
+                     *,
+                     rng_stream: Optional[int] = None) -> List[Entity]:
+        """
+        Add a group of the same template in one call, e.g. a horde of goblins.
+
+        :param entity: Template to spawn
+        :param count: Number of entities
+        :param roll_health: Roll the hit points of the whole group in one batch
+        :param placement: (x, y) of every entity, None to leave them unplaced
+        :param roll_initiative: Roll one initiative for the group and insert it into the turn order
+        :return: The added entities in order of their IDs
+        """
+        if count < 0:
+            raise ValueError(f"Number of entities must not be negative.\n"
+                             f"Delivered: {count!r}")
+        if placement is not None and len(placement) != count:
+            raise ValueError(f"Placement needs one location per entity.\n"
+                             f"Delivered: {len(placement)} locations for {count} entities")
+        template = entity
+        rng_stream, rng = self._rng_stream(rng_stream)
+
+        entities = [template.spawn() for _ in range(count)]
+        for entity in entities:
+            entity.battle_data.entity_id = self._allocate_entity_id()
+            self.enemy[entity.battle_data.entity_id] = entity
+
+        rule_rolls = template.hit_points.rule_rolls
+        if roll_health and rule_rolls is not None and entities:
+            rolls = roll_dice_batch(rule_rolls, count, rng=self.rng.numpy_stream(rng_stream)).total_rolls
+            for entity, roll in zip(entities, rolls.tolist()):
+                entity.hit_points.play_max = roll
+                entity.hit_points.play_max_modifier = 0
+                entity.hit_points.current = roll
+
+        if placement is not None:
+            for entity, (x, y) in zip(entities, placement):
+                entity.battle_data.location = Location(x=x, y=y, metric=metric)
+                self._locate(entity)
+
+        if roll_initiative and entities:
+            initiative = template.roll_initiative(rng=rng)
+            for entity in entities:
+                entity.battle_data.initiative = initiative
+            self.initiative.insert_many(entities)
+
+        self._journal("add_entities", rng_stream, template=template, count=count, roll_health=roll_health,
+                      placement=None if placement is None else [tuple(p) for p in placement],
+                      roll_initiative=roll_initiative, metric=metric, names=[e.name for e in entities])
+        return entities
+
+    def _allocate_entity_id(self) -> int:
+        # IDs of removed entities are handed out again, lowest first, all of them are below the counter.
+        if self._free_entity_ids:
+            return heapq.heappop(self._free_entity_ids)
+        entity_id = self._next_entity_id
+        self._next_entity_id += 1
+        return entity_id
+
+    def add_weapon(self, entity: Union[Entity, int], weapon: BaseWeapon):
+        entity = self.enemy[entity if isinstance(entity, int) else entity.battle_data.entity_id]
+        entity.add_weapon(weapon)
+        self._journal("add_weapon", entity_id=entity.battle_data.entity_id, weapon=weapon)
+
+    def drop_weapon(self, entity: Union[Entity, int], weapon: BaseWeapon) -> Optional[BaseWeapon]:
+        entity = self.enemy[entity if isinstance(entity, int) else entity.battle_data.entity_id]
+        dropped = entity.drop_weapon(weapon)
+        self._journal("drop_weapon", entity_id=entity.battle_data.entity_id, weapon=weapon)
+        return dropped
+
+    def add_effect(self, entity: Union[Entity, int], effect: Effect) -> int:
+        """
+        Apply a buff or debuff. Effects with a duration are removed when their round and turn is reached.
+
+        :return: Effect ID of the entity
+        """
+        entity = self.enemy[entity if isinstance(entity, int) else entity.battle_data.entity_id]
+        effect_id = entity.add_effect(effect)
+        if effect.expires is not None:
+            heapq.heappush(self._effect_expiry, (*effect.expires, entity.battle_data.entity_id, effect_id))
+        self._journal("add_effect", entity_id=entity.battle_data.entity_id, effect=effect)
+        return effect_id
+
+    def remove_effect(self, entity: Union[Entity, int], effect_id: int) -> Effect:
+        entity = self.enemy[entity if isinstance(entity, int) else entity.battle_data.entity_id]
+        removed = entity.remove_effect(effect_id)
+        self._journal("remove_effect", entity_id=entity.battle_data.entity_id, effect_id=effect_id)
+        return removed
+
+    def _expire_effects(self):
+        now = (self.current_round_number, self.current_turn)
+        while self._effect_expiry and self._effect_expiry[0][:2] <= now:
+            _, _, entity_id, effect_id = heapq.heappop(self._effect_expiry)
+            # Effect IDs are never reused, effects removed by hand are simply skipped.
+            entity = self.enemy.get(entity_id)
+            if entity is not None and effect_id in entity.modifiers.effects:
+                entity.remove_effect(effect_id)
 
     def place_entity(self,
                      entity: Union[Entity, int],
@@ -42,6 +223,136 @@ class Battletracker:
 
         location = Location(x=x, y=y, metric=metric)
         entity.battle_data.location=location
+        self._locate(entity)
+        self._journal("place_entity", entity_id=entity.battle_data.entity_id, x=x, y=y, metric=metric)
+
+    def _locate(self, entity: Entity):
+        location = entity.battle_data.location
+        self.environment.move_occupant(self.spatial_index.position(entity.battle_data.entity_id),
+                                       (location.x, location.y))
+        self.spatial_index.place(entity)
+        self.distances.place(entity.battle_data.entity_id, location.x, location.y)
+
+    def distance(self, entity: Union[Entity, int], other: Union[Entity, int]) -> Optional[int]:
+        """
+        Distance in feet between two entities, None if either is not placed.
+        """
+        return self.distances.distance(entity if isinstance(entity, int) else entity.battle_data.entity_id,
+                                       other if isinstance(other, int) else other.battle_data.entity_id)
+
+    def set_movement_cost(self,
+                          x: int,
+                          y: int,
+                          movement_cost: Optional[int],
+                          metric: LocationMetric = LocationMetric.HEX_BASE_60):
+        """
+        :param movement_cost: Multiplier on the movement needed to enter the square, None if impassable
+        """
+        self.environment.set_movement_cost(Location(x=x, y=y, metric=metric), movement_cost)
+        self._journal("set_movement_cost", x=x, y=y, movement_cost=movement_cost, metric=metric)
+
+    def set_wall(self, x: int, y: int, wall: bool = True, metric: LocationMetric = LocationMetric.HEX_BASE_60):
+        """
+        Walls block movement and line of sight.
+        """
+        self.environment.set_wall(Location(x=x, y=y, metric=metric), wall)
+        self._journal("set_wall", x=x, y=y, wall=wall, metric=metric)
+
+    def line_of_sight(self, origin: Union[Entity, Location], target: Union[Entity, Location]) -> bool:
+        """
+        True if no wall stands between both, unplaced entities are always in sight.
+        """
+        origin = origin.battle_data.location if isinstance(origin, Entity) else origin
+        target = target.battle_data.location if isinstance(target, Entity) else target
+        if origin is None or target is None:
+            return True
+        return self.environment.line_of_sight(origin, target)
+
+    def _step_cost(self, entity: Entity) -> StepCost:
+        environment = self.environment
+        spatial_index = self.spatial_index
+
+        def step_cost(hexagon: Hex) -> Optional[int]:
+            movement_cost = environment.movement_cost(*hexagon)
+            if movement_cost is None or any(is_hostile(entity, other) for other in spatial_index.at(hexagon)):
+                return None
+            return FEET_PER_HEX * movement_cost
+        return step_cost
+
+    def _can_stop(self, entity: Entity, hexagon: Hex) -> bool:
+        occupancy = self.environment.map.get("occupancy", *hexagon)
+        return occupancy == 0 or (occupancy == 1 and
+                                  self.spatial_index.position(entity.battle_data.entity_id) == hexagon)
+
+    def remaining_movement(self, entity: Optional[Entity] = None) -> int:
+        entity = entity if entity is not None else self.current_entity
+        return max(entity.speed - entity.battle_data.movement_used, 0)
+
+    def reachable_hexes(self, entity: Optional[Entity] = None) -> Dict[Location, int]:
+        """
+        Every location the entity can end its movement on with its remaining movement.
+        Hostile entities and impassable terrain block, other entities can be passed but not ended on.
+        Results are cached until the battle state changes, i.e. until the next journal entry.
+
+        :return: Location: movement cost in feet
+        """
+        entity = entity if entity is not None else self.current_entity
+        location = entity.battle_data.location
+        if location is None:
+            raise ValueError(f"Entity {entity.description_short()} is not placed.")
+
+        key = (entity.battle_data.entity_id, self.state_version, self.remaining_movement(entity))
+        if key not in self._reachable_cache:
+            # Older states can never be asked for again.
+            self._reachable_cache = {k: v for k, v in self._reachable_cache.items() if k[1] == key[1]}
+            reachable = reachable_hexes(start=(location.x, location.y),
+                                        budget=self.remaining_movement(entity),
+                                        step_cost=self._step_cost(entity),
+                                        can_stop=lambda hexagon: self._can_stop(entity, hexagon))
+            self._reachable_cache[key] = {Location(x=x, y=y, metric=location.metric): cost
+                                          for (x, y), cost in reachable.items()}
+        return self._reachable_cache[key]
+
+    def find_path(self, entity: Union[Entity, int], x: int, y: int) -> Optional[Tuple[List[Location], int]]:
+        """
+        Cheapest path within the remaining movement of the entity.
+
+        :return: Locations from the current one to the goal and the cost in feet, None if out of reach
+        """
+        entity = self.enemy[entity if isinstance(entity, int) else entity.battle_data.entity_id]
+        location = entity.battle_data.location
+        if location is None:
+            raise ValueError(f"Entity {entity.description_short()} is not placed.")
+        if not self._can_stop(entity, (x, y)):
+            return None
+
+        found = find_path(start=(location.x, location.y),
+                          goal=(x, y),
+                          step_cost=self._step_cost(entity),
+                          budget=self.remaining_movement(entity))
+        if found is None:
+            return None
+        path, cost = found
+        return [Location(x=px, y=py, metric=location.metric) for px, py in path], cost
+
+    def move_entity(self, entity: Union[Entity, int], x: int, y: int) -> int:
+        """
+        Move along the cheapest path, using up movement of the current turn.
+
+        :return: Movement cost in feet
+        """
+        entity = self.enemy[entity if isinstance(entity, int) else entity.battle_data.entity_id]
+        found = self.find_path(entity, x, y)
+        if found is None:
+            raise ValueError(f"Location x({x}), y({y}) not reachable for {entity.description_short()} "
+                             f"with {self.remaining_movement(entity)} feet of movement left.")
+        path, cost = found
+
+        entity.battle_data.location = path[-1]
+        entity.battle_data.movement_used += cost
+        self._locate(entity)
+        self._journal("move_entity", entity_id=entity.battle_data.entity_id, x=x, y=y)
+        return cost
 
     def remove_entity(self, entity: Union[Entity, str]):
         if isinstance(entity, int):
@@ -51,63 +362,52 @@ class Battletracker:
 
         # Inherit turn if entity is removed.
         if self.current_entity is not None and self.current_entity.battle_data.entity_id == entity_id:
-            self.set_next_player()
-
-        turn = 0
-        new_order = {}
-        enemy_removed = True
-        for key, value in self.turn_order.items():
-
-            if entity_id == value.battle_data.entity_id:
-                enemy_removed = True
-                continue
-
-            if key == self.current_turn:
-                if enemy_removed:
-                    self.current_turn -= 1
-
-            new_order[turn] = value
-            turn += 1
-
-        if self.current_turn == len(new_order):
-            self.current_turn -= 1
+            self._advance_turn()
 
-        self.turn_order = new_order
+        if entity_id in self.initiative:
+            self.initiative.remove(entity_id)
         self.enemy.pop(entity_id)
-
-    def _reorder_initiative(self):
-        init = [[e.battle_data.initiative ,e] for e in self.enemy.values()]
-        init = sorted(init, key=lambda x: x[0], reverse=True)
-
-        i = 0
-        for initiative, enemy in init:
-            self.turn_order[i] = enemy
-            i += 1
-
-    def roll_initiative_for_all(self):
+        heapq.heappush(self._free_entity_ids, entity_id)
+        self.environment.move_occupant(self.spatial_index.position(entity_id), None)
+        self.spatial_index.remove(entity_id)
+        self.distances.remove(entity_id)
+
+        # Entity IDs are reused, pending expiries must not hit the next entity with this ID.
+        self._effect_expiry = [e for e in self._effect_expiry if e[2] != entity_id]
+        heapq.heapify(self._effect_expiry)
+        self._journal("remove_entity", entity_id=entity_id)
+
+    def roll_initiative_for_all(self, *, rng_stream: Optional[int] = None):
+        rng_stream, rng = self._rng_stream(rng_stream)
+        current = self.current_entity
+        self.initiative.clear()
         for enemy in self.enemy.values():
-            enemy.battle_data.initiative = enemy.roll_initiative()
-        self._reorder_initiative()
-
-    def roll_initiative_for_added_entities(self):
+            enemy.battle_data.initiative = enemy.roll_initiative(rng=rng)
+            self.initiative.insert(enemy)
+        if current is not None:
+            self.initiative.cursor = self.initiative.turn_of(current.battle_data.entity_id)
+        self._journal("roll_initiative_for_all", rng_stream)
+
+    def roll_initiative_for_added_entities(self, *, rng_stream: Optional[int] = None):
+        rng_stream, rng = self._rng_stream(rng_stream)
         for enemy in self.enemy.values():
             if enemy.battle_data.initiative is None:
-                enemy.battle_data.initiative = enemy.roll_initiative()
-        self._reorder_initiative()
+                enemy.battle_data.initiative = enemy.roll_initiative(rng=rng)
+                self.initiative.insert(enemy)
+        self._journal("roll_initiative_for_added_entities", rng_stream)
 
-    def get_turn_order(self) -> List[List[Tuple[int, Entity]]]:
-        ret = [[turn, entity] for turn, entity in self.turn_order.items() if turn >= self.current_turn]
-        turn = 0
-        while turn < self.current_turn:
-            ret.append([turn, self.turn_order[turn]])
-            turn += 1
-        return ret
+    def get_turn_order(self, k: Optional[int] = None) -> List[Tuple[int, Entity]]:
+        """
+        The next k turns starting with the current one, the whole round if k is None.
+        """
+        return self.initiative.upcoming(k)
 
 
     def mutate_initiative_rolls(self, initiatives: Dict[int, int]):
         for id, initiative in initiatives.items():
             self.enemy[id].battle_data.initiative = initiative
-        self._reorder_initiative()
+            self.initiative.insert(self.enemy[id])
+        self._journal("mutate_initiative_rolls", initiatives=dict(initiatives))
 
     def get_current_round_number(self) -> int:
         return self.current_round_number
@@ -118,18 +418,39 @@ class Battletracker:
     def get_current_entity(self) -> Entity:
         return self.current_entity
 
+    def entities_within(self, origin: Union[Entity, Location], feet: int) -> List[Entity]:
+        """
+        Placed entities within the given distance of an entity (itself included) or location.
+        """
+        location = origin.battle_data.location if isinstance(origin, Entity) else origin
+        return self.spatial_index.within(location, feet)
+
+    def nearest_hostile(self, entity: Union[Entity, int], max_feet: Optional[int] = None) -> Optional[Entity]:
+        """
+        Closest placed entity of another character type that is not down.
+        """
+        entity = self.enemy[entity if isinstance(entity, int) else entity.battle_data.entity_id]
+        return self.spatial_index.nearest_hostile(entity, max_feet=max_feet)
+
     def get_enemies(self):
         return list(self.enemy.values())
 
     def set_next_player(self):
-        self.current_turn = self.current_turn + 1 if self.current_turn + 1 < len(self.turn_order) else 0
-        self.current_round_number = self.current_round_number + 1 if self.current_turn == 0 else self.current_round_number
-        self.current_entity = self.turn_order[self.current_turn]
+        self._advance_turn()
+        self._journal("set_next_player")
+
+    def _advance_turn(self):
+        current_entity, new_round = self.initiative.advance()
+        if new_round:
+            self.current_round_number += 1
+        current_entity.battle_data.movement_used = 0
+        self._expire_effects()
 
     def set_previous_player(self):
-        self.current_round_number = self.current_round_number if not self.current_turn == 0 else self.current_round_number - 1
-        self.current_turn = self.current_turn - 1 if not self.current_turn == 0 else len(self.turn_order) - 1
-        self.current_entity = self.turn_order[self.current_turn]
+        _, previous_round = self.initiative.rewind()
+        if previous_round:
+            self.current_round_number -= 1
+        self._journal("set_previous_player")
 
     def get_actions(self,
                     source: Optional[Entity] = None,
@@ -169,20 +490,57 @@ class Battletracker:
             )
         return actions
 
-    def _prime_action(self, action: Action) -> Action:
+    def suggest_actions(self,
+                        entity: Optional[Entity] = None,
+                        targets: Optional[List[int]] = None) -> List[ActionSuggestion]:
+        """
+        Rank every action and bonus action of an entity against every target by expected damage and kill chance.
+        Rankings are cached until the battle state changes.
+
+        :param entity: Entity to suggest actions for, defaults to the current entity
+        :param targets: Entity IDs of possible targets, defaults to every other entity that is not dead
+        :return: Suggestions sorted by descending score
+        """
+        entity = entity if entity is not None else self.current_entity
+        if targets is None:
+            targets = [i for i, e in self.enemy.items()
+                       if e is not entity and not e.hit_points.dead and e.hit_points.current > 0]
+
+        key = (entity.battle_data.entity_id, self.state_version, tuple(targets))
+        if key not in self._suggestion_cache:
+            # Older states can never be asked for again.
+            self._suggestion_cache = {k: v for k, v in self._suggestion_cache.items() if k[1] == key[1]}
+            self._suggestion_cache[key] = rank_actions(
+                source=entity,
+                actions=[self.get_actions(source=entity), self.get_bonus_actions(source=entity)],
+                targets=[self.enemy[i] for i in targets],
+                distances={i: self.distance(entity, i) for i in targets},
+                line_of_sight={i: self.line_of_sight(entity, self.enemy[i]) for i in targets},
+                area_targets=lambda action, aim: self.area_targets(action, aim) if self.can_aim(action, aim) else None
+            )
+        return self._suggestion_cache[key]
+
+    def _prime_action(self, action: Action, rng_stream: Optional[int] = None) -> Action:
         action.primed = True
+        action.rng_stream, rng = self._rng_stream(rng_stream)
 
         if action.action_type in {
             ActionType.WEAPON_ATTACK_MELEE,
             ActionType.WEAPON_ATTACK_RANGED,
             ActionType.WEAPON_ATTACK_THROW
         }:
+            if action.attack_distance is None and action.target_type == TargetType.ENTITY:
+                distance = self.distance(action.source, action.target)
+                if distance is not None:
+                    action.set_attack_distance(distance)
             action.apply_environment_effects()
+            if action.target_type == TargetType.ENTITY and not self.line_of_sight(action.source, action.target):
+                action.success = False
 
-            action.roll_ac()
+            action.roll_ac(rng=rng)
             action.check_attack_success(defender_ac=action.target.armor_class)
 
-            action.roll_source()
+            action.roll_source(rng=rng)
             action.apply_resistance_and_immunity(
                 resistances=action.target.damage_resistances,
                 immunities=action.target.damage_immunity
@@ -194,13 +552,26 @@ class Battletracker:
                              f"Implement actionType in {self.__class__.__name__} '_apply_action.'")
         return action
 
-    def get_targets(self, target: Union[TargetType, List[TargetType]]):
+    def get_targets(self, target: Union[TargetType, List[TargetType]], action: Optional[Action] = None):
+        """
+        Selectable targets by description.
+
+        :param target: Allowed target types of the action
+        :param action: Area attacks only get the locations they can be aimed at
+        """
         target_types = target if isinstance(target, list) else [target]
 
         targets = {}
         if TargetType.ENTITY in target_types:
             entity_targets = {enemy.description_short(): [TargetType.ENTITY, id] for id, enemy in self.enemy.items()}
             targets.update(entity_targets)
+        if TargetType.LOCATION in target_types:
+            location_targets = {f"Location {enemy.battle_data.location} of {enemy.description_short()}":
+                                    [TargetType.LOCATION, enemy.battle_data.location]
+                                for enemy in self.enemy.values() if enemy.battle_data.location is not None
+                                and (not isinstance(action, WeaponAttackAction) or action.area_of_effect is None
+                                     or self.can_aim(action, enemy.battle_data.location))}
+            targets.update(location_targets)
         if TargetType.ENVIRONMENT_WEAPON in target_types:
             environment_weapon_targets = {description: [TargetType.ENVIRONMENT_WEAPON, w_id]
                                           for description, w_id in self.environment.spot_weapons().items()}
@@ -224,7 +595,9 @@ class Battletracker:
 
     def prime_action(self,
                      action: Action,
-                     targets: Union[List[Tuple[TargetType, Any]], Tuple[TargetType, Any]] = None) -> List[Action]:
+                     targets: Union[List[Tuple[TargetType, Any]], Tuple[TargetType, Any]] = None,
+                     *,
+                     rng_stream: Optional[int] = None) -> List[Action]:
         if targets is None:
             targets = [None]
         else:
@@ -233,22 +606,98 @@ class Battletracker:
 
         primed_actions = []
         for target in targets:
+            if action.action_type == ActionType.WEAPON_ATTACK_AREA:
+                if target is None or target[0] != TargetType.LOCATION:
+                    raise ValueError(f"Area attacks need a location to aim at.\n"
+                                     f"Delivered: {target!r}")
+                primed_actions.extend(self._prime_area_action(action, target[1], rng_stream=rng_stream))
+                continue
             action = copy(action)
             action = self.set_target(action, target)
-            primed_actions.append(self._prime_action(action))
+            primed_actions.append(self._prime_action(action, rng_stream=rng_stream))
 
         return primed_actions
 
+    def _aim(self, action: WeaponAttackAction, aim: Union[Location, Tuple[int, int]]) -> Location:
+        origin = action.source.battle_data.location
+        if origin is None:
+            raise ValueError(f"Entity {action.source.description_short()} is not placed.")
+        if not isinstance(aim, Location):
+            aim = Location(x=aim[0], y=aim[1], metric=origin.metric)
+        if action.area_of_effect.shape == AreaShape.BURST and action.range is not None \
+                and origin.distance(aim) > action.range:
+            raise ValueError(f"Aim {aim} out of range {action.range} of {action.weapon.name}.")
+        if action.area_of_effect.shape != AreaShape.BURST and (aim.x, aim.y) == (origin.x, origin.y):
+            raise ValueError(f"A {action.area_of_effect.shape.name} needs an aim different from its origin.\n"
+                             f"Delivered: {aim}")
+        return aim
+
+    def can_aim(self, action: WeaponAttackAction, aim: Union[Location, Tuple[int, int]]) -> bool:
+        """
+        Whether an area attack can be aimed at a location, i.e. area_targets and prime_action accept it.
+        """
+        try:
+            self._aim(action, aim)
+        except ValueError:
+            return False
+        return True
+
+    def area_targets(self, action: WeaponAttackAction, aim: Union[Location, Tuple[int, int]]) -> List[Entity]:
+        """
+        Placed entities caught by the template of an area attack, in one vectorized test over all of them.
+        Walls shelter entities from the point the area spreads from, the aim of bursts and the attacker otherwise.
+        """
+        aim = self._aim(action, aim)
+        origin = action.source.battle_data.location
+        coordinates = self.distances.coordinates
+        caught = action.area_of_effect.mask((origin.x, origin.y), (aim.x, aim.y),
+                                            coordinates[:, 0], coordinates[:, 1])
+        spread_from = aim if action.area_of_effect.shape == AreaShape.BURST else origin
+        return [self.enemy[entity_id] for entity_id in sorted(self.distances.entity_ids[caught].tolist())
+                if self.line_of_sight(spread_from, self.enemy[entity_id])]
+
+    def _prime_area_action(self,
+                           action: WeaponAttackAction,
+                           aim: Union[Location, Tuple[int, int]],
+                           rng_stream: Optional[int] = None) -> List[Action]:
+        aim = self._aim(action, aim)
+        caught = self.area_targets(action, aim)
+
+        # Damage is rolled once for everyone caught, saving throws follow in order of entity ID.
+        area_action = copy(action)
+        area_action.primed = True
+        area_action.aim = aim
+        area_action.rng_stream, rng = self._rng_stream(rng_stream)
+        area_action.roll_source(rng=rng)
+
+        save_ability = action.area_of_effect.save_ability
+        primed_actions = []
+        for target in caught:
+            primed = copy(area_action)
+            primed.target_type = TargetType.ENTITY
+            primed.target = target
+            primed.success = True
+            if save_ability is not None:
+                primed.roll_save(target.ability_scores[save_ability].modifier, rng=rng)
+            primed.apply_resistance_and_immunity(
+                resistances=target.damage_resistances,
+                immunities=target.damage_immunity
+            )
+            primed_actions.append(primed)
+        return primed_actions
+
     def _execute_action(self, action: Action) -> Action:
         action.executed = True
 
         if action.action_type in {
             ActionType.WEAPON_ATTACK_MELEE,
             ActionType.WEAPON_ATTACK_RANGED,
-            ActionType.WEAPON_ATTACK_THROW
+            ActionType.WEAPON_ATTACK_THROW,
+            ActionType.WEAPON_ATTACK_AREA
         }:
             if action.success:
                 action.target.hit_points.apply_damage(action.source_roll)
+                self.spatial_index.refresh(action.target)
 
             if action.action_type == ActionType.WEAPON_ATTACK_THROW:
                 drop = action.source.drop_weapon(action.weapon)
@@ -264,15 +713,43 @@ class Battletracker:
             raise ValueError(f"ActionType '{action.action_type}' not recognized. "
                              f"Implement actionType in {self.__class__.__name__} '_apply_action.'")
 
-        if action.source is not None:
-            action.source.battle_data.actions_taken.append(action)
-        if action.target is not None and action.target_type == TargetType.ENTITY:
-            action.target.battle_data.actions_affected_by.append(action)
-        self.battle_log_actions.append(action)
+        self._log_event(action)
+
+        self._journal(
+            "execute_action",
+            action.rng_stream,
+            source_id=action.source.battle_data.entity_id,
+            action_type=action.action_type,
+            bonus_action=action.bonus_action,
+            weapon=getattr(action, "weapon", None),
+            target_type=action.target_type,
+            target=action.target.battle_data.entity_id if action.target_type == TargetType.ENTITY else action.target,
+            aim=getattr(action, "aim", None)
+        )
         return action
 
+    def _log_event(self, action: Action):
+        targets_entity = action.target is not None and action.target_type == TargetType.ENTITY
+        weapon = getattr(action, "weapon", None)
+        if action.action_type == ActionType.ENVIRONMENT_ACTION_PICK_UP_WEAPON:
+            hit, damage, detail = None, 0, action.target[1] if action.target is not None else None
+        else:
+            hit, damage, detail = action.success, 0, weapon.name if weapon is not None else None
+            if action.success and action.source_roll is not None:
+                damage = max(action.source_roll.total_roll, 0)
+        self.event_log.append(round_number=self.current_round_number,
+                              turn=self.current_turn,
+                              source_id=action.source.battle_data.entity_id if action.source is not None else None,
+                              target_id=action.target.battle_data.entity_id if targets_entity else None,
+                              action_type=action.action_type,
+                              hit=hit,
+                              crit=bool(getattr(action, "crit_roll", False)),
+                              damage=damage,
+                              detail=detail)
+
     def execute_actions(self, actions: List[Action]) -> List[Action]:
-        return [self._execute_action(action) for action in actions]
+        with self.undo_step():
+            return [self._execute_action(action) for action in actions]
 
     def full_action(self,
                     action: Action,
@@ -287,10 +764,120 @@ class Battletracker:
     def remove_player(self):
         raise NotImplementedError()
 
-    def save_battle_data(self):
-        raise NotImplementedError()
-
-    def load_battle_data(self, file):
-        raise NotImplementedError()
-
-
+    def replay(self, upto: Optional[int] = None) -> 'Battletracker':
+        """
+        Rebuild the battle from its seed by re-executing the first upto journal entries (all if None).
+        """
+        battle = Battletracker(rng=BattleRng(self.rng.seed, self.rng.spawn_key))
+        replay_journal(battle, self.battle_journal[:upto])
+        return battle
+
+    @property
+    def can_undo(self) -> bool:
+        return self.undo_history is not None and self.undo_history.undo_steps > 0
+
+    @property
+    def can_redo(self) -> bool:
+        return self.undo_history is not None and self.undo_history.redo_steps > 0
+
+    def undo_step(self):
+        """
+        Context in which all journaled changes form a single undo step.
+        """
+        return self.undo_history.step() if self.undo_history is not None else nullcontext()
+
+    def undo(self, steps: int = 1) -> int:
+        """
+        Undo the last steps, a step is one journaled call, e.g. a turn change, or all actions of one execution.
+        Entities and actions held from before the undo are outdated, they have to be fetched again.
+
+        :return: Number of undone steps
+        """
+        if not self.can_undo:
+            return 0
+        undone = min(steps, self.undo_history.undo_steps)
+        self._take_state(self.undo_history.undo(self, steps))
+        return undone
+
+    def redo(self, steps: int = 1) -> int:
+        """
+        Redo the last undone steps, until anything else is journaled.
+
+        :return: Number of redone steps
+        """
+        if self.undo_history is None:
+            return 0
+        return self.undo_history.redo(self, steps)
+
+    def _take_state(self, other: 'Battletracker'):
+        undo_history, autosave, state_version = self.undo_history, self.autosave, self.state_version
+        self.__dict__.update(vars(other))
+        self.undo_history, self.autosave = undo_history, autosave
+        # The journal may have the same length as before with a different state.
+        self.state_version = state_version + 1
+        if self.autosave is not None:
+            # The journal got shorter, the autosave continues from a checkpoint of the current state.
+            self.autosave.checkpoint(self)
+
+    def save_battle_data(self, file: Optional[Union[str, os.PathLike, BinaryIO]] = None) -> bytes:
+        """
+        Snapshot of the whole battle: entities as deltas to their templates, initiative, environment, log and journal.
+
+        :param file: Path or binary file to write the snapshot to, if any
+        :return: The snapshot
+        """
+        data = dump_snapshot(self)
+        if isinstance(file, (str, os.PathLike)):
+            with open(file, "wb") as f:
+                f.write(data)
+        elif file is not None:
+            file.write(data)
+        return data
+
+    def enable_autosave(self, directory: Union[str, os.PathLike], checkpoint_every: int = 200, fsync: bool = False):
+        """
+        Write the journal to the directory in the background, with a checkpoint every checkpoint_every entries.
+        Files of an earlier journal in the directory are removed once the first checkpoint of this battle is written.
+        """
+        self.close_autosave()
+        self.autosave = JournalWriter(os.fspath(directory), checkpoint_every=checkpoint_every, fsync=fsync)
+        self.autosave.checkpoint(self)
+
+    def close_autosave(self):
+        """
+        Finish writing the journal and stop autosaving.
+        """
+        if self.autosave is not None:
+            autosave, self.autosave = self.autosave, None
+            autosave.close()
+
+    @staticmethod
+    def has_autosave(directory: Union[str, os.PathLike]) -> bool:
+        return has_journal(os.fspath(directory))
+
+    @staticmethod
+    def recover_battle(directory: Union[str, os.PathLike]) -> 'Battletracker':
+        """
+        Battletracker restored from an autosave directory: the latest checkpoint plus the journal written after it.
+        Autosave is not enabled on the restored battle.
+        """
+        return recover_battle(Battletracker(), os.fspath(directory))
+
+    @staticmethod
+    def load_battle_data(file: Union[bytes, str, os.PathLike, BinaryIO]) -> 'Battletracker':
+        """
+        Battletracker restored from a snapshot of save_battle_data.
+
+        :param file: Snapshot, or path or binary file to read it from
+        """
+        if isinstance(file, (str, os.PathLike)):
+            with open(file, "rb") as f:
+                data = f.read()
+        elif isinstance(file, (bytes, bytearray)):
+            data = bytes(file)
+        else:
+            data = file.read()
+        bt = load_snapshot(Battletracker(), data)
+        # Undo reaches back to the loaded state, not beyond it.
+        bt.undo_history.checkpoint(bt)
+        return bt
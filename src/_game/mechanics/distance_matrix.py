@@ -0,0 +1,101 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from _game.mechanics.spatial_index import FEET_PER_HEX
+
+
+class DistanceMatrix:
+    """
+    Hex distances in feet between all placed entities.
+    Moving an entity updates its row and column in O(n), removing one moves the last entity into its slot.
+    """
+    def __init__(self, capacity: int = 16):
+        self._rows: Dict[int, int] = {}  # Entity ID: row
+        self._entity_ids = np.zeros(capacity, dtype=np.int64)
+        self._coordinates = np.zeros((capacity, 2), dtype=np.int64)
+        self._distances = np.zeros((capacity, capacity), dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, entity_id: int) -> bool:
+        return entity_id in self._rows
+
+    def _grow(self):
+        capacity = 2 * len(self._entity_ids)
+        n = len(self._rows)
+        entity_ids = np.zeros(capacity, dtype=np.int64)
+        entity_ids[:n] = self._entity_ids[:n]
+        coordinates = np.zeros((capacity, 2), dtype=np.int64)
+        coordinates[:n] = self._coordinates[:n]
+        distances = np.zeros((capacity, capacity), dtype=np.int64)
+        distances[:n, :n] = self._distances[:n, :n]
+        self._entity_ids, self._coordinates, self._distances = entity_ids, coordinates, distances
+
+    def place(self, entity_id: int, x: int, y: int):
+        row = self._rows.get(entity_id)
+        if row is None:
+            if len(self._rows) == len(self._entity_ids):
+                self._grow()
+            row = self._rows[entity_id] = len(self._rows)
+            self._entity_ids[row] = entity_id
+        self._coordinates[row] = (x, y)
+
+        n = len(self._rows)
+        dx = self._coordinates[:n, 0] - x
+        dy = self._coordinates[:n, 1] - y
+        distances = FEET_PER_HEX * ((np.abs(dx) + np.abs(dy) + np.abs(dx + dy)) // 2)
+        self._distances[row, :n] = distances
+        self._distances[:n, row] = distances
+
+    def remove(self, entity_id: int):
+        row = self._rows.pop(entity_id, None)
+        if row is None:
+            return
+        last = len(self._rows)
+        if row != last:
+            moved_id = int(self._entity_ids[last])
+            self._rows[moved_id] = row
+            self._entity_ids[row] = moved_id
+            self._coordinates[row] = self._coordinates[last]
+            self._distances[row, :last + 1] = self._distances[last, :last + 1]
+            self._distances[:last + 1, row] = self._distances[:last + 1, last]
+            self._distances[row, row] = 0
+
+    def distance(self, entity_id: int, other_id: int) -> Optional[int]:
+        """
+        Distance in feet, None if either entity is not placed.
+        """
+        row, column = self._rows.get(entity_id), self._rows.get(other_id)
+        if row is None or column is None:
+            return None
+        return int(self._distances[row, column])
+
+    @property
+    def entity_ids(self) -> np.ndarray:
+        """
+        Entity IDs in row order, aligned with row().
+        """
+        return self._entity_ids[:len(self._rows)]
+
+    @property
+    def coordinates(self) -> np.ndarray:
+        """
+        (x, y) of every placed entity in row order, aligned with entity_ids.
+        """
+        return self._coordinates[:len(self._rows)]
+
+    def row(self, entity_id: int) -> np.ndarray:
+        """
+        Read only distances from an entity to every placed entity, aligned with entity_ids.
+        """
+        row = self._distances[self._rows[entity_id], :len(self._rows)]
+        row.setflags(write=False)
+        return row
+
+    def within(self, entity_id: int, feet: int) -> List[int]:
+        """
+        IDs of the entities within the given distance, the entity itself included.
+        """
+        return self.entity_ids[self.row(entity_id) <= feet].tolist()
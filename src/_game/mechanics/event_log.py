@@ -0,0 +1,166 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from _game.entities.base.action import ActionType
+
+
+# name: dtype, -1 marks missing IDs and inapplicable hits
+EVENT_COLUMNS = {
+    "round": np.int32,
+    "turn": np.int32,
+    "source_id": np.int32,
+    "target_id": np.int32,
+    "action_type": np.int16,
+    "hit": np.int8,
+    "crit": np.bool_,
+    "damage": np.int32,
+    "detail": np.int32,  # Index into details, e.g. the weapon name
+}
+
+
+class BattleEventLog:
+    """
+    Append-only log of executed actions in NumPy columns, one row per action and target.
+    Rows are indexed by entity (as source or target) and by round, so queries only touch their own rows.
+    Entity IDs are the ones at the time of the event, IDs of removed entities are reused.
+    """
+    def __init__(self, capacity: int = 256):
+        self._size = 0
+        self._columns: Dict[str, np.ndarray] = {name: np.zeros(capacity, dtype=dtype)
+                                                for name, dtype in EVENT_COLUMNS.items()}
+        self.details: List[str] = []
+        self._detail_ids: Dict[str, int] = {}
+        self._by_entity: Dict[int, List[int]] = {}
+        self._by_round: Dict[int, List[int]] = {}
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, np.ndarray], details: List[str]) -> 'BattleEventLog':
+        """
+        Rebuild a log and its indexes from its columns, e.g. from a snapshot.
+        """
+        size = len(columns["round"])
+        log = cls(capacity=max(size, 256))
+        log._size = size
+        for name, dtype in EVENT_COLUMNS.items():
+            log._columns[name][:size] = np.asarray(columns[name], dtype=dtype)
+        log.details = list(details)
+        log._detail_ids = {detail: i for i, detail in enumerate(log.details)}
+        for row, (source_id, target_id, round_number) in enumerate(zip(columns["source_id"].tolist(),
+                                                                        columns["target_id"].tolist(),
+                                                                        columns["round"].tolist())):
+            for entity_id in {source_id, target_id} - {-1}:
+                log._by_entity.setdefault(entity_id, []).append(row)
+            log._by_round.setdefault(round_number, []).append(row)
+        return log
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _grow(self):
+        for name, column in self._columns.items():
+            grown = np.zeros(2 * len(column), dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._columns[name] = grown
+
+    def _detail(self, detail: Optional[str]) -> int:
+        if detail is None:
+            return -1
+        detail_id = self._detail_ids.get(detail)
+        if detail_id is None:
+            detail_id = self._detail_ids[detail] = len(self.details)
+            self.details.append(detail)
+        return detail_id
+
+    def append(self,
+               round_number: int,
+               turn: int,
+               source_id: Optional[int],
+               target_id: Optional[int],
+               action_type: ActionType,
+               hit: Optional[bool] = None,
+               crit: bool = False,
+               damage: int = 0,
+               detail: Optional[str] = None) -> int:
+        """
+        :return: Row of the event
+        """
+        if self._size == len(self._columns["round"]):
+            self._grow()
+        row = self._size
+        values = {
+            "round": round_number,
+            "turn": turn,
+            "source_id": -1 if source_id is None else source_id,
+            "target_id": -1 if target_id is None else target_id,
+            "action_type": action_type.value,
+            "hit": -1 if hit is None else int(hit),
+            "crit": crit,
+            "damage": damage,
+            "detail": self._detail(detail),
+        }
+        for name, value in values.items():
+            self._columns[name][row] = value
+        self._size += 1
+
+        for entity_id in {source_id, target_id} - {None}:
+            self._by_entity.setdefault(entity_id, []).append(row)
+        self._by_round.setdefault(round_number, []).append(row)
+        return row
+
+    def column(self, name: str, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Read only view of a column, all rows or the given ones.
+        """
+        column = self._columns[name][:self._size]
+        column.setflags(write=False)
+        return column if rows is None else column[rows]
+
+    def rows_for_entity(self, entity_id: int, role: Optional[str] = None) -> np.ndarray:
+        """
+        :param role: "source" or "target" to keep only rows with the entity in that role, None for both
+        """
+        rows = np.array(self._by_entity.get(entity_id, ()), dtype=np.int64)
+        if role is None:
+            return rows
+        if role not in ("source", "target"):
+            raise ValueError(f"Role must be 'source', 'target' or None.\n"
+                             f"Delivered: {role!r}")
+        return rows[self._columns[f"{role}_id"][rows] == entity_id]
+
+    def rows_for_round(self, round_number: int) -> np.ndarray:
+        return np.array(self._by_round.get(round_number, ()), dtype=np.int64)
+
+    @property
+    def rounds(self) -> List[int]:
+        return sorted(self._by_round)
+
+    def damage_dealt(self, entity_id: int) -> int:
+        return int(self.column("damage", self.rows_for_entity(entity_id, "source")).sum())
+
+    def damage_taken(self, entity_id: int) -> int:
+        return int(self.column("damage", self.rows_for_entity(entity_id, "target")).sum())
+
+    def table(self, rows: Optional[np.ndarray] = None) -> Dict[str, list]:
+        """
+        Column name: values with readable action types and details, e.g. for a dataframe.
+        """
+        rows = np.arange(self._size) if rows is None else rows
+        table = {name: self.column(name, rows).tolist() for name in EVENT_COLUMNS}
+        table["action_type"] = [ActionType(value).name for value in table["action_type"]]
+        table["hit"] = [None if hit < 0 else bool(hit) for hit in table["hit"]]
+        table["detail"] = [self.details[d] if d >= 0 else None for d in table["detail"]]
+        return table
+
+    def description(self, row: int) -> str:
+        action_type = ActionType(int(self._columns["action_type"][row]))
+        source_id, target_id = int(self._columns["source_id"][row]), int(self._columns["target_id"][row])
+        hit, detail = int(self._columns["hit"][row]), int(self._columns["detail"][row])
+        ret = f"Round {self._columns['round'][row]}, Turn {self._columns['turn'][row]}, {action_type.name}"
+        ret += f", ID{source_id}" if source_id >= 0 else ""
+        ret += f" -> ID{target_id}" if target_id >= 0 else ""
+        ret += f", {self.details[detail]}" if detail >= 0 else ""
+        if hit >= 0:
+            ret += f", {'CRIT ' if self._columns['crit'][row] else ''}{'SUCCESS' if hit else 'FAILED'}"
+            ret += f", Damage: {self._columns['damage'][row]}" if hit else ""
+        return ret
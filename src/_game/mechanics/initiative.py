@@ -0,0 +1,152 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sortedcontainers import SortedList
+
+from _game.base.stats_abilities_and_settings import Abilities
+from _game.entities.base.entity import Entity
+
+
+InitiativeKey = Tuple[int, int, int]
+
+
+def initiative_key(entity: Entity) -> InitiativeKey:
+    """
+    Sort key of the turn order: highest initiative first, ties go to the higher DEX modifier, then the lower ID.
+    """
+    return (-entity.battle_data.initiative,
+            -entity.ability_scores[Abilities.DEXTERITY].modifier,
+            entity.battle_data.entity_id)
+
+
+class InitiativeQueue:
+    """
+    Turn order of all entities with an initiative, kept sorted by initiative_key, and a cursor on the current turn.
+    The keys live in a SortedList, so inserting, removing and finding the turn of an entity are O(log n)
+    and reinforcements join without re-sorting the others.
+    The cursor follows the current entity when entities are inserted or removed before it.
+    """
+    def __init__(self):
+        self._keys: SortedList = SortedList()
+        self._key_of: Dict[int, InitiativeKey] = {}  # Entity ID: key it was inserted with
+        self._entities: Dict[int, Entity] = {}
+        self.cursor = -1  # Turn of the current entity, -1 before the first turn
+
+    @property
+    def keys(self) -> List[InitiativeKey]:
+        return list(self._keys)
+
+    def restore(self, keys: List[InitiativeKey], entities: Dict[int, Entity], cursor: int):
+        """
+        Set the turn order to sorted keys as saved from keys, e.g. from a snapshot.
+        Keys are taken as they are, the current initiatives and DEX modifiers of the entities are not looked at.
+        """
+        self._keys = SortedList(tuple(key) for key in keys)
+        self._key_of = {key[2]: key for key in self._keys}
+        self._entities = {key[2]: entities[key[2]] for key in self._keys}
+        self.cursor = cursor
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, entity_id: int) -> bool:
+        return entity_id in self._key_of
+
+    def __getitem__(self, turn: int) -> Entity:
+        return self._entities[self._keys[turn][2]]
+
+    def __iter__(self) -> Iterator[Entity]:
+        for key in self._keys:
+            yield self._entities[key[2]]
+
+    @property
+    def current(self) -> Optional[Entity]:
+        return self[self.cursor] if 0 <= self.cursor < len(self._keys) else None
+
+    def turn_of(self, entity_id: int) -> int:
+        return self._keys.index(self._key_of[entity_id])
+
+    def insert(self, entity: Entity) -> int:
+        """
+        Insert an entity, or move it after its initiative changed.
+
+        :return: Turn of the entity
+        """
+        current = self.current
+        entity_id = entity.battle_data.entity_id
+        if entity_id in self._key_of:
+            self._keys.remove(self._key_of[entity_id])
+        key = initiative_key(entity)
+        self._keys.add(key)
+        turn = self._keys.index(key)
+        self._key_of[entity_id] = key
+        self._entities[entity_id] = entity
+        # Joining before the current entity means having missed this round.
+        if current is not None:
+            self.cursor = self.turn_of(current.battle_data.entity_id)
+        return turn
+
+    def insert_many(self, entities: List[Entity]):
+        """
+        Insert a group of new entities at once, the cursor is looked up only once.
+        """
+        current = self.current
+        keys = [initiative_key(entity) for entity in entities]
+        for entity, key in zip(entities, keys):
+            entity_id = entity.battle_data.entity_id
+            if entity_id in self._key_of:
+                raise ValueError(f"Entity {entity_id} is already in the turn order, use insert to move it.")
+            self._key_of[entity_id] = key
+            self._entities[entity_id] = entity
+        self._keys.update(keys)
+        if current is not None:
+            self.cursor = self.turn_of(current.battle_data.entity_id)
+
+    def remove(self, entity_id: int) -> Entity:
+        """
+        Removing the current entity moves the cursor back, so the next advance continues with the entity after it.
+        """
+        turn = self.turn_of(entity_id)
+        del self._keys[turn]
+        del self._key_of[entity_id]
+        if turn <= self.cursor:
+            self.cursor -= 1
+        return self._entities.pop(entity_id)
+
+    def clear(self):
+        self._keys.clear()
+        self._key_of.clear()
+        self._entities.clear()
+        self.cursor = -1
+
+    def advance(self) -> Tuple[Entity, bool]:
+        """
+        Move the cursor to the next turn.
+
+        :return: The new current entity and whether a new round started
+        """
+        if not self._keys:
+            raise ValueError("No entity in the turn order, roll initiative first.")
+        self.cursor = self.cursor + 1 if self.cursor + 1 < len(self._keys) else 0
+        return self.current, self.cursor == 0
+
+    def rewind(self) -> Tuple[Entity, bool]:
+        """
+        Move the cursor to the previous turn.
+
+        :return: The new current entity and whether the previous round was entered
+        """
+        if not self._keys:
+            raise ValueError("No entity in the turn order, roll initiative first.")
+        wrapped = self.cursor <= 0
+        self.cursor = self.cursor - 1 if not wrapped else len(self._keys) - 1
+        return self.current, wrapped
+
+    def upcoming(self, k: Optional[int] = None) -> List[Tuple[int, Entity]]:
+        """
+        The next k turns starting with the current one, wrapping into the next round. All turns if k is None.
+        """
+        n = len(self._keys)
+        k = n if k is None else min(k, n)
+        start = max(self.cursor, 0)
+        turns = [(start + i) % n for i in range(k)]
+        return [(turn, self[turn]) for turn in turns]
@@ -0,0 +1,88 @@
+import heapq
+from typing import Callable, Dict, List, Optional, Tuple
+
+from _game.mechanics.spatial_index import HEX_DIRECTIONS, FEET_PER_HEX, hex_steps
+
+
+Hex = Tuple[int, int]
+# Feet it costs to enter a hex, None if it cannot be entered
+StepCost = Callable[[Hex], Optional[int]]
+
+
+def reachable_hexes(start: Hex,
+                    budget: int,
+                    step_cost: StepCost,
+                    can_stop: Callable[[Hex], bool] = lambda hexagon: True) -> Dict[Hex, int]:
+    """
+    Dijkstra flood fill of every hex reachable from start within the movement budget.
+
+    :param start: Hex to start from, always part of the result
+    :param budget: Movement in feet
+    :param step_cost: Feet needed to enter a hex, None for impassable hexes
+    :param can_stop: Hexes that can be passed but not ended on (e.g. occupied by allies) are left out of the result
+    :return: Hex: cheapest movement cost in feet
+    """
+    costs = {start: 0}
+    pending = [(0, start)]
+    while pending:
+        cost, (x, y) = heapq.heappop(pending)
+        if cost > costs[(x, y)]:
+            continue
+        for dx, dy in HEX_DIRECTIONS:
+            neighbour = (x + dx, y + dy)
+            step = step_cost(neighbour)
+            if step is None:
+                continue
+            new_cost = cost + step
+            if new_cost <= budget and new_cost < costs.get(neighbour, budget + 1):
+                costs[neighbour] = new_cost
+                heapq.heappush(pending, (new_cost, neighbour))
+
+    return {hexagon: cost for hexagon, cost in costs.items() if hexagon == start or can_stop(hexagon)}
+
+
+def find_path(start: Hex,
+              goal: Hex,
+              step_cost: StepCost,
+              budget: int) -> Optional[Tuple[List[Hex], int]]:
+    """
+    A* search for the cheapest path. Entering a hex costs at least FEET_PER_HEX, so the hex distance is admissible.
+    The grid is unbounded, the budget keeps the search finite if the goal is walled in.
+
+    :param start: Hex to start from
+    :param goal: Hex to reach
+    :param step_cost: Feet needed to enter a hex, None for impassable hexes
+    :param budget: Movement in feet, paths costing more are not searched
+    :return: Hexes from start to goal (both included) and the cost in feet, None if unreachable
+    """
+    def heuristic(hexagon: Hex) -> int:
+        return FEET_PER_HEX * hex_steps(goal[0] - hexagon[0], goal[1] - hexagon[1])
+
+    costs = {start: 0}
+    previous: Dict[Hex, Hex] = {}
+    pending = [(heuristic(start), 0, start)]
+    while pending:
+        _, cost, current = heapq.heappop(pending)
+        if current == goal:
+            path = [current]
+            while current in previous:
+                current = previous[current]
+                path.append(current)
+            return path[::-1], cost
+        if cost > costs[current]:
+            continue
+        x, y = current
+        for dx, dy in HEX_DIRECTIONS:
+            neighbour = (x + dx, y + dy)
+            step = step_cost(neighbour)
+            if step is None:
+                continue
+            new_cost = cost + step
+            estimate = new_cost + heuristic(neighbour)
+            if estimate > budget:
+                continue
+            if new_cost < costs.get(neighbour, new_cost + 1):
+                costs[neighbour] = new_cost
+                previous[neighbour] = current
+                heapq.heappush(pending, (estimate, new_cost, neighbour))
+    return None
@@ -0,0 +1,111 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from _game.entities.base.action import TargetType
+
+
+@dataclass
+class JournalEntry:
+    """
+    One state changing call on a Battletracker.
+
+    :param operation: Name of the Battletracker method
+    :param arguments: Arguments needed to repeat the call
+    :param rng_stream: Random stream the call rolled with, if any
+    """
+    operation: str
+    arguments: Dict[str, Any] = field(default_factory=dict)
+    rng_stream: Optional[int] = None
+
+
+def _replay_add_entity(bt, entry: JournalEntry):
+    entity = bt.add_entity(entry.arguments["template"],
+                           roll_health=entry.arguments["roll_health"],
+                           rng_stream=entry.rng_stream)
+    entity.name = entry.arguments["name"]
+
+
+def _replay_add_entities(bt, entry: JournalEntry):
+    arguments = entry.arguments
+    entities = bt.add_entities(arguments["template"],
+                               arguments["count"],
+                               roll_health=arguments["roll_health"],
+                               placement=arguments["placement"],
+                               roll_initiative=arguments["roll_initiative"],
+                               metric=arguments["metric"],
+                               rng_stream=entry.rng_stream)
+    for entity, name in zip(entities, arguments["names"]):
+        entity.name = name
+
+
+def _replay_execute_action(bt, entry: JournalEntry):
+    arguments = entry.arguments
+    source = bt.enemy[arguments["source_id"]]
+    if arguments["bonus_action"]:
+        actions = bt.get_bonus_actions(source=source, action_types=arguments["action_type"])
+    else:
+        actions = bt.get_actions(source=source, action_types=arguments["action_type"])
+
+    weapon = arguments["weapon"]
+    candidates = [a for a in actions.get(arguments["action_type"], [])
+                  if weapon is None or getattr(a, "weapon", None) is not None and a.weapon.name == weapon.name]
+    if not candidates:
+        raise ValueError(f"Cannot replay {entry!r}, the action is not available for {source.description_short()}.")
+
+    if arguments.get("aim") is not None:
+        # Area attacks are primed for everyone caught, each of them is journaled on its own.
+        primed = [a for a in bt.prime_action(candidates[0], (TargetType.LOCATION, arguments["aim"]),
+                                             rng_stream=entry.rng_stream)
+                  if a.target.battle_data.entity_id == arguments["target"]]
+    else:
+        target = None if arguments["target_type"] is None else (arguments["target_type"], arguments["target"])
+        primed = bt.prime_action(candidates[0], target, rng_stream=entry.rng_stream)
+    for action in primed:
+        bt._execute_action(action)
+
+
+_REPLAY = {
+    "add_entity": _replay_add_entity,
+    "add_entities": _replay_add_entities,
+    "add_weapon": lambda bt, entry: bt.add_weapon(entry.arguments["entity_id"], entry.arguments["weapon"]),
+    "drop_weapon": lambda bt, entry: bt.drop_weapon(entry.arguments["entity_id"], entry.arguments["weapon"]),
+    "add_effect": lambda bt, entry: bt.add_effect(entry.arguments["entity_id"], entry.arguments["effect"]),
+    "remove_effect": lambda bt, entry: bt.remove_effect(entry.arguments["entity_id"], entry.arguments["effect_id"]),
+    "place_entity": lambda bt, entry: bt.place_entity(entry.arguments["entity_id"],
+                                                      x=entry.arguments["x"],
+                                                      y=entry.arguments["y"],
+                                                      metric=entry.arguments["metric"]),
+    "set_movement_cost": lambda bt, entry: bt.set_movement_cost(x=entry.arguments["x"],
+                                                                y=entry.arguments["y"],
+                                                                movement_cost=entry.arguments["movement_cost"],
+                                                                metric=entry.arguments["metric"]),
+    "set_wall": lambda bt, entry: bt.set_wall(x=entry.arguments["x"],
+                                              y=entry.arguments["y"],
+                                              wall=entry.arguments["wall"],
+                                              metric=entry.arguments["metric"]),
+    "move_entity": lambda bt, entry: bt.move_entity(entry.arguments["entity_id"],
+                                                    x=entry.arguments["x"],
+                                                    y=entry.arguments["y"]),
+    "remove_entity": lambda bt, entry: bt.remove_entity(entry.arguments["entity_id"]),
+    "roll_initiative_for_all": lambda bt, entry: bt.roll_initiative_for_all(rng_stream=entry.rng_stream),
+    "roll_initiative_for_added_entities":
+        lambda bt, entry: bt.roll_initiative_for_added_entities(rng_stream=entry.rng_stream),
+    "mutate_initiative_rolls": lambda bt, entry: bt.mutate_initiative_rolls(entry.arguments["initiatives"]),
+    "set_next_player": lambda bt, entry: bt.set_next_player(),
+    "set_previous_player": lambda bt, entry: bt.set_previous_player(),
+    "execute_action": _replay_execute_action,
+}
+
+
+def replay_journal(bt, journal: List[JournalEntry]):
+    """
+    Re-execute journal entries on a Battletracker created with the seed of the journaled battle.
+    Random events reuse their recorded streams, so the rebuilt state is bit-exact.
+    """
+    for entry in journal:
+        if entry is None:
+            raise ValueError("Journal entry was not kept, the battle was restored from a checkpoint after it.")
+        if entry.operation not in _REPLAY:
+            raise ValueError(f"Journal operation {entry.operation!r} not recognized. "
+                             f"Supported: {list(_REPLAY)!r}")
+        _REPLAY[entry.operation](bt, entry)
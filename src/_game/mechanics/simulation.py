@@ -0,0 +1,235 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from random import Random
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from _game.base.functionality import BattleRng
+from _game.base.stats_abilities_and_settings import CharacterType
+from _game.entities.base.action import Action, ActionType, TargetType
+from _game.entities.base.entity import Entity
+from _game.mechanics.battle_tracker import Battletracker
+
+Policy = Callable[[Battletracker, Entity, List[Entity], Random], Optional[Tuple[Action, Entity]]]
+
+
+@dataclass
+class SimulationResult:
+    """
+    Outcome of a batch of simulated encounters, one entry per encounter.
+
+    :param player_wins: Whether the players side was the last one standing
+    :param enemy_wins: Whether the enemies side was the last one standing
+    :param rounds: Rounds until one side was down (max_rounds for draws)
+    :param damage_dealt_players: Damage dealt by the players side
+    :param damage_dealt_enemies: Damage dealt by the enemies side
+    """
+    player_wins: np.ndarray
+    enemy_wins: np.ndarray
+    rounds: np.ndarray
+    damage_dealt_players: np.ndarray
+    damage_dealt_enemies: np.ndarray
+
+    @property
+    def encounters(self) -> int:
+        return len(self.rounds)
+
+    @property
+    def player_win_rate(self) -> float:
+        return float(self.player_wins.mean())
+
+    @property
+    def enemy_win_rate(self) -> float:
+        return float(self.enemy_wins.mean())
+
+    @property
+    def draw_rate(self) -> float:
+        return 1.0 - self.player_win_rate - self.enemy_win_rate
+
+    @staticmethod
+    def concatenate(results: List['SimulationResult']) -> 'SimulationResult':
+        return SimulationResult(
+            player_wins=np.concatenate([r.player_wins for r in results]),
+            enemy_wins=np.concatenate([r.enemy_wins for r in results]),
+            rounds=np.concatenate([r.rounds for r in results]),
+            damage_dealt_players=np.concatenate([r.damage_dealt_players for r in results]),
+            damage_dealt_enemies=np.concatenate([r.damage_dealt_enemies for r in results])
+        )
+
+    def description(self) -> str:
+        return (f"Encounters: {self.encounters}, "
+                f"Players win: {self.player_win_rate:.1%}, "
+                f"Enemies win: {self.enemy_win_rate:.1%}, "
+                f"Draw: {self.draw_rate:.1%}, "
+                f"Rounds: {self.rounds.mean():.1f} (median {np.median(self.rounds):.0f}), "
+                f"Damage players/enemies: {self.damage_dealt_players.mean():.1f} / "
+                f"{self.damage_dealt_enemies.mean():.1f}")
+
+
+def is_down(entity: Entity) -> bool:
+    return entity.hit_points.dead or entity.hit_points.current <= 0
+
+
+def random_attack_policy(bt: Battletracker,
+                         entity: Entity,
+                         opponents: List[Entity],
+                         rng: Random) -> Optional[Tuple[Action, Entity]]:
+    """
+    Attack a random opponent with a random weapon attack, area attacks are aimed at the opponent.
+    Throwing is only used if nothing else is left, as it disarms the attacker.
+    """
+    actions = bt.get_actions(source=entity, action_types=[ActionType.WEAPON_ATTACK_MELEE,
+                                                          ActionType.WEAPON_ATTACK_RANGED,
+                                                          ActionType.WEAPON_ATTACK_THROW,
+                                                          ActionType.WEAPON_ATTACK_AREA])
+    attacks = actions.get(ActionType.WEAPON_ATTACK_MELEE, []) + actions.get(ActionType.WEAPON_ATTACK_RANGED, []) + \
+        actions.get(ActionType.WEAPON_ATTACK_AREA, [])
+    if not attacks:
+        attacks = actions.get(ActionType.WEAPON_ATTACK_THROW, [])
+    if not attacks or not opponents:
+        return None
+    return rng.choice(attacks), rng.choice(opponents)
+
+
+def suggested_attack_policy(bt: Battletracker,
+                            entity: Entity,
+                            opponents: List[Entity],
+                            rng: Random) -> Optional[Tuple[Action, Entity]]:
+    """
+    Take the best ranked suggestion of Battletracker.suggest_actions. Throwing is only used if nothing else is left.
+    """
+    suggestions = [s for s in bt.suggest_actions(entity, targets=[o.battle_data.entity_id for o in opponents])
+                   if not s.action.bonus_action]
+    if not suggestions:
+        return None
+    best = next((s for s in suggestions if s.action.action_type != ActionType.WEAPON_ATTACK_THROW), suggestions[0])
+    return best.action, bt.enemy[best.target_id]
+
+
+def run_encounter(players: List[Entity],
+                  enemies: List[Entity],
+                  roll_health: bool = True,
+                  max_rounds: int = 100,
+                  policy: Policy = random_attack_policy,
+                  rng: Optional[BattleRng] = None) -> Tuple[bool, bool, int, int, int]:
+    """
+    Run a single encounter headless from initiative until one side is down.
+
+    :return: (players won, enemies won, rounds, damage dealt by players, damage dealt by enemies)
+    """
+    rng = rng if rng is not None else BattleRng()
+    battle_rng, policy_rng = rng.spawn(2)
+    policy_rng = policy_rng.stream(0)
+
+    bt = Battletracker(rng=battle_rng)
+    # Headless encounters are never undone, checkpoints would only cost time.
+    bt.undo_history = None
+    for side, character_type, x in [(players, CharacterType.PLAYER, 0), (enemies, CharacterType.ENEMY, 1)]:
+        for template in side:
+            entity = bt.add_entity(template, roll_health=roll_health)
+            entity.character_type = character_type
+            bt.place_entity(entity, x=x, y=0)
+
+    bt.roll_initiative_for_all()
+
+    damage = {CharacterType.PLAYER: 0, CharacterType.ENEMY: 0}
+    while bt.current_round_number < max_rounds:
+        standing = {character_type: [e for e in bt.enemy.values()
+                                     if e.character_type == character_type and not is_down(e)]
+                    for character_type in damage}
+        if not standing[CharacterType.PLAYER] or not standing[CharacterType.ENEMY]:
+            break
+
+        bt.set_next_player()
+        entity = bt.current_entity
+        if is_down(entity):
+            continue
+
+        opponents = standing[CharacterType.ENEMY if entity.character_type == CharacterType.PLAYER
+                             else CharacterType.PLAYER]
+        choice = policy(bt, entity, opponents, policy_rng)
+        if choice is None:
+            continue
+
+        action, target = choice
+        if action.action_type == ActionType.WEAPON_ATTACK_AREA:
+            targets = (TargetType.LOCATION, target.battle_data.location)
+        else:
+            targets = (TargetType.ENTITY, target.battle_data.entity_id)
+        for executed in bt.full_action(action, targets):
+            if executed.success and executed.target.character_type != entity.character_type:
+                damage[entity.character_type] += max(executed.source_roll.total_roll, 0)
+
+    players_standing = any(not is_down(e) for e in bt.enemy.values() if e.character_type == CharacterType.PLAYER)
+    enemies_standing = any(not is_down(e) for e in bt.enemy.values() if e.character_type == CharacterType.ENEMY)
+    return (players_standing and not enemies_standing,
+            enemies_standing and not players_standing,
+            min(bt.current_round_number + 1, max_rounds),
+            damage[CharacterType.PLAYER],
+            damage[CharacterType.ENEMY])
+
+
+def _simulate_chunk(players: List[Entity],
+                    enemies: List[Entity],
+                    encounter_rngs: List[BattleRng],
+                    roll_health: bool,
+                    max_rounds: int,
+                    policy: Policy) -> SimulationResult:
+    outcomes = [run_encounter(players, enemies,
+                              roll_health=roll_health,
+                              max_rounds=max_rounds,
+                              policy=policy,
+                              rng=encounter_rng)
+                for encounter_rng in encounter_rngs]
+    player_wins, enemy_wins, rounds, damage_players, damage_enemies = zip(*outcomes) if outcomes else [()] * 5
+    return SimulationResult(
+        player_wins=np.array(player_wins, dtype=bool),
+        enemy_wins=np.array(enemy_wins, dtype=bool),
+        rounds=np.array(rounds, dtype=np.int64),
+        damage_dealt_players=np.array(damage_players, dtype=np.int64),
+        damage_dealt_enemies=np.array(damage_enemies, dtype=np.int64)
+    )
+
+
+def simulate_encounters(players: List[Entity],
+                        enemies: List[Entity],
+                        encounters: int = 1000,
+                        roll_health: bool = True,
+                        max_rounds: int = 100,
+                        policy: Policy = random_attack_policy,
+                        max_workers: Optional[int] = None,
+                        seed: Optional[int] = None) -> SimulationResult:
+    """
+    Monte Carlo simulation of full encounters between two sides, spread over a process pool.
+
+    :param players: Templates of the players side, copied for every encounter
+    :param enemies: Templates of the enemies side, copied for every encounter
+    :param encounters: Number of encounters to simulate
+    :param roll_health: Roll hit points for every encounter instead of using the defaults
+    :param max_rounds: Encounters still undecided after this many rounds count as draws
+    :param policy: Picks action and target for an entity, must be a picklable module level function
+    :param max_workers: Number of worker processes, defaults to every core. 1 runs in process.
+    :param seed: Seed of the whole simulation, every encounter rolls on its own spawned stream
+    :return: SimulationResult over all encounters
+    """
+    if encounters < 1:
+        raise ValueError(f"At least one encounter must be simulated. Delivered: {encounters}")
+    max_workers = max_workers if max_workers is not None else os.cpu_count() or 1
+
+    # A few chunks per worker keep the pool busy if encounters differ in length.
+    chunks = min(encounters, 4 * max_workers)
+    # Streams are spawned per encounter, so results do not depend on the number of workers.
+    encounter_rngs = BattleRng(seed).spawn(encounters)
+    bounds = [encounters * i // chunks for i in range(chunks + 1)]
+    arguments = [(players, enemies, encounter_rngs[start:end], roll_health, max_rounds, policy)
+                 for start, end in zip(bounds[:-1], bounds[1:])]
+
+    if max_workers == 1:
+        results = [_simulate_chunk(*args) for args in arguments]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_simulate_chunk, *zip(*arguments)))
+
+    return SimulationResult.concatenate(results)
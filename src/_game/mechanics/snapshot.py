@@ -0,0 +1,354 @@
+import dataclasses
+import json
+import struct
+import zlib
+from enum import Enum
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from _game.base import stats_abilities_and_settings
+from _game.base.chunked_map import MAP_LAYERS
+from _game.base.environment import Location, LocationMetric
+from _game.base.functionality import BattleRng
+from _game.base.item_store import ItemStore
+from _game.base.modifiers import Effect, ModifierStack
+from _game.base.weapons import BaseWeapon, Weapons
+from _game.entities.base.action import ActionType, TargetType
+from _game.entities.base.entity import BattleTrackerMetaData, Entity, ENTITY_STATS
+from _game.entities.entities.monsters import PredefinedMonsters
+from _game.mechanics.event_log import BattleEventLog, EVENT_COLUMNS
+from _game.mechanics.replay import JournalEntry
+
+
+SNAPSHOT_MAGIC = b"BTSNAP"
+SNAPSHOT_VERSION = 1
+
+_HEADER = struct.Struct("<6sH")
+_META_LENGTH = struct.Struct("<I")
+_NONE = np.iinfo(np.int32).min  # None in nullable integer columns
+
+_ENUMS = {cls.__name__: cls for cls in [*(value for value in vars(stats_abilities_and_settings).values()
+                                           if isinstance(value, type) and issubclass(value, Enum)
+                                           and value is not Enum),
+                                        LocationMetric, ActionType, TargetType]}
+# Battle data written by the Battletracker, everything else in BattleTrackerMetaData is stored if set.
+_TRACKED_BATTLE_DATA = {"entity_id", "initiative", "location", "movement_used", "enemy_in_melee_range"}
+
+
+def encode_value(value: Any) -> Any:
+    """
+    JSON compatible form of journal arguments and entity deltas.
+    Templates and weapons are stored by name, so they must be the shared PredefinedMonsters and Weapons objects.
+    """
+    if value is None or isinstance(value, (bool, str)):
+        return value
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return float(value)
+    if isinstance(value, Enum):
+        return {"enum": [value.__class__.__name__, value.name]}
+    if isinstance(value, Location):
+        return {"location": [value.x, value.y, value.metric.name]}
+    if isinstance(value, BaseWeapon):
+        if Weapons.get_weapon(value.name) is not value:
+            raise ValueError(f"Only weapons of Weapons can be stored.\n"
+                             f"Delivered: {value.name!r}")
+        return {"weapon": value.name}
+    if isinstance(value, Entity):
+        if PredefinedMonsters.ALL_MONSTERS.get(value.race) is not value:
+            raise ValueError(f"Only templates of PredefinedMonsters can be stored by reference.\n"
+                             f"Delivered: {value.description_short()}")
+        return {"template": value.race}
+    if isinstance(value, Effect):
+        return {"effect": {f.name: encode_value(getattr(value, f.name)) for f in dataclasses.fields(value)}}
+    if isinstance(value, tuple):
+        return {"tuple": [encode_value(v) for v in value]}
+    if isinstance(value, (set, frozenset)):
+        # Sorted by their encoding, so equal sets always encode equally.
+        return {"frozenset" if isinstance(value, frozenset) else "set":
+                sorted((encode_value(v) for v in value), key=json.dumps)}
+    if isinstance(value, list):
+        return [encode_value(v) for v in value]
+    if isinstance(value, dict):
+        return {"dict": [[encode_value(k), encode_value(v)] for k, v in value.items()]}
+    raise ValueError(f"Cannot store values of type {type(value).__name__}.\n"
+                     f"Delivered: {value!r}")
+
+
+def decode_value(value: Any) -> Any:
+    if isinstance(value, list):
+        return [decode_value(v) for v in value]
+    if not isinstance(value, dict):
+        return value
+
+    (tag, content), = value.items()
+    if tag == "enum":
+        return _ENUMS[content[0]][content[1]]
+    if tag == "location":
+        return Location(x=content[0], y=content[1], metric=LocationMetric[content[2]])
+    if tag == "weapon":
+        return Weapons.get_weapon(content)
+    if tag == "template":
+        return PredefinedMonsters.ALL_MONSTERS[content]
+    if tag == "effect":
+        return Effect(**{k: decode_value(v) for k, v in content.items()})
+    if tag == "tuple":
+        return tuple(decode_value(v) for v in content)
+    if tag == "frozenset":
+        return frozenset(decode_value(v) for v in content)
+    if tag == "set":
+        return {decode_value(v) for v in content}
+    if tag == "dict":
+        return {decode_value(k): decode_value(v) for k, v in content}
+    raise ValueError(f"Unknown tag {tag!r} in stored value.")
+
+
+def encode_journal_entry(entry: JournalEntry) -> Dict[str, Any]:
+    return {"operation": entry.operation,
+            "arguments": encode_value(entry.arguments),
+            "rng_stream": entry.rng_stream}
+
+
+def decode_journal_entry(entry: Dict[str, Any]) -> JournalEntry:
+    return JournalEntry(operation=entry["operation"],
+                        arguments=decode_value(entry["arguments"]),
+                        rng_stream=entry["rng_stream"])
+
+
+def _nullable(value) -> int:
+    return _NONE if value is None else value
+
+
+def _from_nullable(value: int):
+    return None if value == _NONE else value
+
+
+def _entity_delta(entity: Entity) -> Dict[str, Any]:
+    """
+    Everything in which a spawned entity differs from its template, besides the columns.
+    """
+    template = entity.template
+    delta: Dict[str, Any] = {}
+    if entity._owns_stats:
+        stats = {key: entity._stats.get(key) for key in ENTITY_STATS.inputs
+                 if entity._stats.get(key) != template._stats.get(key)}
+        if stats:
+            delta["stats"] = stats
+    if entity.proficiencies != template.proficiencies:
+        delta["proficiencies"] = entity.proficiencies
+    if [w.name for w in entity.weapons] != [w.name for w in template.weapons]:
+        delta["weapons"] = list(entity.weapons)
+    if entity.modifiers.effects or entity.modifiers.next_effect_id:
+        delta["effects"] = entity.modifiers.effects
+        delta["next_effect_id"] = entity.modifiers.next_effect_id
+    battle_data = {f.name: getattr(entity.battle_data, f.name) for f in dataclasses.fields(BattleTrackerMetaData)
+                   if f.name not in _TRACKED_BATTLE_DATA and getattr(entity.battle_data, f.name)}
+    if battle_data:
+        delta["battle_data"] = battle_data
+    return delta
+
+
+def capture_snapshot(bt, journal: bool = True) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    """
+    State of a Battletracker as JSON compatible meta and NumPy columns, sharing nothing with the battle,
+    so encode_snapshot may run later or on another thread.
+    Raises a ValueError for entities that were not spawned from PredefinedMonsters.
+
+    :param journal: Include the journal, without it only its length is stored
+    """
+    columns: Dict[str, np.ndarray] = {}
+    entities = list(bt.enemy.values())
+    for entity in entities:
+        # Templates are stored by race, like in encode_value.
+        if entity.template is None or PredefinedMonsters.ALL_MONSTERS.get(entity.template.race) is not entity.template:
+            raise ValueError(f"Only entities spawned from templates of PredefinedMonsters can be stored.\n"
+                             f"Delivered: {entity.description_short()}")
+
+    hit_points = [e.hit_points for e in entities]
+    battle_data = [e.battle_data for e in entities]
+    locations = [b.location for b in battle_data]
+    columns["entity/entity_id"] = np.array([b.entity_id for b in battle_data], dtype=np.int32)
+    columns["entity/play_max"] = np.array([_nullable(h.play_max) for h in hit_points], dtype=np.int32)
+    columns["entity/play_max_modifier"] = np.array([_nullable(h.play_max_modifier) for h in hit_points],
+                                                   dtype=np.int32)
+    columns["entity/current"] = np.array([_nullable(h.current) for h in hit_points], dtype=np.int32)
+    columns["entity/death_save"] = np.array([h.death_save for h in hit_points], dtype=np.int32)
+    columns["entity/dead"] = np.array([h.dead for h in hit_points], dtype=np.bool_)
+    columns["entity/has_death_save"] = np.array([h.has_death_save for h in hit_points], dtype=np.bool_)
+    columns["entity/initiative"] = np.array([_nullable(b.initiative) for b in battle_data], dtype=np.int32)
+    columns["entity/movement_used"] = np.array([b.movement_used for b in battle_data], dtype=np.int32)
+    columns["entity/placed"] = np.array([loc is not None for loc in locations], dtype=np.bool_)
+    columns["entity/x"] = np.array([loc.x if loc is not None else 0 for loc in locations], dtype=np.int32)
+    columns["entity/y"] = np.array([loc.y if loc is not None else 0 for loc in locations], dtype=np.int32)
+
+    columns["initiative/keys"] = np.array(bt.initiative.keys, dtype=np.int32).reshape(-1, 3)
+    for name in EVENT_COLUMNS:
+        columns[f"event/{name}"] = bt.event_log.column(name).copy()
+    hex_map = bt.environment.map
+    for chunk in hex_map.chunks:
+        for layer, array in hex_map.chunk_arrays(chunk).items():
+            columns[f"map/{layer}/{chunk[0]}/{chunk[1]}"] = np.array(array)
+
+    meta = {
+        "seed": bt.rng.seed,
+        "spawn_key": list(bt.rng.spawn_key),
+        "next_rng_stream": bt.next_rng_stream,
+        "current_round_number": bt.current_round_number,
+        "next_entity_id": bt._next_entity_id,
+        "free_entity_ids": list(bt._free_entity_ids),
+        "initiative_cursor": bt.initiative.cursor,
+        "effect_expiry": list(bt._effect_expiry),
+        "entities": [{"template": e.template.race,
+                      "name": e.name,
+                      "character_type": e.character_type.name,
+                      "metric": e.battle_data.location.metric.name if e.battle_data.location is not None else None,
+                      "delta": encode_value(_entity_delta(e))} for e in entities],
+        "event_details": list(bt.event_log.details),
+        "map_chunk_size": hex_map.chunk_size,
+        "items": [[item_id, encode_value(location), encode_value(item)]
+                  for item_id, location, item in bt.environment.items],
+        "next_item_id": bt.environment.items.next_id,
+        # Entries that were not kept, e.g. before the checkpoint of a recovered battle, are stored as None.
+        "journal": [encode_journal_entry(entry) if entry is not None else None for entry in bt.battle_journal]
+                   if journal else None,
+        "journal_length": len(bt.battle_journal),
+    }
+    return meta, columns
+
+
+def encode_snapshot(meta: Dict[str, Any], columns: Dict[str, np.ndarray], level: int = 6) -> bytes:
+    """
+    Binary snapshot: header (magic, version), then zlib compressed
+    meta length, JSON meta and the raw bytes of all NumPy columns listed in the meta.
+
+    :param level: zlib compression level, 0 to store uncompressed
+    """
+    meta = dict(meta, columns={})
+    blobs = []
+    offset = 0
+    for name, column in columns.items():
+        column = np.ascontiguousarray(column)
+        meta["columns"][name] = [column.dtype.str, list(column.shape), offset]
+        blobs.append(column.tobytes())
+        offset += column.nbytes
+
+    meta_bytes = json.dumps(meta, separators=(",", ":")).encode()
+    body = _META_LENGTH.pack(len(meta_bytes)) + meta_bytes + b"".join(blobs)
+    return _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION) + zlib.compress(body, level)
+
+
+def dump_snapshot(bt, journal: bool = True, level: int = 6) -> bytes:
+    """
+    Binary snapshot of a Battletracker, see capture_snapshot and encode_snapshot.
+    """
+    return encode_snapshot(*capture_snapshot(bt, journal=journal), level=level)
+
+
+def _read_columns(data: bytes) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    if len(data) < _HEADER.size:
+        raise ValueError(f"Not a battle snapshot, only {len(data)} bytes.")
+    magic, version = _HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError(f"Not a battle snapshot.\n"
+                         f"Delivered: header {magic!r}")
+    if version > SNAPSHOT_VERSION:
+        raise ValueError(f"Snapshot version {version} is newer than the supported version {SNAPSHOT_VERSION}.")
+
+    body = zlib.decompress(data[_HEADER.size:])
+    meta_length, = _META_LENGTH.unpack_from(body)
+    meta = json.loads(body[_META_LENGTH.size:_META_LENGTH.size + meta_length])
+    blobs = memoryview(body)[_META_LENGTH.size + meta_length:]
+    columns = {}
+    for name, (dtype, shape, offset) in meta["columns"].items():
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        columns[name] = np.frombuffer(blobs, dtype=dtype, count=count, offset=offset).reshape(shape).copy()
+    return meta, columns
+
+
+def load_snapshot(bt, data: bytes, journal: Optional[List[JournalEntry]] = None):
+    """
+    Restore a snapshot into a freshly created Battletracker.
+
+    :param journal: Journal of a snapshot dumped without it, the entries are shared, not copied.
+        Without it the entries are None, the battle goes on but cannot be replayed from its start.
+    :return: The Battletracker
+    """
+    meta, columns = _read_columns(data)
+    if journal is not None and len(journal) != meta["journal_length"]:
+        raise ValueError(f"Journal does not match the snapshot, it has {meta['journal_length']} entries.\n"
+                         f"Delivered: {len(journal)} entries")
+    bt.rng = BattleRng(meta["seed"], tuple(meta["spawn_key"]))
+    bt.next_rng_stream = meta["next_rng_stream"]
+    bt.current_round_number = meta["current_round_number"]
+    bt._next_entity_id = meta["next_entity_id"]
+    bt._free_entity_ids = list(meta["free_entity_ids"])
+    bt._effect_expiry = [tuple(expiry) for expiry in meta["effect_expiry"]]
+
+    hex_map = bt.environment.map
+    if hex_map.chunk_size != meta["map_chunk_size"]:
+        raise ValueError(f"Map chunk size {hex_map.chunk_size} does not match the snapshot.\n"
+                         f"Delivered: {meta['map_chunk_size']}")
+    map_chunks: Dict[Tuple[int, int], Dict[str, np.ndarray]] = {}
+    for name, column in columns.items():
+        if name.startswith("map/"):
+            _, layer, chunk_x, chunk_y = name.split("/")
+            map_chunks.setdefault((int(chunk_x), int(chunk_y)), {})[layer] = column
+    for chunk, arrays in map_chunks.items():
+        hex_map.put_chunk(chunk, {layer: arrays[layer] for layer in MAP_LAYERS if layer in arrays})
+
+    bt.environment.items = ItemStore.from_items([(item_id, decode_value(location), decode_value(item))
+                                                 for item_id, location, item in meta["items"]],
+                                                meta["next_item_id"])
+
+    entity_columns = {name.split("/", 1)[1]: column.tolist()
+                      for name, column in columns.items() if name.startswith("entity/")}
+    for i, stored in enumerate(meta["entities"]):
+        entity = PredefinedMonsters.ALL_MONSTERS[stored["template"]].spawn()
+        entity.name = stored["name"]
+        entity.character_type = stats_abilities_and_settings.CharacterType[stored["character_type"]]
+
+        delta = decode_value(stored["delta"])
+        if "stats" in delta:
+            entity._set_stats(delta["stats"])
+        if "proficiencies" in delta:
+            entity.proficiencies = delta["proficiencies"]
+        if "weapons" in delta:
+            entity.weapons = delta["weapons"]
+        if "effects" in delta:
+            entity.modifiers = ModifierStack.from_effects(delta["effects"], delta["next_effect_id"])
+        for name, value in delta.get("battle_data", {}).items():
+            setattr(entity.battle_data, name, value)
+
+        hit_points = entity.hit_points
+        hit_points.play_max = _from_nullable(entity_columns["play_max"][i])
+        hit_points.play_max_modifier = _from_nullable(entity_columns["play_max_modifier"][i])
+        hit_points.current = _from_nullable(entity_columns["current"][i])
+        hit_points.death_save = entity_columns["death_save"][i]
+        hit_points.dead = entity_columns["dead"][i]
+        hit_points.has_death_save = entity_columns["has_death_save"][i]
+
+        battle_data = entity.battle_data
+        battle_data.entity_id = entity_columns["entity_id"][i]
+        battle_data.initiative = _from_nullable(entity_columns["initiative"][i])
+        battle_data.movement_used = entity_columns["movement_used"][i]
+        bt.enemy[battle_data.entity_id] = entity
+        if entity_columns["placed"][i]:
+            battle_data.location = Location(x=entity_columns["x"][i], y=entity_columns["y"][i],
+                                            metric=LocationMetric[stored["metric"]])
+            # Occupancy is part of the restored map, only the entity indexes are rebuilt.
+            bt.spatial_index.place(entity)
+            bt.distances.place(battle_data.entity_id, battle_data.location.x, battle_data.location.y)
+
+    bt.initiative.restore(columns["initiative/keys"].tolist(), bt.enemy, meta["initiative_cursor"])
+    bt.event_log = BattleEventLog.from_columns({name: columns[f"event/{name}"] for name in EVENT_COLUMNS},
+                                               meta["event_details"])
+    if meta["journal"] is not None:
+        bt.battle_journal = [decode_journal_entry(entry) if entry is not None else None for entry in meta["journal"]]
+    elif journal is not None:
+        bt.battle_journal = list(journal)
+    else:
+        bt.battle_journal = [None] * meta["journal_length"]
+    return bt
@@ -0,0 +1,172 @@
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from _game.base.environment import Location, LocationMetric, FEET_PER_HEX
+from _game.entities.base.entity import Entity
+
+
+# Axial hex directions in ring order, matching the HEX_BASE_60 grid of Location
+HEX_DIRECTIONS = ((1, 0), (1, -1), (0, -1), (-1, 0), (-1, 1), (0, 1))
+
+
+def hex_steps(dx: int, dy: int) -> int:
+    return (abs(dx) + abs(dy) + abs(dx + dy)) // 2
+
+
+def hex_ring(x: int, y: int, steps: int) -> Iterator[Tuple[int, int]]:
+    """
+    All hexes at exactly the given number of steps from (x, y).
+    """
+    if steps == 0:
+        yield x, y
+        return
+    hx, hy = x + HEX_DIRECTIONS[4][0] * steps, y + HEX_DIRECTIONS[4][1] * steps
+    for dx, dy in HEX_DIRECTIONS:
+        for _ in range(steps):
+            yield hx, hy
+            hx, hy = hx + dx, hy + dy
+
+
+def is_active(entity: Entity) -> bool:
+    return not entity.hit_points.dead and entity.hit_points.current > 0
+
+
+def is_hostile(entity: Entity, other: Entity) -> bool:
+    return entity.character_type != other.character_type and is_active(other)
+
+
+class HexSpatialIndex:
+    """
+    Entities bucketed by the hex they stand on.
+    Radius and nearest queries walk the hexes around the origin ring by ring, or scan the placed entities
+    if those are fewer, so their cost is bounded by min(searched area, placed entities).
+    """
+    def __init__(self, melee_reach: int = 5):
+        self.melee_reach = melee_reach
+        self._entities: Dict[int, Entity] = {}
+        self._positions: Dict[int, Tuple[int, int]] = {}
+        self._buckets: Dict[Tuple[int, int], Set[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __contains__(self, entity_id: int) -> bool:
+        return entity_id in self._positions
+
+    def place(self, entity: Entity):
+        """
+        (Re)index an entity at its battle_data.location and update enemy_in_melee_range around its old and new hex.
+        """
+        location = entity.battle_data.location
+        if location.metric is not LocationMetric.HEX_BASE_60:
+            raise ValueError(f"{self.__class__.__name__} supports {LocationMetric.HEX_BASE_60!r} only.\n"
+                             f"Delivered: {location.metric!r}")
+        entity_id = entity.battle_data.entity_id
+        old = self._pop(entity_id)
+
+        position = (location.x, location.y)
+        self._entities[entity_id] = entity
+        self._positions[entity_id] = position
+        self._buckets.setdefault(position, set()).add(entity_id)
+
+        if old is not None:
+            self.update_melee_flags(old)
+        self.update_melee_flags(position)
+
+    def remove(self, entity_id: int):
+        old = self._pop(entity_id)
+        self._entities.pop(entity_id, None)
+        if old is not None:
+            self.update_melee_flags(old)
+
+    def _pop(self, entity_id: int) -> Optional[Tuple[int, int]]:
+        old = self._positions.pop(entity_id, None)
+        if old is not None:
+            bucket = self._buckets[old]
+            bucket.discard(entity_id)
+            if not bucket:
+                del self._buckets[old]
+        return old
+
+    def position(self, entity_id: int) -> Optional[Tuple[int, int]]:
+        return self._positions.get(entity_id)
+
+    def at(self, position: Tuple[int, int]) -> Iterator[Entity]:
+        for entity_id in self._buckets.get(position, ()):
+            yield self._entities[entity_id]
+
+    def _around(self, position: Tuple[int, int], steps: int) -> Iterator[Entity]:
+        x, y = position
+        # Walking the area only pays off while it has fewer hexes than there are entities to scan.
+        if 3 * steps * (steps + 1) + 1 <= len(self._positions):
+            for k in range(steps + 1):
+                for hexagon in hex_ring(x, y, k):
+                    yield from self.at(hexagon)
+        else:
+            for entity_id, (ex, ey) in self._positions.items():
+                if hex_steps(ex - x, ey - y) <= steps:
+                    yield self._entities[entity_id]
+
+    def within(self, location: Location, feet: int) -> List[Entity]:
+        """
+        Entities within the given distance of a location, ordered by entity ID.
+        """
+        found = self._around((location.x, location.y), feet // FEET_PER_HEX)
+        return sorted(found, key=lambda e: e.battle_data.entity_id)
+
+    def nearest(self,
+                location: Location,
+                predicate: Callable[[Entity], bool],
+                max_feet: Optional[int] = None) -> Optional[Entity]:
+        """
+        Closest entity satisfying predicate, ties are broken by the lowest entity ID.
+        """
+        if not self._positions:
+            return None
+        x, y = location.x, location.y
+        max_steps = max_feet // FEET_PER_HEX if max_feet is not None else None
+
+        searched = 0
+        steps = 0
+        while searched < len(self._positions) and (max_steps is None or steps <= max_steps):
+            found = [e for hexagon in hex_ring(x, y, steps) for e in self.at(hexagon) if predicate(e)]
+            if found:
+                return min(found, key=lambda e: e.battle_data.entity_id)
+            searched += 6 * steps if steps else 1
+            steps += 1
+        if max_steps is not None and steps > max_steps:
+            return None
+
+        # The rings grew larger than the battle, scan the remaining entities.
+        best = None
+        for entity_id, (ex, ey) in self._positions.items():
+            distance = hex_steps(ex - x, ey - y)
+            if distance < steps or (max_steps is not None and distance > max_steps):
+                continue
+            entity = self._entities[entity_id]
+            if predicate(entity) and (best is None or (distance, entity_id) < best[0]):
+                best = ((distance, entity_id), entity)
+        return best[1] if best is not None else None
+
+    def nearest_hostile(self, entity: Entity, max_feet: Optional[int] = None) -> Optional[Entity]:
+        return self.nearest(entity.battle_data.location, lambda other: is_hostile(entity, other), max_feet)
+
+    def enemy_in_melee_range(self, entity: Entity) -> bool:
+        position = self._positions.get(entity.battle_data.entity_id)
+        if position is None:
+            return False
+        return any(is_hostile(entity, other) for other in self._around(position, self.melee_reach // FEET_PER_HEX))
+
+    def update_melee_flags(self, position: Tuple[int, int]):
+        """
+        Recompute enemy_in_melee_range of every entity that can reach the given hex in melee.
+        """
+        for entity in list(self._around(position, self.melee_reach // FEET_PER_HEX)):
+            entity.battle_data.enemy_in_melee_range = self.enemy_in_melee_range(entity)
+
+    def refresh(self, entity: Entity):
+        """
+        Update enemy_in_melee_range around an entity after its state (e.g. going down) changed.
+        """
+        position = self._positions.get(entity.battle_data.entity_id)
+        if position is not None:
+            self.update_melee_flags(position)
@@ -0,0 +1,133 @@
+from dataclasses import dataclass
+from itertools import chain
+from typing import Callable, Dict, Iterable, List, Optional
+
+from _game.base.environment import Location
+from _game.entities.base.action import Action, ActionType, WeaponAttackAction
+from _game.entities.base.entity import Entity
+from _game.mechanics.attack_odds import AttackOdds, area_attack_odds, attack_odds
+
+
+@dataclass
+class ActionSuggestion:
+    """
+    One action against one target, scored by its exact odds.
+    Area attacks are aimed at the location of the target and scored over every entity caught.
+
+    :param action: Unprimed action as returned by get_actions / get_bonus_actions
+    :param target_id: Entity ID of the target
+    :param attack_distance: Distance between source and target
+    :param odds: Exact outcome of the attack against the target
+    :param expected_damage: Expected damage without overkill, summed over the caught targets of area attacks
+    :param kill_probability: Probability to drop the target to 0 hit points
+    :param score: Ranking score, expected_damage * (1 + kill_probability) summed over the caught targets,
+        minus the same for caught entities that are no target
+    :param caught: Entity IDs caught by area attacks
+    """
+    action: Action
+    target_id: int
+    attack_distance: int
+    odds: AttackOdds
+    expected_damage: float
+    kill_probability: float
+    score: float
+    caught: Optional[List[int]] = None
+
+    def description(self) -> str:
+        caught = f" Caught: {', '.join(f'ID{i}' for i in self.caught)}," if self.caught is not None else ""
+        return (f"{'Bonus: ' if self.action.bonus_action else ''}{self.action.description_prior()} "
+                f"-> ID{self.target_id},{caught} {self.odds.description()}, "
+                f"Effective Damage: {self.expected_damage:.1f}, "
+                f"Kill: {self.kill_probability:.0%}")
+
+
+def _area_odds(action: WeaponAttackAction, entity: Entity) -> AttackOdds:
+    save_ability = action.area_of_effect.save_ability
+    return area_attack_odds(action,
+                            save_modifier=entity.ability_scores[save_ability].modifier if save_ability else 0,
+                            resistances=entity.damage_resistances,
+                            immunities=entity.damage_immunity)
+
+
+def rank_actions(source: Entity,
+                 actions: Iterable[Dict[ActionType, List[Action]]],
+                 targets: Iterable[Entity],
+                 distances: Optional[Dict[int, Optional[int]]] = None,
+                 line_of_sight: Optional[Dict[int, bool]] = None,
+                 area_targets: Optional[Callable[[WeaponAttackAction, Location], Optional[List[Entity]]]] = None
+                 ) -> List[ActionSuggestion]:
+    """
+    Score every weapon attack against every target and rank them, best first.
+    Odds are cached per action signature and AC, so a ranking costs a few lookups per (action, target) pair.
+    Area attacks are aimed at each target location and score the damage to everyone caught after saving throws,
+    caught entities that are no target, e.g. the source itself, count against the score.
+
+    :param source: Entity taking the actions
+    :param actions: Action dicts as returned by get_actions / get_bonus_actions
+    :param targets: Possible targets
+    :param distances: Entity ID: distance to the source, computed from the locations if not given
+    :param line_of_sight: Entity ID: whether the source sees the target, all are in sight if not given
+    :param area_targets: Entities caught by an area attack aimed at a location, None if it cannot be aimed there.
+        Area attacks are left out if not given.
+    :return: Suggestions sorted by descending score
+    """
+    attacks = [a for a in chain.from_iterable(chain.from_iterable(d.values() for d in actions))
+               if isinstance(a, WeaponAttackAction) and (a.area_of_effect is None or area_targets is not None)]
+
+    targets = list(targets)
+    target_ids = {target.battle_data.entity_id for target in targets}
+    suggestions = []
+    for target in targets:
+        if distances is not None:
+            distance = distances[target.battle_data.entity_id]
+        elif target.battle_data.location is not None and source.battle_data.location is not None:
+            distance = target.battle_data.location.distance(source.battle_data.location)
+        else:
+            distance = None
+        hit_points = target.hit_points.current
+        for action in attacks:
+            caught = None
+            if action.area_of_effect is not None:
+                caught = area_targets(action, target.battle_data.location) \
+                    if target.battle_data.location is not None else None
+                if caught is None:
+                    continue
+                odds = _area_odds(action, target)
+            else:
+                odds = attack_odds(action,
+                                   armor_class=target.armor_class,
+                                   resistances=target.damage_resistances,
+                                   immunities=target.damage_immunity,
+                                   attack_distance=distance,
+                                   line_of_sight=line_of_sight is None or line_of_sight[target.battle_data.entity_id])
+            expected_damage = odds.effective_damage(hit_points)
+            kill_probability = odds.kill_probability(hit_points)
+            score = expected_damage * (1 + kill_probability)
+
+            if caught is not None:
+                # Walls may shelter the target itself, only the caught entities count.
+                expected_damage, score = 0.0, 0.0
+                for entity in caught:
+                    caught_odds = _area_odds(action, entity)
+                    caught_damage = caught_odds.effective_damage(entity.hit_points.current)
+                    caught_score = caught_damage * (1 + caught_odds.kill_probability(entity.hit_points.current))
+                    if entity.battle_data.entity_id in target_ids:
+                        expected_damage += caught_damage
+                        score += caught_score
+                    elif not entity.hit_points.dead and entity.hit_points.current > 0:
+                        score -= caught_score
+                if target not in caught:
+                    kill_probability = 0.0
+            suggestions.append(ActionSuggestion(
+                action=action,
+                target_id=target.battle_data.entity_id,
+                attack_distance=distance,
+                odds=odds,
+                expected_damage=expected_damage,
+                kill_probability=kill_probability,
+                score=score,
+                caught=None if caught is None else [entity.battle_data.entity_id for entity in caught]
+            ))
+
+    suggestions.sort(key=lambda s: s.score, reverse=True)
+    return suggestions
@@ -0,0 +1,149 @@
+from contextlib import contextmanager
+from typing import Dict, List
+
+from _game.base.functionality import BattleRng
+from _game.mechanics.replay import JournalEntry, replay_journal
+from _game.mechanics.snapshot import dump_snapshot, load_snapshot
+
+
+class UndoHistory:
+    """
+    Undo and redo of a Battletracker along its journal.
+
+    Every checkpoint_every entries an in-memory checkpoint is taken, a snapshot without the journal.
+    Undoing loads the closest checkpoint before the target, shares the journal entries up to it and replays
+    the few entries after it, so undo costs one small load and at most checkpoint_every replayed entries.
+    Redoing replays the undone entries, with their recorded random streams the results are the same.
+
+    :param checkpoint_every: Journal entries between two checkpoints
+    :param max_checkpoints: Checkpoints kept in memory, the oldest are dropped first
+    """
+    def __init__(self, checkpoint_every: int = 25, max_checkpoints: int = 40):
+        if checkpoint_every < 1:
+            raise ValueError(f"Checkpoints must be at least one entry apart.\n"
+                             f"Delivered: {checkpoint_every!r}")
+        self.checkpoint_every = checkpoint_every
+        self.max_checkpoints = max_checkpoints
+        # Journal length: snapshot, in ascending order
+        self._checkpoints: Dict[int, bytes] = {}
+        # Journal length at the last checkpoint, taken or failed
+        self._last_attempt = 0
+        # Journal lengths the undo steps start at
+        self._steps: List[int] = []
+        # Entries of the undone steps, the next step to redo last
+        self._redo: List[List[JournalEntry]] = []
+        self._group_depth = 0
+        self._group_started = False
+        self._redoing = False
+
+    @property
+    def undo_steps(self) -> int:
+        return len(self._steps)
+
+    @property
+    def redo_steps(self) -> int:
+        return len(self._redo)
+
+    @contextmanager
+    def step(self):
+        """
+        Entries journaled within form a single undo step, e.g. all actions of one execution.
+        """
+        if self._group_depth == 0:
+            self._group_started = False
+        self._group_depth += 1
+        try:
+            yield
+        finally:
+            self._group_depth -= 1
+
+    def record(self, bt, index: int):
+        """
+        Register the journal entry at index, called by the Battletracker once the entry is journaled.
+        """
+        if not self._redoing:
+            self._redo.clear()
+        if self._group_depth == 0 or not self._group_started:
+            self._steps.append(index)
+            self._group_started = self._group_depth > 0
+        if index + 1 - self._last_attempt >= self.checkpoint_every:
+            self.checkpoint(bt)
+
+    def checkpoint(self, bt):
+        length = len(bt.battle_journal)
+        self._last_attempt = length
+        try:
+            self._checkpoints[length] = dump_snapshot(bt, journal=False, level=1)
+        except ValueError:
+            # Battles with entities of custom templates cannot be stored, undo replays from an earlier checkpoint.
+            return
+        if len(self._checkpoints) > self.max_checkpoints:
+            while len(self._checkpoints) > self.max_checkpoints:
+                del self._checkpoints[next(iter(self._checkpoints))]
+            # Steps before the oldest checkpoint are not undone, that would replay the battle from its start.
+            oldest = next(iter(self._checkpoints))
+            self._steps = [step for step in self._steps if step >= oldest]
+
+    def undo(self, bt, steps: int = 1):
+        """
+        Battletracker with the last steps undone, rebuilt aside, bt itself is left unchanged.
+        The history only changes once the rebuild succeeded.
+
+        :return: The rebuilt Battletracker, None if there is nothing to undo
+        """
+        steps = min(steps, len(self._steps))
+        if steps < 1:
+            return None
+        bounds = self._steps[-steps:] + [len(bt.battle_journal)]
+        rebuilt = self._rebuild(bt, bounds[0])
+
+        for start, end in reversed(list(zip(bounds, bounds[1:]))):
+            self._redo.append(bt.battle_journal[start:end])
+        del self._steps[-steps:]
+        self._drop_checkpoints_after(bounds[0])
+        return rebuilt
+
+    def redo(self, bt, steps: int = 1) -> int:
+        """
+        Replay the next undone steps on bt. A step that fails is rolled back and stays to be redone.
+
+        :return: Number of redone steps
+        """
+        redone = 0
+        self._redoing = True
+        try:
+            while redone < steps and self._redo:
+                length = len(bt.battle_journal)
+                try:
+                    with self.step():
+                        replay_journal(bt, self._redo[-1])
+                except Exception:
+                    if len(bt.battle_journal) > length:
+                        rebuilt = self._rebuild(bt, length)
+                        self._steps = [step for step in self._steps if step < length]
+                        self._drop_checkpoints_after(length)
+                        bt._take_state(rebuilt)
+                    raise
+                self._redo.pop()
+                redone += 1
+        finally:
+            self._redoing = False
+        return redone
+
+    def _drop_checkpoints_after(self, length: int):
+        for checkpoint in [checkpoint for checkpoint in self._checkpoints if checkpoint > length]:
+            del self._checkpoints[checkpoint]
+        self._last_attempt = min(self._last_attempt, length)
+
+    def _rebuild(self, bt, length: int):
+        base = max((checkpoint for checkpoint in self._checkpoints if checkpoint <= length), default=None)
+
+        rebuilt = bt.__class__(rng=BattleRng(bt.rng.seed, bt.rng.spawn_key))
+        rebuilt.undo_history = None
+        if base is not None:
+            load_snapshot(rebuilt, self._checkpoints[base], journal=bt.battle_journal[:base])
+        else:
+            # No checkpoint up to the target (yet), the journal is replayed from the start.
+            base = 0
+        replay_journal(rebuilt, bt.battle_journal[base:length])
+        return rebuilt
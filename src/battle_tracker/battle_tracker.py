@@ -1,16 +1,35 @@
 import streamlit as st
 from itertools import chain
-from copy import deepcopy, copy
+import os
+import shutil
+import time
+import uuid
+import numpy as np
 
 from _game.base.environment import LocationMetric, Location
-from _game.base.weapons import Weapons
-from _game.entities.base.action import Action, ActionType
+from _game.base.modifiers import Effect
+from _game.base.stats_abilities_and_settings import Abilities, DamageType, EffectStat
+from _game.base.weapons import BaseWeapon, Weapons
+from _game.entities.base.action import Action, ActionType, TargetType, WeaponAttackAction
 from _game.entities.base.entity import Entity
 from _game.entities.entities.monsters import PredefinedMonsters
-from _game.base.functionality import roll_dice
+from _game.base.functionality import compile_dice_notation, roll_dice, roll_dice_batch
+from _game.base.probability import get_dice_distribution
+from _game.mechanics.attack_odds import attack_odds
 from _game.mechanics.battle_tracker import Battletracker
 
 
+AUTOSAVE_DIRECTORY = "autosave"  # Every session autosaves into a directory of its own in here
+
+
+def autosaved_battles(exclude: str) -> list:
+    if not os.path.isdir(AUTOSAVE_DIRECTORY):
+        return []
+    directories = [os.path.join(AUTOSAVE_DIRECTORY, name) for name in sorted(os.listdir(AUTOSAVE_DIRECTORY),
+                                                                            reverse=True)]
+    return [d for d in directories if d != exclude and Battletracker.has_autosave(d)]
+
+
 def page_set_up_add_player(bt) -> Battletracker:
 
     st.subheader(f"Add Players: Build")
@@ -22,13 +41,14 @@ def page_set_up_add_enemy(bt) -> Battletracker:
 
     st.subheader(f"Add Enemies:")
     added_enemy_name = st.selectbox("Select Enemy:", list(PredefinedMonsters.get_monster()))
-    add_enemy: Entity = deepcopy(PredefinedMonsters.get_monster(race=added_enemy_name))
+    add_enemy: Entity = PredefinedMonsters.get_monster(race=added_enemy_name)
 
+    count = st.number_input("Number of Enemies:", min_value=1, value=1, step=1)
     cols = st.columns(2)
     if cols[0].button("Add Enemy Base Stats"):
-        bt.add_entity(add_enemy)
+        bt.add_entities(add_enemy, int(count))
     if cols[1].button("Add Enemy Rolled Stats"):
-        bt.add_entity(add_enemy, roll_health=True)
+        bt.add_entities(add_enemy, int(count), roll_health=True)
 
     # Remove
     st.subheader(f"Remove Enemies:")
@@ -59,15 +79,42 @@ def page_set_up_alter(bt) -> Battletracker:
 
     weapon = st.selectbox(f"Select weapon:", list(Weapons.all_weapons.keys()))
     if st.button("Add Weapon to Enemy"):
-        enemy = bt.enemy[selected_enemy[0]]
-        enemy.add_weapon(weapon=Weapons.get_weapon(weapon))
+        bt.add_weapon(selected_enemy[0], weapon=Weapons.get_weapon(weapon))
 
     weapons = bt.enemy[selected_enemy[0]].weapons
     weapon_name = st.radio(f"Select weapon:", [(i, w.description_short) for i, w in enumerate(weapons)])
     if st.button("Remove Weapon", disabled=True if weapon_name is None else False):
-        enemy = bt.enemy[selected_enemy[0]]
         if weapon_name is not None:
-            del enemy.weapons[weapon_name[0]]
+            bt.drop_weapon(selected_enemy[0], weapons[weapon_name[0]])
+
+    # Effects
+    st.subheader(f"Effects:")
+    stat = st.selectbox(f"Select stat:", list(Abilities) + list(EffectStat), format_func=lambda s: s.name)
+    cols = st.columns(4)
+    if stat in (EffectStat.DAMAGE_RESISTANCE, EffectStat.DAMAGE_IMMUNITY):
+        value = cols[0].selectbox(f"Damage type:", list(DamageType), format_func=lambda d: d.name)
+    elif stat in (EffectStat.ADVANTAGE, EffectStat.DISADVANTAGE):
+        value = None
+    else:
+        value = int(cols[0].number_input(f"Value:", step=1, value=1))
+    source = cols[1].text_input(f"Source:")
+    stacking = cols[2].checkbox(f"Stacking")
+    rounds = int(cols[3].number_input(f"Rounds (0: permanent):", step=1, min_value=0, value=1))
+    if st.button("Add Effect"):
+        bt.add_effect(selected_enemy[0], Effect(
+            stat=stat,
+            value=value,
+            source=source,
+            stacking=stacking,
+            expires_round=bt.current_round_number + rounds if rounds else None,
+            expires_turn=max(bt.current_turn, 0)
+        ))
+
+    effects = bt.enemy[selected_enemy[0]].modifiers.effects
+    effect = st.radio(f"Select effect:", [(i, e.description()) for i, e in effects.items()])
+    if st.button("Remove Effect", disabled=True if effect is None else False):
+        if effect is not None:
+            bt.remove_effect(selected_enemy[0], effect[0])
 
     return bt
 
@@ -194,6 +241,10 @@ def page_battle(bt) -> Battletracker:
         st.sidebar.write(f"{turn}, {entity.description_short()}")
 
 
+    with st.expander("Suggested Actions"):
+        for suggestion in bt.suggest_actions(bt.current_entity)[:5]:
+            st.write(suggestion.description())
+
     # Main Selection
     st.markdown("### Action")
     col_actions, col_targets, col_execute = st.columns(3)
@@ -212,15 +263,37 @@ def page_battle(bt) -> Battletracker:
         if st.session_state.selected_action is None:
             target_selection = {}
         else:
-            target_selection = bt.get_targets(st.session_state.selected_action.allowed_target_types)
+            target_selection = bt.get_targets(st.session_state.selected_action.allowed_target_types,
+                                              st.session_state.selected_action)
         target_description = st.radio(f"Select Target", target_selection.keys())
         target_id = target_selection[target_description] if target_description is not None else None
 
+        if isinstance(st.session_state.selected_action, WeaponAttackAction) and target_id is not None \
+                and target_id[0] == TargetType.LOCATION:
+            try:
+                caught = bt.area_targets(st.session_state.selected_action, target_id[1])
+                st.caption(f"Caught: {', '.join(e.description_short() for e in caught) if caught else 'nobody'}")
+            except ValueError as e:
+                st.warning(str(e))
+        elif isinstance(st.session_state.selected_action, WeaponAttackAction) and target_id is not None:
+            target = bt.enemy[target_id[1]]
+            odds = attack_odds(
+                st.session_state.selected_action,
+                armor_class=target.armor_class,
+                resistances=target.damage_resistances,
+                immunities=target.damage_immunity,
+                attack_distance=bt.distance(current_entity, target)
+            )
+            st.caption(f"{odds.description()}, Kill: {odds.kill_probability(target.hit_points.current):.0%}")
+
         if st.button(f"Prime Action", disabled=True if st.session_state.selected_action is None else False):
             if st.session_state.selected_action is not None:
                 action: Action = st.session_state.selected_action
-                st.session_state.primed_actions = bt.prime_action(action, target_id)
-                st.session_state.executed_actions = None
+                try:
+                    st.session_state.primed_actions = bt.prime_action(action, target_id)
+                    st.session_state.executed_actions = None
+                except ValueError as e:
+                    st.warning(str(e))
 
     with col_execute:
 
@@ -256,7 +329,6 @@ def page_battle(bt) -> Battletracker:
     with col_actions:
         st.markdown("### Movement")
 
-        new_loc = copy(current_entity.battle_data.location)
         with st.container():
             st.markdown("""
                 <style>
@@ -270,11 +342,17 @@ def page_battle(bt) -> Battletracker:
             x_value = colx.number_input(label="X", step=1, label_visibility='hidden')
             y_value = coly.number_input(label="Y", step=1, label_visibility='hidden')
 
-            new_loc.x = x_value
-            new_loc.y = y_value
+            new_loc = Location(x=int(x_value), y=int(y_value), metric=current_entity.battle_data.location.metric)
 
-            st.write(f"Total: {current_entity.speed}, Minimal target location distance: "
-                     f"{abs(new_loc - current_entity.battle_data.location)}")
+            reachable = bt.reachable_hexes(current_entity)
+            st.write(f"Total: {current_entity.speed}, Remaining: {bt.remaining_movement(current_entity)}, "
+                     f"Reachable locations: {len(reachable)}, Minimal target location distance: "
+                     f"{new_loc.distance(current_entity.battle_data.location)}, "
+                     f"Movement cost: {reachable[new_loc] if new_loc in reachable else 'not reachable'}")
+
+        if st.button("Move", disabled=new_loc not in reachable):
+            bt.move_entity(current_entity, x=new_loc.x, y=new_loc.y)
+            st.write("Data Processed succesfully.")
 
         if st.button("Set New Location"):
             if new_loc:
@@ -289,21 +367,58 @@ def page_battle(bt) -> Battletracker:
     return bt
 
 def page_environment(bt) -> Battletracker:
-    for key in bt.environment._environment.keys():
-        st.write(key)
-        for weapon in bt.environment._environment[key]:
-            st.write(f"Weapon: {weapon.name}")
+    items = bt.environment.items
+    for location in items.locations:
+        st.write("No location" if location is None else location)
+        for item_id, item in items.at(location):
+            kind = "Weapon" if isinstance(item, BaseWeapon) else "Item"
+            st.write(f"{kind}: {getattr(item, 'name', item)} (#{item_id})")
+
+    st.markdown("### Map")
+    coordinates = bt.distances.coordinates
+    if len(coordinates):
+        (x0, y0), (x1, y1) = coordinates.min(axis=0) - 2, coordinates.max(axis=0) + 2
+        width, height = int(x1 - x0 + 1), int(y1 - y0 + 1)
+        hex_map = bt.environment.map
+        cost = hex_map.region("movement_cost", int(x0), int(y0), width, height)
+        symbols = np.full(cost.shape, ".")
+        symbols[cost > 1] = "~"
+        symbols[cost == 0] = "X"
+        symbols[hex_map.region("occupancy", int(x0), int(y0), width, height) > 0] = "o"
+        symbols[hex_map.region("wall", int(x0), int(y0), width, height)] = "#"
+        # Rows of the HEX_BASE_60 grid shift by half a hex per y, highest y on top.
+        rows = [" " * (height - 1 - j) + " ".join(symbols[:, j]) for j in range(height - 1, -1, -1)]
+        st.code("\n".join(rows))
+        st.caption(f"x {x0} to {x1}, y {y0} to {y1}. # wall, X impassable, ~ difficult, o occupied")
+
+    colx, coly, col_terrain = st.columns(3)
+    x_value = colx.number_input(label="X", step=1, key="terrain_x")
+    y_value = coly.number_input(label="Y", step=1, key="terrain_y")
+    terrain = col_terrain.selectbox("Terrain", ["Plain", "Difficult", "Impassable", "Wall"])
+    if st.button("Set Terrain"):
+        bt.set_wall(x=int(x_value), y=int(y_value), wall=terrain == "Wall")
+        bt.set_movement_cost(x=int(x_value), y=int(y_value),
+                             movement_cost={"Difficult": 2, "Impassable": None}.get(terrain, 1))
+        st.write("Data Processed succesfully.")
     return bt
 
 def page_battle_summary(bt) -> Battletracker:
 
+    event_log = bt.event_log
+
     st.subheader("Enemies")
-    for num, enemy in bt.enemy.items():
-        st.write(f"ID {num},  Enemy {enemy.description_short()}")
+    st.dataframe({
+        "ID": list(bt.enemy),
+        "Enemy": [enemy.description_short() for enemy in bt.enemy.values()],
+        "Damage dealt": [event_log.damage_dealt(num) for num in bt.enemy],
+        "Damage taken": [event_log.damage_taken(num) for num in bt.enemy],
+    })
 
     st.subheader("Past Actions")
-    for action in bt.battle_log_actions:
-        st.write(action.description_executed())
+    if event_log.rounds:
+        round_number = st.selectbox("Round:", ["All"] + event_log.rounds)
+        rows = None if round_number == "All" else event_log.rows_for_round(round_number)
+        st.dataframe(event_log.table(rows))
 
     st.write(bt.turn_order)
 
@@ -312,7 +427,11 @@ def page_battle_summary(bt) -> Battletracker:
 def main_battle_tracker():
 
     if 'battle_tracker' not in st.session_state:
-        st.session_state.battle_tracker = Battletracker()
+        st.session_state.autosave_directory = os.path.join(
+            AUTOSAVE_DIRECTORY, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}")
+        bt = Battletracker()
+        bt.enable_autosave(st.session_state.autosave_directory)
+        st.session_state.battle_tracker = bt
     bt = st.session_state.battle_tracker
 
     if 'selected_action' not in st.session_state:
@@ -324,6 +443,17 @@ def main_battle_tracker():
     if 'executed_actions' not in st.session_state:
         st.session_state.executed_actions = None
 
+    undo_column, redo_column = st.sidebar.columns(2)
+    if undo_column.button("Undo", disabled=not bt.can_undo) and bt.undo():
+        # Actions refer to the entities from before the undo.
+        st.session_state.selected_action = None
+        st.session_state.primed_actions = None
+        st.session_state.executed_actions = None
+    if redo_column.button("Redo", disabled=not bt.can_redo) and bt.redo():
+        st.session_state.selected_action = None
+        st.session_state.primed_actions = None
+        st.session_state.executed_actions = None
+
     # Page Selection
 
     pages = [
@@ -366,32 +496,67 @@ def main_battle_tracker():
     elif st.session_state.battle_tracker_page == "Store and Load":
         st.write("Following allows to store and load battle data in between sessions or for battle tracking purposes")
         st.write("")
-        # Button to select directory
-        if st.button('Load Battle Data'):
-            raise NotImplementedError()
-            # File uploader allowing multiple files (and directories in compatible browsers)
-            uploaded_files = st.file_uploader("Choose a folder", accept_multiple_files=True)
-
-            # Display selected files
-            if uploaded_files:
-                for uploaded_file in uploaded_files:
-                    st.write(f"File: {uploaded_file.race}, Size: {uploaded_file.size} bytes")
-                    print(f"File: {uploaded_file.race}, Size: {uploaded_file.size} bytes")
-                bt.load_battle_data(uploaded_files)
-
-        if st.button('Store Battle Data'):
-            raise NotImplementedError()
-            # bt.save_battle_data()
+        uploaded_file = st.file_uploader("Choose a battle snapshot", type=["btsnap"])
+        if st.button('Load Battle Data', disabled=uploaded_file is None):
+            try:
+                loaded = Battletracker.load_battle_data(uploaded_file)
+                bt.close_autosave()
+                bt = loaded
+                bt.enable_autosave(st.session_state.autosave_directory)
+                st.write(f"Loaded {len(bt.enemy)} entities, round {bt.get_current_round_number()}.")
+            except ValueError as e:
+                st.warning(str(e))
+
+        st.subheader("Autosaved Battles")
+        autosaves = autosaved_battles(exclude=st.session_state.autosave_directory)
+        autosave = st.selectbox("Autosave:", autosaves, format_func=os.path.basename)
+        recover_column, delete_column = st.columns(2)
+        if recover_column.button('Recover Battle', disabled=autosave is None):
+            try:
+                recovered = Battletracker.recover_battle(autosave)
+                bt.close_autosave()
+                bt = recovered
+                bt.enable_autosave(st.session_state.autosave_directory)
+                st.write(f"Recovered {len(bt.enemy)} entities, round {bt.get_current_round_number()}.")
+            except ValueError as e:
+                st.warning(str(e))
+        if delete_column.button('Delete Autosave', disabled=autosave is None):
+            shutil.rmtree(autosave)
+            st.write(f"Deleted {os.path.basename(autosave)}.")
+
+        snapshot = bt.save_battle_data()
+        st.download_button('Store Battle Data', data=snapshot, file_name="battle.btsnap")
+        st.caption(f"Snapshot size: {len(snapshot) / 1024:.1f} KB")
 
     elif st.session_state.battle_tracker_page == "Dice Roll":
         st.write("Independent Dice Rolls")
         input_take_damage = st.text_input("Roll:")
+        number_of_rolls = st.number_input("Number of Rolls:", min_value=1, value=1, step=1)
         if input_take_damage:
-            roll = roll_dice(input_take_damage)
-            st.write(roll.description())
-            st.write("")
+            try:
+                compile_dice_notation(input_take_damage)
+            except ValueError as e:
+                st.warning(str(e))
+                input_take_damage = ""
+        if input_take_damage:
+            if number_of_rolls == 1:
+                roll = roll_dice(input_take_damage)
+                st.write(roll.description())
+                st.write("")
 
-            st.write(roll)
+                st.write(roll)
+            else:
+                rolls = roll_dice_batch(input_take_damage, n=int(number_of_rolls))
+                st.write(rolls.description())
+                st.write(", ".join(str(total) for total in rolls.total_rolls[:100]))
+
+            distribution = get_dice_distribution(input_take_damage)
+            st.write(distribution.description())
+            at_least = st.number_input("Probability to roll at least:", value=distribution.percentile(50), step=1)
+            st.write(f"P(total >= {at_least}): {distribution.probability_at_least(int(at_least)):.2%}, "
+                     f"Percentiles 10/50/90: {distribution.percentile(10)} / "
+                     f"{distribution.percentile(50)} / {distribution.percentile(90)}")
+            st.bar_chart({"Probability": dict(zip(distribution.totals.tolist(), distribution.pmf.tolist()))})
 
 
     st.session_state.battle_tracker = bt
\ No newline at end of file